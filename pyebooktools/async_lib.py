@@ -0,0 +1,206 @@
+"""Asynchronous variants of the functions from `lib.py` that run external tools
+(pdfinfo, pdftotext, 7z, calibre's tools, ...).
+
+They are built on :func:`asyncio.create_subprocess_exec` so that a single event
+loop can keep many external tools running at the same time without needing a
+pool of Python processes. The number of concurrent processes of each tool is
+limited by a semaphore shared by all the event loops (and threads) of the
+process, see :func:`set_tool_limits`.
+
+The coroutines take the same arguments and return the same :class:`Result` as
+their synchronous counterparts in `lib.py`.
+"""
+import asyncio
+import os
+import shlex
+import signal
+import sys
+import threading
+
+from pyebooktools.configs import default_config as default_cfg
+from pyebooktools.lib import (METADATA_CACHE_NEGATIVE_TTL, METADATA_CACHE_TTL,
+                              Result, convert_result_from_shell_cmd,
+                              get_cached_metadata, get_fetch_metadata_cmd,
+                              set_cached_metadata)
+from pyebooktools.utils.logutils import init_log
+
+logger = init_log(__name__, __file__)
+
+# Maximum number of concurrent processes per tool (name of the executable);
+# 'default' applies to the tools not listed
+_tool_limits = dict(default_cfg.async_tool_limits)
+# Semaphore of each tool. They are shared by all the event loops of the process
+# (e.g. one per thread of the organize pipeline) so they can't be asyncio
+# primitives, which are bound to a single loop
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+# Seconds between two attempts at acquiring the semaphore of a tool
+_SEMAPHORE_POLL_INTERVAL = 0.05
+
+
+def _get_semaphore(tool):
+    with _semaphores_lock:
+        if tool not in _semaphores:
+            limit = _tool_limits.get(tool, _tool_limits['default'])
+            _semaphores[tool] = threading.BoundedSemaphore(limit)
+        return _semaphores[tool]
+
+
+# NOTE: the semaphore is polled instead of acquired in a thread of the loop's
+# executor: a cancelled task then never acquires it
+async def _acquire(semaphore):
+    while not semaphore.acquire(blocking=False):
+        await asyncio.sleep(_SEMAPHORE_POLL_INTERVAL)
+
+
+# Returns True if the event loops of the current thread can run subprocesses.
+# Before Python 3.8, the child watcher only works with an event loop of the
+# main thread
+def can_run_subprocesses():
+    return sys.version_info >= (3, 8) or \
+        threading.current_thread() is threading.main_thread()
+
+
+# Runs the command and returns its Result. If the task is cancelled (e.g. by
+# asyncio.wait_for() or when racing other tasks), the process is killed along
+# with its children (the tool is run in its own process group), otherwise the
+# children would keep the pipes open
+async def _run(cmd):
+    args = shlex.split(cmd)
+    semaphore = _get_semaphore(args[0])
+    await _acquire(semaphore)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        try:
+            stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            logger.debug(f'Cancelled, killing `{args[0]}`...')
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            raise
+    finally:
+        semaphore.release()
+    return convert_result_from_shell_cmd(
+        Result(stdout, stderr, process.returncode, args))
+
+
+def run_until_complete(coro):
+    # NOTE: asyncio.run() requires Python 3.7+
+    loop = asyncio.new_event_loop()
+    # Before Python 3.8, the child watcher is attached to the current loop of
+    # the main thread
+    attach_watcher = sys.version_info < (3, 8) and \
+        threading.current_thread() is threading.main_thread()
+    if attach_watcher:
+        asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        if attach_watcher:
+            asyncio.set_event_loop(None)
+        loop.close()
+
+
+# NOTE: the processes already running (or waiting) keep the previous limits
+def set_tool_limits(**limits):
+    # e.g. set_tool_limits(default=16, gs=2)
+    with _semaphores_lock:
+        _tool_limits.update(limits)
+        if 'default' in limits:
+            _semaphores.clear()
+        else:
+            for tool in limits:
+                _semaphores.pop(tool, None)
+
+
+async def djvutxt(input_file, output_file, pages=None):
+    page_opt = f'--page={pages} ' if pages else ''
+    return await _run(f'djvutxt {page_opt}"{input_file}" "{output_file}"')
+
+
+async def ebook_convert(input_file, output_file):
+    return await _run(f'ebook-convert "{input_file}" "{output_file}"')
+
+
+async def extract_archive(input_file, output_file):
+    return await _run(f'7z x -o "{output_file}" "{input_file}"')
+
+
+# See lib.fetch_metadata()
+async def fetch_metadata(isbn_sources, options='', cache=None,
+                         ttl=METADATA_CACHE_TTL,
+                         negative_ttl=METADATA_CACHE_NEGATIVE_TTL):
+    cmd = get_fetch_metadata_cmd(isbn_sources, options)
+    if cache is not None:
+        result = get_cached_metadata(cache, cmd)
+        if result is not None:
+            return result
+    logger.debug(f'Calling `{cmd}`')
+    result = await _run(cmd)
+    if cache is not None:
+        set_cached_metadata(cache, cmd, result, ttl, negative_ttl)
+    return result
+
+
+# Queries all the metadata sources at the same time (one `fetch-ebook-metadata`
+# per source) and returns (isbn_source, result) for the first source in
+# `isbn_sources` (i.e. by priority) that has metadata, or None. As soon as a
+# source has metadata, the queries of the sources with a lower priority are
+# cancelled
+async def race_fetch_metadata(isbn_sources, options='', **kwargs):
+    tasks = [asyncio.ensure_future(fetch_metadata(isbn_source, options,
+                                                  **kwargs))
+             for isbn_source in isbn_sources]
+    try:
+        for isbn_source, task in zip(isbn_sources, tasks):
+            try:
+                result = await task
+            except Exception as e:
+                logger.debug(f"Couldn't fetch metadata from '{isbn_source}': "
+                             f"{e!r}")
+                continue
+            if result.stdout:
+                return isbn_source, result
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Wait for the cancelled processes to be killed
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def get_ebook_metadata(file_path):
+    return await _run(f'ebook-meta "{file_path}"')
+
+
+async def gs(input_file, output_file):
+    return await _run(f'gs -o "{output_file}" -sDEVICE=pdfwrite '
+                      f'-dPDFSETTINGS=/prepress "{input_file}"')
+
+
+async def pdfinfo(file_path):
+    return await _run(f'pdfinfo "{file_path}"')
+
+
+async def pdftotext(input_file, output_file, first_page=None, last_page=None):
+    page_opts = f'-f {first_page} ' if first_page else ''
+    page_opts += f'-l {last_page} ' if last_page else ''
+    return await _run(f'pdftotext {page_opts}"{input_file}" "{output_file}"')
+
+
+async def tesseract_wrapper(input_file, output_file):
+    result = await _run(f'tesseract "{input_file}" stdout --psm 12')
+    with open(output_file, 'w') as f:
+        f.write(str(result.stdout))
+    # Like lib.tesseract_wrapper(), the text is only found in `output_file`
+    result.stdout = ''
+    return result
+
+
+async def test_archive(file_path):
+    return await _run(f'7z t "{file_path}"')
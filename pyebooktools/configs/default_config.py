@@ -63,7 +63,7 @@ keep_metadata = False
 
 # 1.2 Options related to extracting ISBNs from files and finding metadata by ISBN
 # ===============================================================================
-isbn_regex = '(?<![0-9])(-?9-?7[789]-?)?((-?[0-9]-?){9}[0-9xX])(?![0-9])'
+isbn_regex = '(?<![0-9])(-?9-?7[789]-?)?(-?[0-9](-{0,2}[0-9]){8}-?[0-9xX])(?![0-9])'
 isbn_blacklist_regex = '^(0123456789|([0-9xX])\\2{9})$'
 isbn_direct_grep_files = '^text/(plain|xml|html)$'
 isbn_ignored_files = '^(image/(gif|svg.+)|application/(x-shockwave-flash|CDFV2|vnd.ms-opentype|x-font-ttf|x-dosexec|vnd.ms-excel|x-java-applet)|audio/.+|video/.+)$'
@@ -71,9 +71,27 @@ isbn_grep_rf_scan_first = 400
 isbn_grep_rf_reverse_last = 50
 # False to disable the functionality or (first_lines,last_lines) to enable it
 isbn_grep_reorder_files = (isbn_grep_rf_scan_first, isbn_grep_rf_reverse_last)
+# Before converting a whole pdf or djvu document to text, only extract the
+# text of its first and last pages (first_pages,last_pages) or False to
+# disable the functionality
+isbn_extract_first_last_pages = (10, 5)
+# Stop searching the text of a file once this number of ISBNs are found (0 to
+# always search the whole text)
+isbn_stop_after = 0
+# Number of threads used for searching the files extracted from an archive
+# (e.g. epub) for ISBNs. The most likely files (OPF, copyright page, ...) are
+# searched first and the search stops at the first file with ISBNs
+isbn_archive_scan_workers = 4
+# Maximum disk space (in MiB) used at the same time for decompressing the
+# files of an archive that are not text (e.g. a pdf in a rar) before searching
+# them. The text files are searched as they are decompressed
+isbn_archive_scratch_limit = 512
 # NOTE: If you use Calibre versions that are older than 2.84, it's required to
 # manually set the following option to an empty string
 isbn_metadata_fetch_order = ['Goodreads', 'Amazon.com', 'Google', 'ISBNDB', 'WorldCat xISBN', 'OZON.ru']
+# Query all the metadata sources at the same time instead of one after the
+# other (the order above is still used to choose the metadata)
+isbn_metadata_fetch_race = False
 
 # 1.3 Options for OCR
 # ===================
@@ -104,6 +122,10 @@ eviction_policy = 'least-recently-stored'
 # In gigabytes (GB)
 cache_size_limit = 1
 clear_cache = False
+# Number of seconds the metadata fetched online is kept in the cache and, when
+# nothing was found, before trying again the same query
+metadata_cache_ttl = 30 * 24 * 3600
+metadata_cache_negative_ttl = 6 * 3600
 
 # 1.7 Miscellaneous options
 # =========================
@@ -111,6 +133,15 @@ logging_level = 'info'
 logging_formatter = 'only_msg'
 # Reverse sort
 reverse = False
+# The files are processed while their folder is being scanned and are sorted by
+# name (see `reverse`) within consecutive windows of `sort_window` files, i.e.
+# the whole folder is never loaded in memory. 0 to disable the sorting
+sort_window = 1000
+# Maximum number of processes of each external tool that can run at the same
+# time when using the asyncio versions of the tools (see async_lib.py).
+# 'default' is used for the tools that are not listed
+async_tool_limits = {'default': 8, 'ebook-convert': 2,
+                     'fetch-ebook-metadata': 4, 'gs': 2, 'tesseract': 2}
 
 # ==================
 # 2. Command options
@@ -123,6 +154,8 @@ reverse = False
 input_file = None
 output_file = 'output.txt'
 djvu_convert_method = 'djvutxt'
+# epubtxt: extract the text in-process, in the order of the OPF spine
+# calibre: convert the epub with calibre's `ebook-convert`
 epub_convert_method = 'calibre'
 msword_convert_method = 'textutil'
 pdf_convert_method = 'pdftotext'
@@ -142,6 +175,14 @@ cfg_type = 'main'
 # extracting ISBNs from files, see section 1.2 above)
 input_data = None
 isbn_ret_separator = '\n'
+# Also find the ISSNs, DOIs and ASINs (in the same pass as the ISBNs)
+identifiers = False
+# Number of worker processes used for searching many files (folders, several
+# paths or `input_null`) for ISBNs. One JSON line is printed per file
+find_jobs = 1
+# Read the NUL-delimited paths of the files to search from stdin (e.g.
+# `find . -print0 | ebooktools find -0`)
+input_null = False
 
 # 2.4 fix_ebooks
 # ==============
@@ -177,7 +218,22 @@ organize = {
     'corruption_check_only': False,
     'corruption_check_method': 'pdfinfo',  # pdftotext
     'corruption_check_order': [],  # TODO: urgent, remove
+    # Number of worker processes used for organizing files in parallel
+    # NOTE: the ISBNs already looked up are not shared between the workers, see
+    # `use_cache`
+    'jobs': 1,
+    # Path of the SQLite journal where the outcome of each file is saved. With
+    # `resume`, the files already in the journal (same path, size and
+    # modification time) are skipped
+    'journal': None,
+    'resume': False,
     'tested_archive_extensions': '^(7z|bz2|chm|arj|cab|gz|tgz|gzip|zip|rar|xz|tar|epub|docx|odt|ods|cbr|cbz|maff|iso)$',
+    # How the zip archives (epub, docx, cbz, ...) with a tested extension are
+    # checked: 'quick' (central directory and local headers only), 'crc' (also
+    # decompress each file and check its CRC) or '7z' (with `7z t`)
+    'zip_check_method': 'crc',
+    # Number of threads used for checking the CRCs of the files of a zip
+    'zip_check_workers': 4,
     'organize_without_isbn': False,
     'without_isbn_ignore': get_without_isbn_ignore(),
     # TODO: why '?' in pptx, see https://bit.ly/2ryWlgt
@@ -185,6 +241,21 @@ organize = {
     'pamphlet_excluded_files': '\.(chm|epub|cbr|cbz|mobi|lit|pdb)$',
     'pamphlet_max_pdf_pages': 50,
     'pamphlet_max_filesize_kib': 250,
+    # Organize the files with a pipeline of stages connected by queues instead
+    # of one file at a time. Each stage has its own number of worker threads:
+    # (corruption check, ISBN search, metadata fetch, move)
+    'pipeline': False,
+    'pipeline_workers': (2, 4, 8, 1),
+    # Maximum number of files waiting in the queue of each stage
+    'pipeline_queue_size': 8,
+    # Keep watching the folder after organizing it and organize the new files
+    # as soon as they are written (Linux only, uses inotify)
+    'watch': False,
+    # Number of seconds a new file must stay unmodified before being organized
+    'watch_debounce': 5,
+    # New files whose lowercase names match this regex are not organized (e.g.
+    # incomplete downloads)
+    'watch_ignored_files': '\\.(part|crdownload|download|tmp)$',
 
     # 2.6.2 Input and output options
     # ------------------------------
@@ -17,35 +17,80 @@ References
 .. _find-isbns.sh: https://github.com/na--/ebook-tools/blob/master/find-isbns.sh
 .. _na--: https://github.com/na--
 """
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from pyebooktools.configs import default_config as default_cfg
-from pyebooktools.lib import find_isbns, search_file_for_isbns
-from pyebooktools.utils.logutils import init_log
+from pyebooktools.lib import (find_identifiers, find_identifiers_in_file,
+                              find_isbns, get_isbn_scanner, init_cache,
+                              search_file_for_isbns)
+from pyebooktools.utils.genutils import scan_files
+from pyebooktools.utils.logutils import (get_logging_levels, init_log,
+                                         set_logging_levels)
 
 logger = init_log(__name__, __file__)
 
+# Options of the files searched by the worker processes, see _init_worker()
+_worker_params = {}
+_worker_cache = None
 
-def find(input_data, isbn_blacklist_regex=default_cfg.isbn_blacklist_regex,
+
+def find(input_data, epub_convert_method=default_cfg.epub_convert_method,
+         find_jobs=default_cfg.find_jobs,
+         identifiers=default_cfg.identifiers,
+         input_null=default_cfg.input_null,
+         isbn_archive_scan_workers=default_cfg.isbn_archive_scan_workers,
+         isbn_archive_scratch_limit=default_cfg.isbn_archive_scratch_limit,
+         isbn_blacklist_regex=default_cfg.isbn_blacklist_regex,
          isbn_direct_grep_files=default_cfg.isbn_direct_grep_files,
+         isbn_extract_first_last_pages=default_cfg.isbn_extract_first_last_pages,
          isbn_grep_reorder_files=default_cfg.isbn_grep_reorder_files,
          isbn_grep_rf_reverse_last=default_cfg.isbn_grep_rf_reverse_last,
          isbn_grep_rf_scan_first=default_cfg.isbn_grep_rf_scan_first,
          isbn_ignored_files=default_cfg.isbn_ignored_files,
          isbn_regex=default_cfg.isbn_regex,
          isbn_ret_separator=default_cfg.isbn_ret_separator,
+         isbn_stop_after=default_cfg.isbn_stop_after,
          ocr_command=default_cfg.ocr_command,
          ocr_enabled=default_cfg.ocr_enabled,
          ocr_only_first_last_pages=default_cfg.ocr_only_first_last_pages,
-         **kwargs):
+         use_cache=default_cfg.use_cache, **kwargs):
     func_params = locals().copy()
+    # NOTE: a single path or string (e.g. when called from Python), the
+    # command-line gives a list
+    if input_data is None:
+        input_data = []
+    elif isinstance(input_data, (str, Path)):
+        input_data = [input_data]
+    if input_null or len(input_data) > 1 or \
+            any(Path(i).is_dir() for i in input_data if _is_path(i)):
+        return _find_in_files(_iter_input_files(input_data, input_null),
+                              func_params, kwargs)
+    if not input_data:
+        logger.error('No input data was given')
+        return 1
+    input_data = input_data[0]
+    func_params['input_data'] = input_data
+    if identifiers:
+        return _find_identifiers(input_data, func_params)
     # Check if input data is a file path or a string
     try:
         if Path(input_data).is_file():
             logger.debug(f'The input data is a file path')
             logger.info(f"Searching file '{Path(input_data).name}' for "
                         "ISBN numbers...")
-            isbns = search_file_for_isbns(input_data, **func_params)
+            cache = init_cache(**kwargs) if use_cache else None
+            try:
+                isbns = search_file_for_isbns(input_data, cache=cache,
+                                              **func_params)
+            finally:
+                if cache is not None:
+                    cache.close()
         else:
             logger.debug(f'The input data is a string')
             isbns = find_isbns(input_data, **func_params)
@@ -56,8 +101,176 @@ def find(input_data, isbn_blacklist_regex=default_cfg.isbn_blacklist_regex,
             isbns = find_isbns(input_data, **func_params)
         else:
             raise e
+    scanner = get_isbn_scanner(isbn_blacklist_regex, isbn_regex)
+    logger.debug(f'Scanned {scanner.nb_chars} characters for ISBNs in '
+                 f'{scanner.elapsed:.3f} seconds ({scanner.throughput:.1f} '
+                 'MB/s)')
     if isbns:
         logger.info(f"Extracted ISBNs:\n{isbns}")
     else:
         logger.info("No ISBNs could be found!")
     return 0
+
+
+# Finds the ISBNs, ISSNs, DOIs and ASINs in the file or string
+def _find_identifiers(input_data, func_params):
+    try:
+        is_file = Path(input_data).is_file()
+    except OSError:
+        # e.g. a string too long to be a file name
+        is_file = False
+    if is_file:
+        logger.info(f"Searching file '{Path(input_data).name}' for "
+                    "identifiers...")
+        identifiers = find_identifiers_in_file(input_data, **func_params)
+    else:
+        logger.debug('The input data is a string')
+        identifiers = find_identifiers(input_data, **func_params)
+    isbns = [value for kind, value in identifiers if kind == 'isbn']
+    if identifiers:
+        logger.info('Extracted identifiers:\n' + '\n'.join(
+            f'{kind}: {value}' for kind, value in identifiers))
+    else:
+        logger.info("No identifiers could be found!")
+    if isbns:
+        logger.info("Extracted ISBNs:\n"
+                    f"{func_params['isbn_ret_separator'].join(isbns)}")
+    return 0
+
+
+def _is_path(input_data):
+    try:
+        Path(input_data).exists()
+    except (OSError, ValueError):
+        # e.g. a string too long to be a file name or with a NUL character
+        return False
+    return True
+
+
+# Yields the files given as arguments, those found in the folders given as
+# arguments (recursively) and the NUL-delimited paths read from stdin
+def _iter_input_files(input_data, input_null=False):
+    for input_path in input_data:
+        if not _is_path(input_path) or not Path(input_path).exists():
+            logger.warning(f"Skipping '{input_path}': no such file or folder")
+        elif Path(input_path).is_dir():
+            yield from scan_files(input_path)
+        else:
+            yield Path(input_path)
+    if input_null:
+        # NOTE: the paths are read as they come so that the search can start
+        # before the whole list is written (e.g. by `find -print0`)
+        rest = b''
+        for chunk in iter(lambda: sys.stdin.buffer.read1(64 * 1024), b''):
+            paths = (rest + chunk).split(b'\0')
+            rest = paths.pop()
+            for path in paths:
+                if path:
+                    yield Path(os.fsdecode(path))
+        if rest.strip(b'\n'):
+            yield Path(os.fsdecode(rest.strip(b'\n')))
+
+
+# Searches the files for ISBNs (with `find_jobs` worker processes) and prints
+# one JSON line per file (in the same order as the files) with its path, the
+# ISBNs found, the step that found them (see search_file_for_isbns()) and the
+# time taken. With `identifiers`, the line also has the identifiers found (see
+# find_identifiers_in_file()) and the ISBNs are the ones among them
+def _find_in_files(files, func_params, cache_params):
+    params = {k: v for k, v in func_params.items()
+              if k not in ['input_data', 'kwargs']}
+    jobs = func_params['find_jobs']
+    cache_params = dict(cache_params)
+    if func_params['use_cache'] and not func_params['identifiers']:
+        # NOTE: the cache is cleared once, before the workers open it
+        cache = init_cache(**cache_params)
+        if cache is not None:
+            cache.close()
+        cache_params['clear_cache'] = False
+    else:
+        cache_params = None
+    nb_files = nb_files_with_isbns = 0
+
+    def print_result(result):
+        nonlocal nb_files, nb_files_with_isbns
+        nb_files += 1
+        nb_files_with_isbns += bool(result['isbns'])
+        print(json.dumps(result), flush=True)
+
+    if jobs == 1:
+        _init_worker(params, cache_params)
+        try:
+            for fp in files:
+                print_result(_search_file(fp))
+        finally:
+            _close_worker_cache()
+    else:
+        logger.debug(f'Searching files with {jobs} worker processes...')
+        # Maximum number of files submitted to the pool and not yet printed
+        max_pending = jobs * 4
+        pending = deque()
+        with ProcessPoolExecutor(
+                max_workers=jobs, initializer=_init_worker,
+                initargs=(params, cache_params, get_logging_levels())) \
+                as executor:
+            for fp in files:
+                pending.append(executor.submit(_search_file, fp))
+                if len(pending) >= max_pending:
+                    print_result(pending.popleft().result())
+            while pending:
+                print_result(pending.popleft().result())
+    logger.info(f'Found ISBNs in {nb_files_with_isbns} out of {nb_files} '
+                'files')
+    return 0
+
+
+def _init_worker(params, cache_params, logging_levels=None):
+    global _worker_cache
+    # NOTE: with the 'spawn' start method, the worker doesn't inherit the
+    # logging config
+    if logging_levels is not None:
+        set_logging_levels(logging_levels)
+    _worker_params.update(params)
+    if cache_params is not None:
+        _worker_cache = init_cache(**cache_params)
+
+
+def _close_worker_cache():
+    global _worker_cache
+    if _worker_cache is not None:
+        _worker_cache.close()
+        _worker_cache = None
+
+
+# Returns the result of the search of a file, printed as a JSON line by
+# _find_in_files()
+def _search_file(file_path):
+    search_info = {}
+    identifiers = None
+    start = time.monotonic()
+    try:
+        if _worker_params['identifiers']:
+            identifiers = find_identifiers_in_file(str(file_path),
+                                                   **_worker_params)
+            isbns = [value for kind, value in identifiers if kind == 'isbn']
+        else:
+            isbns = search_file_for_isbns(
+                str(file_path), cache=_worker_cache, search_info=search_info,
+                **_worker_params)
+            sep = _worker_params['isbn_ret_separator']
+            isbns = isbns.split(sep) if isbns else []
+        error = None
+    except Exception as e:
+        logger.debug(f"Couldn't search '{file_path}': {e!r}")
+        isbns = []
+        error = str(e)
+    result = {'path': str(file_path),
+              'isbns': isbns,
+              'step': search_info.get('step'),
+              'elapsed': round(time.monotonic() - start, 3)}
+    if identifiers is not None:
+        result['identifiers'] = [{'kind': kind, 'value': value}
+                                 for kind, value in identifiers]
+    if error:
+        result['error'] = error
+    return result
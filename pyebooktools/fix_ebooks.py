@@ -24,6 +24,7 @@ from pyebooktools.lib import (GREEN, NC, color_msg as c, check_input_data,
                               fail_file, fix_file_for_corruption,
                               get_parts_from_path as g, move_or_link_file,
                               remove_file, skip_file, unique_filename)
+from pyebooktools.utils.genutils import scan_files
 from pyebooktools.utils.logutils import init_log
 
 logger = init_log(__name__, __file__)
@@ -46,6 +47,7 @@ class FixEbooks:
         self.corruption_fix_order = default_cfg.fix['corruption_fix_order']
         self.dry_run = default_cfg.dry_run
         self.reverse = default_cfg.reverse
+        self.sort_window = default_cfg.sort_window
         self.symlink_only = default_cfg.symlink_only
         self.output_metadata_extension = default_cfg.output_metadata_extension
 
@@ -59,14 +61,16 @@ class FixEbooks:
             if code == 0:
                 logger.debug('File was successfully fixed!')
                 new_path_fixed = unique_filename(self.output_folder, file_path.name)
-                move_or_link_file(output_tmp_file, new_path_fixed, dry_run=False,
-                                  symlink_only=False)
+                new_path_fixed = move_or_link_file(
+                    output_tmp_file, new_path_fixed, dry_run=False,
+                    symlink_only=False)
                 fixed_file(file_path, new_path_fixed)
                 new_path_corrupted = unique_filename(
                     Path(self.output_folder_corrupt).joinpath('fixed'),
                     file_path.name)
-                move_or_link_file(file_path, new_path_corrupted, self.dry_run,
-                                  self.symlink_only)
+                new_path_corrupted = move_or_link_file(
+                    file_path, new_path_corrupted, self.dry_run,
+                    self.symlink_only)
                 # TODO: do we add the meta extension directly to new_path?
                 # TODO: important, add next in a func in lib (other places)
                 new_metadata_path = f'{new_path_corrupted}.{self.output_metadata_extension}'
@@ -88,8 +92,9 @@ class FixEbooks:
                         Path(self.output_folder_corrupt).joinpath('not_fixed'),
                         file_path.name)
                     if new_path != file_path:
-                        move_or_link_file(file_path, new_path, self.dry_run,
-                                          self.symlink_only)
+                        new_path = move_or_link_file(file_path, new_path,
+                                                     self.dry_run,
+                                                     self.symlink_only)
                     # TODO: do we add the meta extension directly to new_path?
                     new_metadata_path = f'{new_path}.{self.output_metadata_extension}'
                     logger.debug(f'Saving original filename to {new_metadata_path}...')
@@ -115,8 +120,9 @@ class FixEbooks:
                 ipdb.set_trace()
                 if self.output_folder_uncertain:
                     new_path_fixed = unique_filename(self.output_folder_uncertain, file_path.name)
-                    move_or_link_file(output_tmp_file, new_path_fixed, dry_run=False,
-                                      symlink_only=False)
+                    new_path_fixed = move_or_link_file(
+                        output_tmp_file, new_path_fixed, dry_run=False,
+                        symlink_only=False)
                 else:
                     # logger.debug('No uncertain folder specified, skipping...')
                     skip_file(file_path, 'No uncertain folder specified')
@@ -148,10 +154,25 @@ class FixEbooks:
         else:
             # TODO: important, use get_mime_type for each file found?
             # you can have a pdf file with the wrong ext?
-            files = [fp for fp in self.input_data.rglob('*.pdf')]
-            # TODO: important sort within glob?
-            logger.debug("Files sorted {}".format("in desc" if self.reverse else "in asc"))
-            files.sort(key=lambda x: x.name, reverse=self.reverse)
+            # NOTE: the files are fixed while the folder is being scanned, thus
+            # the output folders are not scanned in case they are within it
+            output_folders = {Path(folder).resolve() for folder in
+                              [self.output_folder, self.output_folder_corrupt,
+                               self.output_folder_uncertain] if folder}
+            if self.input_data.resolve() in output_folders:
+                # The fixed files would be found again by the scan
+                files = list(scan_files(self.input_data,
+                                        sort_window=self.sort_window,
+                                        reverse=self.reverse))
+            else:
+                files = scan_files(self.input_data,
+                                   excluded_folders=output_folders,
+                                   sort_window=self.sort_window,
+                                   reverse=self.reverse)
+            if self.sort_window > 0:
+                logger.debug("Files sorted {} within windows of {} files".format(
+                    "in desc" if self.reverse else "in asc", self.sort_window))
+            files = (fp for fp in files if fp.suffix == '.pdf')
         return files
 
     def fix(self, input_data, **kwargs):
@@ -164,8 +185,11 @@ class FixEbooks:
             return 0
         files = self._get_files()
         logger.debug('=====================================================')
-        _ = list(map(lambda fp: self._fix_file(fp), files))
-        if not files:
+        nb_files = 0
+        for fp in files:
+            self._fix_file(fp)
+            nb_files += 1
+        if not nb_files:
             if input_data.is_file():
                 logger.warning(f"{c('Not a pdf file:')} {input_data}")
             else:
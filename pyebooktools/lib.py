@@ -9,20 +9,36 @@ This is a Python port of `lib.sh`_ from `ebook-tools`_ written in Shell by
 .. _na--: https://github.com/na--
 """
 import ast
+import bz2
+import gzip
 import hashlib
+import logging
+import lzma
 import mimetypes
+import mmap
 import os
+import posixpath
 import re
 import shlex
 import shutil
 import string
+import struct
 import subprocess
+import tarfile
 import tempfile
-from lxml.etree import parse
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from lxml.etree import (HTMLParser, XMLParser, XMLSyntaxError, fromstring,
+                        parse)
 from pathlib import Path
+from urllib.parse import unquote
 
 from pyebooktools.configs import default_config as default_cfg
-from pyebooktools.utils.genutils import move
+from pyebooktools.utils.genutils import move_exclusive
 from pyebooktools.utils.logutils import init_log
 
 logger = init_log(__name__, __file__)
@@ -31,16 +47,26 @@ logger = init_log(__name__, __file__)
 # Default config values
 # =====================
 CACHE_FOLDER = default_cfg.cache_folder
+CACHE_SIZE_LIMIT = default_cfg.cache_size_limit
+CLEAR_CACHE = default_cfg.clear_cache
 DRY_RUN = default_cfg.dry_run
+EPUB_CONVERT_METHOD = default_cfg.epub_convert_method
+EVICTION_POLICY = default_cfg.eviction_policy
 KEEP_METADATA = default_cfg.keep_metadata
+METADATA_CACHE_NEGATIVE_TTL = default_cfg.metadata_cache_negative_ttl
+METADATA_CACHE_TTL = default_cfg.metadata_cache_ttl
+ISBN_ARCHIVE_SCAN_WORKERS = default_cfg.isbn_archive_scan_workers
+ISBN_ARCHIVE_SCRATCH_LIMIT = default_cfg.isbn_archive_scratch_limit
 ISBN_BLACKLIST_REGEX = default_cfg.isbn_blacklist_regex
 ISBN_DIRECT_GREP_FILES = default_cfg.isbn_direct_grep_files
+ISBN_EXTRACT_FIRST_LAST_PAGES = default_cfg.isbn_extract_first_last_pages
 ISBN_GREP_REORDER_FILES = default_cfg.isbn_grep_reorder_files
 ISBN_GREP_RF_REVERSE_LAST = default_cfg.isbn_grep_rf_reverse_last
 ISBN_GREP_RF_SCAN_FIRST = default_cfg.isbn_grep_rf_scan_first
 ISBN_IGNORED_FILES = default_cfg.isbn_ignored_files
 ISBN_REGEX = default_cfg.isbn_regex
 ISBN_RET_SEPARATOR = default_cfg.isbn_ret_separator
+ISBN_STOP_AFTER = default_cfg.isbn_stop_after
 OCR_COMMAND = default_cfg.ocr_command
 OCR_ENABLED = default_cfg.ocr_enabled
 OCR_ONLY_FIRST_LAST_PAGES = default_cfg.ocr_only_first_last_pages
@@ -49,6 +75,8 @@ OUTPUT_METADATA_EXTENSION = default_cfg.output_metadata_extension
 SYMLINK_ONLY = default_cfg.symlink_only
 TESTED_ARCHIVE_EXTENSIONS = default_cfg.organize['tested_archive_extensions']
 USE_CACHE = default_cfg.use_cache
+ZIP_CHECK_METHOD = default_cfg.organize['zip_check_method']
+ZIP_CHECK_WORKERS = default_cfg.organize['zip_check_workers']
 
 GREEN = '\033[0;36m'  # 32
 RED = '\033[0;31m'
@@ -58,6 +86,150 @@ VIOLET = '\033[0;35m'  #
 BOLD = '\033[1m'
 NC = '\033[0m'
 
+# Regexes of the identifiers found along with the ISBNs by find_identifiers()
+IDENTIFIER_REGEXES = {
+    'issn': '(?<![0-9-])[0-9]{4}-[0-9]{3}[0-9xX](?![0-9-])',
+    'doi': '(?<![0-9A-Za-z])10\\.[0-9]{4,9}/[-._;()/:A-Za-z0-9]+',
+    'asin': '(?<![0-9A-Za-z])B0[0-9A-Z]{8}(?![0-9A-Za-z])',
+}
+
+# Regexes of the names of the files from an archive (e.g. epub) by decreasing
+# likelihood of containing the book's ISBNs, see get_archive_member_priority()
+ARCHIVE_MEMBER_PRIORITIES = [
+    # The package document of an epub (dc:identifier)
+    '\\.opf$',
+    # Copyright, title and similar pages
+    '(^|/)[^/]*(copyright|title_?page|imprint|colophon|rights|legal)[^/]*'
+    '\\.(x?html?|xml|txt)$',
+    # Other text files
+    '\\.(x?html?|xml|txt|ncx|md|rtf)$',
+    # None: the files not matched by any regex (e.g. pdf, nested archives)
+    None,
+    # Images, fonts, stylesheets and media files
+    '\\.(jpe?g|png|gif|svg|bmp|tiff?|webp|ttf|otf|woff2?|css|mp3|mp4|ogg|'
+    'wav)$',
+]
+
+# Options that change the ISBNs found in the content of a file, see
+# get_isbns_cache_key()
+ISBNS_CACHE_OPTIONS = ['epub_convert_method', 'isbn_archive_scratch_limit',
+                       'isbn_blacklist_regex', 'isbn_direct_grep_files',
+                       'isbn_extract_first_last_pages',
+                       'isbn_grep_reorder_files', 'isbn_grep_rf_reverse_last',
+                       'isbn_grep_rf_scan_first', 'isbn_ignored_files',
+                       'isbn_regex', 'isbn_ret_separator', 'isbn_stop_after',
+                       'ocr_command', 'ocr_enabled',
+                       'ocr_only_first_last_pages']
+
+# Linear-time equivalents of the ISBN regexes used by older configs: with
+# `(-?[0-9]-?){9}`, the hyphens between two digits can be matched by either
+# group and the number of ways to (fail to) match a run of digits and hyphens
+# grows exponentially
+_LINEAR_ISBN_REGEXES = {
+    '(?<![0-9])(-?9-?7[789]-?)?((-?[0-9]-?){9}[0-9xX])(?![0-9])':
+        ISBN_REGEX,
+}
+# Deletes everything except numbers [0-9], 'x', and 'X'
+# NOTE: equivalent to UNIX command `tr -c -d '0-9xX'`
+_ISBN_DEL_CHARS = string.printable[10:].replace('x', '').replace('X', '')
+_ISBN_DEL_TABLE = str.maketrans('', '', _ISBN_DEL_CHARS)
+_ISBN_DEL_BYTES = _ISBN_DEL_CHARS.encode()
+_ISBN10_WEIGHTS = range(10, 0, -1)
+_ISBN13_WEIGHTS = (1, 3) * 6 + (1,)
+# (isbn_blacklist_regex, isbn_regex) -> ISBNScanner, see get_isbn_scanner()
+_isbn_scanners = {}
+# Size in bytes of the chunks of text searched for ISBNs, see
+# iter_buffer_regions(). The chunks are cut at the end of a line or after a
+# byte that can't be part of an ISBN. If there is none (a whole chunk of
+# digits), the chunk is extended until there is one
+_ISBN_CHUNK_SIZE = 1024 * 1024
+_ISBN_CHARS_BYTES = b'0123456789xX-'
+_ISBN_CHARS = frozenset(_ISBN_CHARS_BYTES)
+# Longest average line (in bytes) of the first and last lines of a file that
+# are searched first for ISBNs. Past it (e.g. minified HTML on a single line),
+# the first and last regions are byte windows of (number of lines) *
+# _REGION_LINE_BYTES bytes
+_REGION_LINE_BYTES = 1024
+# Maximum uncompressed size of a text file from an archive that is read in
+# memory (and searched in the order given by `isbn_grep_reorder_files`); bigger
+# files (or files whose size is unknown) are searched as they are decompressed
+_ARCHIVE_MEMBER_MAX_MEMORY = 64 * 1024 * 1024
+# Magic numbers of the single compressed files (e.g. book.pdf.gz) and the
+# functions used for reading them
+_COMPRESSED_FILE_OPENERS = [(b'\x1f\x8b', gzip.open), (b'BZh', bz2.open),
+                            (b'\xfd7zXZ\x00', lzma.open)]
+# Files from an archive that are never searched for ISBNs (e.g. the 'mimetype'
+# file of an epub)
+_ARCHIVE_IGNORED_MEMBERS = ['mimetype']
+# Size of the blocks written when decompressing a file from an archive in a
+# temporary folder
+_SCRATCH_BLOCK_SIZE = 64 * 1024
+# Local file header of a zip archive: signature, [version, flags, compression,
+# time, date, CRC, sizes], file name and extra field lengths
+_ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+_ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_ZIP_EOCD_SIGNATURE = b'PK\x05\x06'
+# Size of the blocks decompressed when checking the CRCs of a zip archive
+_ZIP_CHECK_BLOCK_SIZE = 1024 * 1024
+# Magic numbers of the file types that are checked against the file's
+# extension by triage_file_for_corruption(): (offset, magic number) with a None
+# offset for a magic number found within the first 1024 bytes
+_ZIP_SIGNATURES = [(0, _ZIP_LOCAL_HEADER_SIGNATURE),
+                   (0, _ZIP_EOCD_SIGNATURE)]
+_RAR_SIGNATURES = [(0, b'Rar!\x1a\x07')]
+_7Z_SIGNATURES = [(0, b"7z\xbc\xaf'\x1c")]
+_GZIP_SIGNATURES = [(0, b'\x1f\x8b')]
+_DJVU_SIGNATURES = [(0, b'AT&TFORM')]
+# Mobipocket and PalmDoc (TEXtREAd) files, and Topaz (TPZ0) files for azw
+_MOBI_SIGNATURES = [(60, b'BOOKMOBI'), (60, b'TEXtREAd')]
+_AZW_SIGNATURES = _MOBI_SIGNATURES + [(0, b'TPZ0')]
+# NOTE: comic book archives are often named after the wrong archive format
+# (e.g. a .cbr that is a zip), see _INCONCLUSIVE_SIGNATURE_EXTENSIONS
+_COMIC_SIGNATURES = _ZIP_SIGNATURES + _RAR_SIGNATURES + _7Z_SIGNATURES
+_FILE_SIGNATURES = {
+    '7z': _7Z_SIGNATURES,
+    'azw': _AZW_SIGNATURES,
+    'azw3': _AZW_SIGNATURES,
+    'bz2': [(0, b'BZh')],
+    'cb7': _COMIC_SIGNATURES,
+    'cbr': _COMIC_SIGNATURES,
+    'cbz': _COMIC_SIGNATURES,
+    'chm': [(0, b'ITSF')],
+    'djv': _DJVU_SIGNATURES,
+    'djvu': _DJVU_SIGNATURES,
+    'docx': _ZIP_SIGNATURES,
+    'epub': _ZIP_SIGNATURES,
+    'gz': _GZIP_SIGNATURES,
+    'gzip': _GZIP_SIGNATURES,
+    'maff': _ZIP_SIGNATURES,
+    'mobi': _MOBI_SIGNATURES,
+    'ods': _ZIP_SIGNATURES,
+    'odt': _ZIP_SIGNATURES,
+    'pdf': [(None, b'%PDF-')],
+    'rar': _RAR_SIGNATURES,
+    'tgz': _GZIP_SIGNATURES,
+    'xz': [(0, b'\xfd7zXZ\x00')],
+    'zip': _ZIP_SIGNATURES,
+}
+# Extensions whose magic numbers are not trusted enough to report a file
+# without any of them as corrupt: the file is left to the other checks (e.g.
+# `7z t`)
+_INCONCLUSIVE_SIGNATURE_EXTENSIONS = ['cb7', 'cbr', 'cbz']
+# The trailer of a pdf (startxref and %%EOF) should be within its last 1024
+# bytes but some pdfs have padding after %%EOF (e.g. \0 from a download), so it
+# is searched in their last 64 KiB. The end of central directory of a zip
+# archive must be within its last 64 KiB (the longest comment) + 22 bytes
+_PDF_TRAILER_WINDOW = 64 * 1024
+_ZIP_EOCD_WINDOW = 65535 + 22
+# Blocks compared with the content of a file by is_file_empty()
+_ZERO_BLOCK = bytes(64 * 1024)
+# Elements of the (x)html files of an epub whose text is not extracted and
+# elements whose text is put on its own lines, see epubtxt()
+_EPUB_SKIPPED_ELEMENTS = {'head', 'script', 'style'}
+_EPUB_BLOCK_ELEMENTS = {'address', 'blockquote', 'br', 'dd', 'div', 'dt',
+                        'figcaption', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+                        'li', 'p', 'pre', 'section', 'td', 'th', 'title', 'tr'}
+
 _COLOR_TO_CODE = {
     'g': GREEN,
     'r': RED,
@@ -86,6 +258,201 @@ class Result:
                f'returncode={self.returncode}, args={self.args}'
 
 
+# Finds the ISBNs in strings or bytes with regexes compiled once, see
+# find_isbns(). Bytes (e.g. the content of a file) are searched without being
+# decoded, only the matched candidates are.
+# `nb_chars` and `elapsed` are the totals of all the scanned strings
+class ISBNScanner:
+    def __init__(self, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+                 isbn_regex=ISBN_REGEX):
+        isbn_regex = _LINEAR_ISBN_REGEXES.get(isbn_regex, isbn_regex)
+        self.isbn_blacklist_regex = re.compile(isbn_blacklist_regex)
+        self.isbn_regex = re.compile(isbn_regex)
+        try:
+            self.isbn_bytes_regex = re.compile(isbn_regex.encode('ascii'))
+        except (UnicodeEncodeError, re.error):
+            # e.g. non-ASCII characters in the regex: the bytes are decoded
+            logger.debug('The ISBN regex can only be used on decoded text')
+            self.isbn_bytes_regex = None
+        # Regexes of all the identifiers, see find_identifiers_in_chunks()
+        self._identifiers_regex = None
+        self._identifiers_bytes_regex = None
+        self.nb_chars = 0
+        self.elapsed = 0.0
+
+    # Returns the unique valid (and not blacklisted) ISBNs found in the string
+    def find(self, input_str):
+        return self.find_in_chunks([input_str])
+
+    # Returns the unique valid ISBNs found in the chunks of text or bytes
+    # (searched in order). If `stop_after` is not 0, the search stops as soon
+    # as that many ISBNs are found, i.e. the following chunks are not even read
+    # if `chunks` is an iterator (see iter_file_regions())
+    # NOTE: only the first found form of an ISBN is returned, e.g.
+    # 9780306406157 is skipped if 0306406152 was found before it (see
+    # canonical_isbn())
+    def find_in_chunks(self, chunks, stop_after=0):
+        isbns = []
+        seen = set()
+        # Canonical ISBN -> first found form
+        found = {}
+        for chunk in chunks:
+            start = time.perf_counter()
+            for isbn in self._iter_isbns(chunk, seen, found):
+                isbns.append(isbn)
+                if len(isbns) == stop_after:
+                    break
+            self.nb_chars += len(chunk)
+            self.elapsed += time.perf_counter() - start
+            if stop_after and len(isbns) == stop_after:
+                logger.debug(f'Found {stop_after} ISBNs, stopping the search')
+                break
+        return isbns
+
+    # Returns the identifiers found in the chunks of text or bytes as (kind,
+    # value) tuples, e.g. ('doi', '10.1000/182'): the ISBNs (like
+    # find_in_chunks()) and the identifiers of IDENTIFIER_REGEXES. All of them
+    # are found in a single pass over the text
+    # NOTE: a DOI can contain the ISBN of a book (e.g. 10.1007/978-3-...), it
+    # is also searched for ISBNs
+    def find_identifiers_in_chunks(self, chunks):
+        if self._identifiers_regex is None:
+            self._compile_identifiers_regexes()
+        debug = logger.isEnabledFor(logging.DEBUG)
+        identifiers = []
+        seen = set()
+        found = {}
+        for chunk in chunks:
+            start = time.perf_counter()
+            if isinstance(chunk, str):
+                regex = self._identifiers_regex
+            elif self._identifiers_bytes_regex is None:
+                chunk = bytes(chunk).decode('utf-8', 'replace')
+                regex = self._identifiers_regex
+            else:
+                regex = self._identifiers_bytes_regex
+            for match in regex.finditer(chunk):
+                kind = match.lastgroup
+                value = match.group()
+                if not isinstance(value, str):
+                    value = value.decode('utf-8', 'replace')
+                if kind == 'isbn':
+                    isbn = value.translate(_ISBN_DEL_TABLE)
+                    if self._accept_isbn(isbn, seen, found, debug):
+                        identifiers.append((kind, isbn))
+                    continue
+                if kind == 'doi':
+                    value = _strip_doi(value)
+                    for isbn in self._iter_isbns(value, seen, found):
+                        identifiers.append(('isbn', isbn))
+                elif kind == 'issn' and not is_issn_valid(value):
+                    if debug:
+                        logger.debug(f'Invalid ISSN found: {value}')
+                    continue
+                # NOTE: DOIs are case-insensitive
+                key = (kind, value.upper())
+                if key not in seen:
+                    seen.add(key)
+                    if debug:
+                        logger.debug(f'Valid {kind.upper()} found: {value}')
+                    identifiers.append((kind, value))
+            self.nb_chars += len(chunk)
+            self.elapsed += time.perf_counter() - start
+        return identifiers
+
+    def _compile_identifiers_regexes(self):
+        regex = f'(?P<isbn>{self.isbn_regex.pattern})|' + '|'.join(
+            f'(?P<{kind}>{kind_regex})'
+            for kind, kind_regex in IDENTIFIER_REGEXES.items())
+        self._identifiers_regex = re.compile(regex)
+        if self.isbn_bytes_regex is not None:
+            self._identifiers_bytes_regex = re.compile(regex.encode('ascii'))
+
+    # Returns True if the ISBN is valid (and not blacklisted) and neither it
+    # is in `seen` nor its canonical form is in `found`
+    def _accept_isbn(self, isbn, seen, found, debug):
+        # Only keep unique ISBNs
+        if isbn in seen:
+            if debug:
+                logger.debug(f'Non-unique ISBN found: {isbn}')
+            return False
+        seen.add(isbn)
+        if not self.is_valid(isbn):
+            if debug:
+                logger.debug(f'Invalid ISBN found: {isbn}')
+            return False
+        if self.isbn_blacklist_regex.match(isbn):
+            if debug:
+                logger.debug(f'Wrong ISBN (blacklisted): {isbn}')
+            return False
+        key = canonical_isbn(isbn)
+        if key in found:
+            if debug:
+                logger.debug(f'Equivalent ISBN found: {isbn} (same book as '
+                             f'{found[key]})')
+            return False
+        found[key] = isbn
+        if debug:
+            logger.debug(f'Valid ISBN found: {isbn}')
+        return True
+
+    # Yields the valid ISBNs found in the string (or bytes) that are not in
+    # `seen` and whose canonical form is not in `found`
+    def _iter_isbns(self, input_str, seen, found):
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for isbn in self._iter_candidates(input_str):
+            if self._accept_isbn(isbn, seen, found, debug):
+                yield isbn
+
+    # Yields the matches of the ISBN regex without the characters that are not
+    # [0-9xX]
+    def _iter_candidates(self, input_str):
+        if not isinstance(input_str, str):
+            if self.isbn_bytes_regex is None:
+                input_str = bytes(input_str).decode('utf-8', 'replace')
+            else:
+                for match in self.isbn_bytes_regex.finditer(input_str):
+                    yield match.group().translate(
+                        None, _ISBN_DEL_BYTES).decode('utf-8', 'replace')
+                return
+        for match in self.isbn_regex.finditer(input_str):
+            yield match.group().translate(_ISBN_DEL_TABLE)
+
+    # Checksum of an ISBN that only consists of numbers and [xX], see
+    # is_isbn_valid() for any ISBN-like string
+    @staticmethod
+    def is_valid(isbn):
+        if len(isbn) == 10:
+            if isbn[9] in 'xX':
+                if not isbn[:9].isdigit():
+                    return False
+                isbn = isbn[:9] + ':'  # ord(':') - 48 = 10
+            elif not isbn.isdigit():
+                return False
+            return sum((ord(c) - 48) * w
+                       for c, w in zip(isbn, _ISBN10_WEIGHTS)) % 11 == 0
+        if len(isbn) == 13 and isbn.isdigit() and isbn[:3] in ('978', '979'):
+            return sum((ord(c) - 48) * w
+                       for c, w in zip(isbn, _ISBN13_WEIGHTS)) % 10 == 0
+        return False
+
+    # Throughput in MB (millions of characters) per second
+    @property
+    def throughput(self):
+        return self.nb_chars / 1e6 / self.elapsed if self.elapsed else 0.0
+
+
+# Returns the ISBN-13 of a valid ISBN-10 or ISBN-13 (only numbers and [xX]),
+# i.e. the same value for the two forms of the ISBN of a book, e.g.
+# 0306406152 and 9780306406157
+def canonical_isbn(isbn):
+    if len(isbn) != 10:
+        return isbn
+    isbn = '978' + isbn[:9]
+    check = sum((ord(c) - 48) * w for c, w in zip(isbn, _ISBN13_WEIGHTS))
+    return isbn + str(-check % 10)
+
+
 # TODO: important, test it on linux
 def catdoc(input_file, output_file):
     cmd = f'catdoc "{input_file}"'
@@ -100,17 +467,23 @@ def catdoc(input_file, output_file):
 
 # Checks the supplied file for different kinds of corruption:
 #  - If it's zero-sized or contains only \0
+#  - If its magic number doesn't match its extension, it's a zip archive
+#    without an end of central directory or a pdf without a trailer, see
+#    triage_file_for_corruption() (no external tool is called for these)
 #  - If it has a pdf extension but different mime type
 #  - If it's a pdf and `pdfinfo` returns an error
-#  - If it has an archive extension but `7z t` returns an error
+#  - If it has an archive extension but `7z t` returns an error (zip archives
+#    are checked with check_zip_integrity() unless `zip_check_method` is '7z')
 # ref.: https://bit.ly/2JLpqgf
 def check_file_for_corruption(
-        file_path, tested_archive_extensions=TESTED_ARCHIVE_EXTENSIONS):
+        file_path, tested_archive_extensions=TESTED_ARCHIVE_EXTENSIONS,
+        zip_check_method=ZIP_CHECK_METHOD,
+        zip_check_workers=ZIP_CHECK_WORKERS):
     file_err = ''
     logger.debug(f"Testing '{Path(file_path).name}' for corruption...")
     logger.debug(f"Full path: {file_path}")
 
-    # TODO: test that it is the same as
+    # Same as
     # if [[ "$(tr -d '\0' < "$file_path" | head -c 1)" == "" ]]; then
     # Ref.: https://bit.ly/2jpX0xf
     if is_file_empty(file_path):
@@ -119,10 +492,15 @@ def check_file_for_corruption(
         return file_err
 
     ext = Path(file_path).suffix[1:]  # Remove the dot from extension
+    file_err = triage_file_for_corruption(file_path, ext)
+    if file_err:
+        logger.debug(file_err)
+        return file_err
+
     mime_type = get_mime_type(file_path)
 
     if mime_type == 'application/octet-stream' and \
-            re.match('^(pdf|djv|djvu)$', mime_type):
+            re.match('^(pdf|djv|djvu)$', ext):
         file_err = f"The file has a {ext} extension but '{mime_type}' MIME type!"
         logger.debug(file_err)
         return file_err
@@ -152,16 +530,33 @@ def check_file_for_corruption(
                     return file_err
 
     if re.match(tested_archive_extensions, ext):
-        logger.debug(f"The file has a '{ext}' extension, testing with 7z...")
-        log = test_archive(file_path)
-        if log.stderr:
-            logger.debug('Test failed!')
-            logger.debug(log.stderr)
-            file_err = 'Looks like an archive, but testing it with 7z failed!'
-            return file_err
-        else:
-            logger.debug('Test succeeded!')
-            logger.debug(log.stdout)
+        zip_err = None
+        if zip_check_method != '7z' and zipfile.is_zipfile(file_path):
+            logger.debug(f"The file has a '{ext}' extension, checking the zip "
+                         f"archive ({zip_check_method})...")
+            zip_err = check_zip_integrity(
+                file_path, zip_check_method == 'crc', zip_check_workers)
+            if zip_err:
+                logger.debug(zip_err)
+                file_err = 'Looks like a zip archive, but checking it failed!'
+                return file_err
+            elif zip_err is None:
+                logger.debug("The zip archive couldn't be fully checked")
+            else:
+                logger.debug('Check succeeded!')
+        if zip_err is None:
+            logger.debug(f"The file has a '{ext}' extension, testing with "
+                         "7z...")
+            log = test_archive(file_path)
+            if log.stderr:
+                logger.debug('Test failed!')
+                logger.debug(log.stderr)
+                file_err = 'Looks like an archive, but testing it with 7z ' \
+                           'failed!'
+                return file_err
+            else:
+                logger.debug('Test succeeded!')
+                logger.debug(log.stdout)
 
     if file_err == '':
         logger.debug('Corruption not detected!')
@@ -171,6 +566,133 @@ def check_file_for_corruption(
     return file_err
 
 
+# Quick checks of the file's content that don't call any external tool.
+# Returns the error found if the file is obviously broken or '' otherwise
+# (also if its extension is not known, see _FILE_SIGNATURES, or if the checks
+# are inconclusive and the file is left to the external tools):
+#  - its magic number must match its extension (a comic book archive with none
+#    of the archive magic numbers is inconclusive)
+#  - a zip archive (epub, docx, cbz, ...) must have an end of central directory
+#  - a pdf must have a trailer (startxref or %%EOF) near its end, see
+#    _PDF_TRAILER_WINDOW (if only one of them is found, pdfinfo checks it)
+def triage_file_for_corruption(file_path, ext=None):
+    if ext is None:
+        ext = Path(file_path).suffix[1:]
+    ext = ext.lower()
+    signatures = _FILE_SIGNATURES.get(ext)
+    if not signatures or os.path.getsize(file_path) == 0:
+        return ''
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for offset, magic in signatures:
+            if offset is None:
+                if buf.find(magic, 0, 1024) >= 0:
+                    break
+            elif buf[offset:offset + len(magic)] == magic:
+                break
+        else:
+            if ext in _INCONCLUSIVE_SIGNATURE_EXTENSIONS:
+                logger.debug(f'The file has a {ext} extension but none of its '
+                             'magic numbers, leaving it to the other checks')
+                return ''
+            return f'The file has a {ext} extension but not its magic number!'
+        if ext == 'pdf':
+            start = max(0, len(buf) - _PDF_TRAILER_WINDOW)
+            has_startxref = buf.rfind(b'startxref', start) >= 0
+            has_eof = buf.rfind(b'%%EOF', start) >= 0
+            if not has_startxref and not has_eof:
+                return 'The pdf has no trailer (startxref and %%EOF), it is ' \
+                       'truncated!'
+            elif not has_startxref or not has_eof:
+                logger.debug('The pdf has only part of its trailer (startxref '
+                             f'and %%EOF) in its last {_PDF_TRAILER_WINDOW} '
+                             'bytes, it will be checked with pdfinfo')
+        elif (offset, magic) in _ZIP_SIGNATURES:
+            if buf.rfind(_ZIP_EOCD_SIGNATURE,
+                         max(0, len(buf) - _ZIP_EOCD_WINDOW)) < 0:
+                return 'The zip archive has no end of central directory, it ' \
+                       'is truncated!'
+    return ''
+
+
+# Checks a zip archive (epub, docx, cbz, ...) without calling `7z t`:
+#  - its central directory must be readable and each of its files must have a
+#    local header and data within the archive
+#  - if `crc_check` is True, each file is also decompressed (by `workers`
+#    threads) and its CRC is checked
+# Returns '' if the archive is OK, the error found otherwise or None if the
+# archive couldn't be fully checked (e.g. encrypted files or unsupported
+# compression methods)
+def check_zip_integrity(file_path, crc_check=True, workers=ZIP_CHECK_WORKERS):
+    try:
+        zf = zipfile.ZipFile(file_path)
+    except (zipfile.BadZipFile, OSError, ValueError) as e:
+        return f'The central directory is corrupt: {e}'
+    with zf:
+        infos = zf.infolist()
+        zip_err = _check_zip_local_headers(file_path, infos)
+        if zip_err or not crc_check:
+            return zip_err
+        infos = [info for info in infos if not info.is_dir()]
+        if not infos:
+            return ''
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(workers, len(infos)))) as executor:
+            futures = [executor.submit(_check_zip_member_crc, zf, info)
+                       for info in infos]
+            # The first corrupt file stops the check
+            _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+        results = []
+        for future in futures:
+            if future.cancelled():
+                continue
+            if future.exception() is not None:
+                return str(future.exception())
+            results.append(future.result())
+        return None if None in results else ''
+
+
+# Decompresses a file of the zip archive to check its CRC (zipfile raises
+# BadZipFile when it doesn't match). Returns '' if the file is OK or None if it
+# couldn't be checked, raises ValueError if it is corrupt
+def _check_zip_member_crc(zf, info):
+    try:
+        with zf.open(info) as f:
+            while f.read(_ZIP_CHECK_BLOCK_SIZE):
+                pass
+    except (NotImplementedError, RuntimeError) as e:
+        # Unsupported compression method or encrypted file
+        logger.debug(f"Couldn't check '{info.filename}': {e}")
+        return None
+    except (zipfile.BadZipFile, EOFError, OSError, lzma.LZMAError,
+            zlib.error) as e:
+        raise ValueError(f"'{info.filename}' is corrupt: {e}")
+    return ''
+
+
+# Checks that each file listed in the central directory of the zip archive has
+# a local header and that its data fits within the archive
+def _check_zip_local_headers(file_path, infos):
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        for info in infos:
+            data_start = info.header_offset + _ZIP_LOCAL_HEADER.size
+            if info.header_offset < 0 or data_start > file_size:
+                return f"'{info.filename}' starts past the end of the archive"
+            f.seek(info.header_offset)
+            signature, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack(
+                f.read(_ZIP_LOCAL_HEADER.size))
+            if signature != _ZIP_LOCAL_HEADER_SIGNATURE:
+                return f"'{info.filename}' has no local header"
+            data_end = data_start + name_length + extra_length + \
+                info.compress_size
+            if data_end > file_size:
+                return f"'{info.filename}' ends past the end of the archive"
+    return ''
+
+
 def check_input_data(input_data):
     input_data = Path(input_data)
     short_path = get_parts_from_path(input_data)
@@ -308,6 +830,55 @@ def get_hash(file_path):
     return file_hash.hexdigest()
 
 
+# Returns the result of the `fetch-ebook-metadata` command from the cache or
+# None if it is not cached, see fetch_metadata()
+def get_cached_metadata(cache, cmd):
+    result = cache.get(f'metadata:{cmd}')
+    if result is not None:
+        logger.debug(f'Found the result of `{cmd}` in the cache')
+    return result
+
+
+def get_fetch_metadata_cmd(isbn_sources, options=''):
+    cmd = f'fetch-ebook-metadata {options}'
+    if isinstance(isbn_sources, str):
+        isbn_sources = isbn_sources.split(',')
+    for isbn_source in isbn_sources:
+        cmd += f' --allowed-plugin={isbn_source} '
+    # Remove trailing whitespace
+    return cmd.strip()
+
+
+# Groups the equivalent ISBNs (the ISBN-10 and ISBN-13 of a book): returns a
+# dict mapping each canonical ISBN (see canonical_isbn()) to its forms in
+# `isbns`, in the order they were found
+def group_isbns(isbns):
+    groups = {}
+    for isbn in isbns:
+        groups.setdefault(canonical_isbn(isbn), []).append(isbn)
+    return groups
+
+
+# Returns the ISBNScanner for the given regexes (they are only compiled once
+# per process)
+def get_isbn_scanner(isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+                     isbn_regex=ISBN_REGEX):
+    key = (isbn_blacklist_regex, isbn_regex)
+    scanner = _isbn_scanners.get(key)
+    if scanner is None:
+        scanner = _isbn_scanners[key] = ISBNScanner(*key)
+    return scanner
+
+
+# Returns the key under which the ISBNs found in the content of the file are
+# cached: the hash of the file content and a fingerprint of the options used
+# for searching the ISBNs (see ISBNS_CACHE_OPTIONS)
+def get_isbns_cache_key(file_path, **kwargs):
+    options = repr([(k, kwargs.get(k)) for k in ISBNS_CACHE_OPTIONS])
+    fingerprint = hashlib.md5(options.encode('utf-8')).hexdigest()
+    return f'isbns:{get_hash(file_path)}:{fingerprint}'
+
+
 # Tries to convert the supplied ebook file into .txt. It uses calibre's
 # ebook-convert tool. For optimization, if present, it will use pdftotext
 # for pdfs, catdoc for word files and djvutxt for djvu files.
@@ -325,10 +896,14 @@ def convert_to_txt(input_file, output_file, mime_type,
                      'text')
         result = djvutxt(input_file, output_file)
     elif mime_type.startswith('application/epub+zip') \
-            and epub_convert_method == 'epubtxt' and command_exists('unzip'):
-        logger.debug('The file looks like an epub, using epub2txt to extract '
+            and epub_convert_method == 'epubtxt':
+        logger.debug('The file looks like an epub, using epubtxt to extract '
                      'the text')
         result = epubtxt(input_file, output_file)
+        if result.returncode != 0:
+            logger.debug(f"epubtxt couldn't extract the text: {result.stderr}")
+            logger.debug("Trying to use calibre's ebook-convert instead...")
+            result = ebook_convert(input_file, output_file)
     elif mime_type == 'application/msword' \
             and msword_convert_method in ['catdoc', 'textutil'] \
             and (command_exists('catdoc') or command_exists('textutil')):
@@ -357,27 +932,169 @@ def convert_to_txt(input_file, output_file, mime_type,
     return result
 
 
-def djvutxt(input_file, output_file):
+# Extracts the text of the first and last pages (see
+# `isbn_extract_first_last_pages`) of a pdf (with pdftotext) or djvu (with
+# djvutxt) document or of the first and last (x)html files of the spine of an
+# epub (with epubtxt). Returns None if the document is not supported or doesn't
+# have more pages than that, i.e. it should be converted whole with
+# convert_to_txt()
+def convert_pages_to_txt(
+        input_file, output_file, mime_type,
+        isbn_extract_first_last_pages=ISBN_EXTRACT_FIRST_LAST_PAGES,
+        djvu_convert_method=default_cfg.djvu_convert_method,
+        epub_convert_method=default_cfg.epub_convert_method,
+        pdf_convert_method=default_cfg.pdf_convert_method, **kwargs):
+    if not isbn_extract_first_last_pages:
+        return None
+    first_pages, last_pages = [int(i) for i in isbn_extract_first_last_pages]
+    if not first_pages and not last_pages:
+        return None
+    if mime_type.startswith('application/epub+zip') \
+            and epub_convert_method == 'epubtxt':
+        try:
+            with zipfile.ZipFile(input_file) as zf:
+                num_items = len(get_epub_spine(zf))
+        except (zipfile.BadZipFile, OSError):
+            return None
+        if not num_items or num_items <= first_pages + last_pages:
+            return None
+        logger.debug(f'Extracting the text of the first {first_pages} and '
+                     f'last {last_pages} files of the spine (out of '
+                     f'{num_items})')
+        return epubtxt(input_file, output_file, (first_pages, last_pages))
+    if mime_type.startswith('image/vnd.djvu') \
+            and djvu_convert_method == 'djvutxt' and command_exists('djvutxt') \
+            and command_exists('djvused'):
+        result = get_pages_in_djvu(input_file)
+        if result.returncode != 0:
+            return None
+        # NOTE: the output of djvused is already an int, see
+        # convert_result_from_shell_cmd()
+        num_pages = result.stdout
+    elif mime_type == 'application/pdf' and pdf_convert_method == 'pdftotext' \
+            and command_exists('pdftotext') and command_exists('pdfinfo'):
+        result = get_pages_in_pdf(input_file, cmd='pdfinfo')
+        if result.returncode != 0:
+            return None
+        num_pages = result.stdout
+    else:
+        return None
+    if num_pages <= first_pages + last_pages:
+        logger.debug(f'The document only has {num_pages} pages, it will be '
+                     'converted whole')
+        return None
+    page_ranges = [(1, first_pages),
+                   (num_pages - last_pages + 1, num_pages)]
+    page_ranges = [(first, last) for first, last in page_ranges
+                   if first <= last]
+    logger.debug(f'Extracting the text of the pages {page_ranges} (out of '
+                 f'{num_pages} pages)')
+    if mime_type.startswith('image/vnd.djvu'):
+        pages = ','.join(f'{first}-{last}' for first, last in page_ranges)
+        return djvutxt(input_file, output_file, pages)
+    # pdftotext can only extract one range of pages at a time
+    tmp_file_txt = tempfile.mkstemp(suffix='.txt')[1]
+    try:
+        with open(output_file, 'wb') as f:
+            for first, last in page_ranges:
+                result = pdftotext(input_file, tmp_file_txt, first, last)
+                if result.returncode != 0:
+                    break
+                with open(tmp_file_txt, 'rb') as f_tmp:
+                    shutil.copyfileobj(f_tmp, f)
+    finally:
+        remove_file(tmp_file_txt)
+    return result
+
+
+# `pages`: e.g. '1-10,95-100' to only extract the text of these pages
+def djvutxt(input_file, output_file, pages=None):
     # TODO: explain that you need to softlink djvutxt in /user/local/bin (or
     # add in $PATH?)
-    cmd = f'djvutxt "{input_file}" "{output_file}"'
+    cmd = 'djvutxt '
+    if pages:
+        cmd += f'--page={pages} '
+    cmd += f'"{input_file}" "{output_file}"'
     # TODO: use genutils.run_cmd() [fix problem with 3.<6] and in other places?
     args = shlex.split(cmd)
     result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return convert_result_from_shell_cmd(result)
 
 
-def epubtxt(input_file, output_file):
-    cmd = f'unzip -c "{input_file}"'
-    # TODO: use genutils.run_cmd() [fix problem with 3.<6] and in other places?
-    args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if not result.stderr:
-        text = str(result.stdout)
-        with open(output_file, 'w') as f:
-            f.write(text)
-        result.stdout = text
-    return convert_result_from_shell_cmd(result)
+# Extracts the text of the epub in the order of its spine (see
+# get_epub_spine()), without calling an external tool. The markup of each
+# (x)html file is stripped as it is decompressed. If `spine_items` is given as
+# (first_items,last_items), only the text of these files of the spine is
+# extracted.
+# NOTE: like tesseract_wrapper(), the text is only found in `output_file`
+def epubtxt(input_file, output_file, spine_items=None):
+    args = ['epubtxt', str(input_file)]
+    try:
+        with zipfile.ZipFile(input_file) as zf:
+            spine = get_epub_spine(zf)
+            if not spine:
+                return Result(stderr='No spine found in the epub',
+                              returncode=1, args=args)
+            if spine_items:
+                first_items, last_items = [int(i) for i in spine_items]
+                spine = spine[:first_items] + \
+                    spine[max(first_items, len(spine) - last_items):]
+            with open(output_file, 'w', encoding='utf-8') as f:
+                for name in spine:
+                    _extract_epub_item_text(zf, name, f.write)
+    except (zipfile.BadZipFile, NotImplementedError, RuntimeError, OSError,
+            zlib.error) as e:
+        return Result(stderr=str(e), returncode=1, args=args)
+    return Result(returncode=0, args=args)
+
+
+def _extract_epub_item_text(zf, name, write):
+    # NOTE: the HTML parser knows the HTML entities (e.g. &nbsp;) and recovers
+    # from broken markup, the XML parser doesn't
+    parser = HTMLParser(target=_EpubTextTarget(write), no_network=True,
+                        encoding='utf-8')
+    try:
+        with zf.open(name) as f:
+            for block in iter(lambda: f.read(_SCRATCH_BLOCK_SIZE), b''):
+                parser.feed(block)
+        parser.close()
+    except XMLSyntaxError as e:
+        logger.debug(f"Couldn't parse '{name}' from the epub: {e}")
+    write('\n')
+
+
+# e.g. '{http://www.w3.org/1999/xhtml}P' or 'svg:title' -> 'p' or 'title'
+def _get_local_name(tag):
+    return tag.rpartition('}')[2].rpartition(':')[2].lower()
+
+
+# Parser target that writes the text of an (x)html file as it is parsed, see
+# _EPUB_SKIPPED_ELEMENTS and _EPUB_BLOCK_ELEMENTS
+class _EpubTextTarget:
+    def __init__(self, write):
+        self._write = write
+        self._skip_depth = 0
+
+    def close(self):
+        return None
+
+    def data(self, data):
+        if not self._skip_depth:
+            self._write(data)
+
+    def end(self, tag):
+        name = _get_local_name(tag)
+        if name in _EPUB_SKIPPED_ELEMENTS:
+            self._skip_depth -= 1
+        elif name in _EPUB_BLOCK_ELEMENTS and not self._skip_depth:
+            self._write('\n')
+
+    def start(self, tag, attrib, nsmap=None):
+        name = _get_local_name(tag)
+        if name in _EPUB_SKIPPED_ELEMENTS:
+            self._skip_depth += 1
+        elif name in _EPUB_BLOCK_ELEMENTS and not self._skip_depth:
+            self._write('\n')
 
 
 def ebook_convert(input_file, output_file):
@@ -417,15 +1134,19 @@ def fail_file(old_path, reason, new_path=None):
 # options='--verbose --opf isbn=1234567890'
 # Returns the ebook metadata as a string; if no metadata found, an empty string
 # is returned
+# If a `cache` is given, the result is cached for `ttl` seconds or for
+# `negative_ttl` seconds if no metadata was found
 # Ref.: https://bit.ly/2HS0iXQ
-def fetch_metadata(isbn_sources, options=''):
-    args = f'fetch-ebook-metadata {options}'
-    if isinstance(isbn_sources, str):
-        isbn_sources = isbn_sources.split(',')
-    for isbn_source in isbn_sources:
-        args += f' --allowed-plugin={isbn_source} '
-    # Remove trailing whitespace
-    args = args.strip()
+def fetch_metadata(isbn_sources, options='', cache=None,
+                   ttl=METADATA_CACHE_TTL,
+                   negative_ttl=METADATA_CACHE_NEGATIVE_TTL):
+    args = get_fetch_metadata_cmd(isbn_sources, options)
+    if cache is not None:
+        result = get_cached_metadata(cache, args)
+        if result is None:
+            result = fetch_metadata(isbn_sources, options)
+            set_cached_metadata(cache, args, result, ttl, negative_ttl)
+        return result
     logger.debug(f'Calling `{args}`')
     args = shlex.split(args)
     # NOTE: `stderr` contains the whole log from running the fetch-data query
@@ -445,40 +1166,111 @@ def fetch_metadata(isbn_sources, options=''):
 def find_isbns(input_str, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
                isbn_regex=ISBN_REGEX, isbn_ret_separator=ISBN_RET_SEPARATOR,
                **kwargs):
-    isbns = []
     # TODO: they are using grep -oP
     # ref.: https://bit.ly/2HUbnIs
-    # Remove spaces
-    # input_str = input_str.replace(' ', '')
-    matches = re.finditer(isbn_regex, input_str)
-    for i, match in enumerate(matches):
-        match = match.group()
-        # Remove everything except numbers [0-9], 'x', and 'X'
-        # NOTE: equivalent to UNIX command `tr -c -d '0-9xX'`
-        # TODO 1: they don't remove \n in their code
-        # TODO 2: put the following in a function
-        del_tab = string.printable[10:].replace('x', '').replace('X', '')
-        tran_tab = str.maketrans('', '', del_tab)
-        match = match.translate(tran_tab)
-        # Only keep unique ISBNs
-        if match not in isbns:
-            # Validate ISBN
-            if is_isbn_valid(match):
-                if re.match(isbn_blacklist_regex, match):
-                    logger.debug(f'Wrong ISBN (blacklisted): {match}')
-                else:
-                    logger.debug(f'Valid ISBN found: {match}')
-                    isbns.append(match)
-            else:
-                logger.debug(f'Invalid ISBN found: {match}')
-        else:
-            logger.debug(f'Non-unique ISBN found: {match}')
+    isbns = get_isbn_scanner(isbn_blacklist_regex, isbn_regex).find(input_str)
     if not isbns:
         msg = f'"{input_str}"' if len(input_str) < 100 else ''
         logger.debug(f'No ISBN found in the input string {msg}')
     return isbn_ret_separator.join(isbns)
 
 
+# Searches the input string for identifiers (ISBNs, ISSNs, DOIs and ASINs) in
+# a single pass and returns them as (kind, value) tuples, see
+# ISBNScanner.find_identifiers_in_chunks()
+def find_identifiers(input_str, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+                     isbn_regex=ISBN_REGEX, **kwargs):
+    scanner = get_isbn_scanner(isbn_blacklist_regex, isbn_regex)
+    return scanner.find_identifiers_in_chunks([input_str])
+
+
+# Searches the file for identifiers like find_identifiers(). The text files
+# (see `isbn_direct_grep_files`) are searched directly, the other files are
+# converted to text first with convert_to_txt()
+# NOTE: unlike search_file_for_isbns(), only the text of the file is searched:
+# the ebook metadata (ebook-meta), the files inside archives and the OCR'd text
+# are not, and the ISBN cache is neither read nor updated (it only holds ISBNs)
+def find_identifiers_in_file(
+        file_path, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+        isbn_direct_grep_files=ISBN_DIRECT_GREP_FILES, isbn_regex=ISBN_REGEX,
+        **kwargs):
+    scanner = get_isbn_scanner(isbn_blacklist_regex, isbn_regex)
+    mime_type = get_mime_type(file_path)
+    if re.match(isbn_direct_grep_files, mime_type):
+        return scanner.find_identifiers_in_chunks(
+            iter_file_regions(file_path, isbn_grep_reorder_files=False))
+    tmp_file_txt = tempfile.mkstemp(suffix='.txt')[1]
+    try:
+        logger.debug('Converting the file to text format...')
+        result = convert_to_txt(file_path, tmp_file_txt, mime_type)
+        if result.returncode != 0:
+            logger.info('There was an error converting the file to txt format')
+            logger.debug(result.stderr)
+            return []
+        return scanner.find_identifiers_in_chunks(
+            iter_file_regions(tmp_file_txt, isbn_grep_reorder_files=False))
+    finally:
+        remove_file(tmp_file_txt)
+
+
+# Searches the text file for ISBNs like find_isbns() but without reading the
+# whole file: the text is searched in chunks, in the order given by
+# `isbn_grep_reorder_files` (see reorder_file_content()), until
+# `isbn_stop_after` ISBNs are found (0 to search the whole text)
+def find_isbns_in_file(file_path, **kwargs):
+    # NOTE: the bytes of the file are searched, they are not decoded
+    isbns = find_isbns_in_chunks(iter_file_regions(file_path, **kwargs),
+                                 **kwargs)
+    if not isbns:
+        logger.debug(f'No ISBN found in the file {file_path}')
+    return isbns
+
+
+# Returns the ISBNs found in the identifiers (dc:identifier) of the OPF package
+# document of the epub (see read_epub_opf()). The other identifiers are only
+# searched if none of the identifiers marked as ISBNs (e.g. opf:scheme="ISBN"
+# or urn:isbn:...) has some; UUIDs are ignored
+def find_isbns_in_epub_opf(file_path, **kwargs):
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            _, opf = read_epub_opf(zf)
+    except (zipfile.BadZipFile, NotImplementedError, RuntimeError, OSError,
+            zlib.error) as e:
+        logger.debug(f"Couldn't read the OPF of the epub: {e}")
+        return ''
+    if opf is None:
+        return ''
+    isbn_identifiers = []
+    other_identifiers = []
+    for identifier in opf.xpath('//*[local-name()="metadata"]'
+                                '/*[local-name()="identifier"]'):
+        text = (identifier.text or '').strip()
+        schemes = [value.lower() for value in identifier.attrib.values()]
+        logger.debug(f'OPF identifier: {text}')
+        if 'isbn' in text.lower() or 'isbn' in schemes:
+            isbn_identifiers.append(text)
+        elif 'uuid' not in text.lower() and 'uuid' not in schemes:
+            other_identifiers.append(text)
+    return find_isbns('\n'.join(isbn_identifiers), **kwargs) or \
+        find_isbns('\n'.join(other_identifiers), **kwargs)
+
+
+# Returns the ISBNs found in the chunks (str or bytes) separated by
+# `isbn_ret_separator`. The chunks are consumed until `isbn_stop_after` ISBNs
+# are found (0 to consume all of them)
+def find_isbns_in_chunks(chunks, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+                         isbn_regex=ISBN_REGEX,
+                         isbn_ret_separator=ISBN_RET_SEPARATOR,
+                         isbn_stop_after=ISBN_STOP_AFTER, **kwargs):
+    scanner = get_isbn_scanner(isbn_blacklist_regex, isbn_regex)
+    try:
+        isbns = scanner.find_in_chunks(chunks, isbn_stop_after)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return isbn_ret_separator.join(isbns)
+
+
 # Tries to fix the supplied PDF file for corruption based on one of the
 # following methods:
 # gs, pdftocairo, mutool, cpdf
@@ -526,61 +1318,293 @@ def fix_file_for_corruption(input_file, command='gs'):
     return exit_code, file_err, output_tmp_file
 
 
+# Searches the files from the archive for ISBNs by decreasing likelihood (see
+# get_archive_member_priority()) with `isbn_archive_scan_workers` threads and
+# returns the ISBNs of the first file (in that order) that has some.
+# The zip (epub, docx, odt, cbz, ...) and tar archives and the single
+# compressed files (gz, bz2, xz) are read directly, the files from the other
+# archives (rar, 7z, iso, ...) are decompressed one at a time with `7z e -so`.
+# The text files are searched as they are decompressed and the other files
+# (e.g. a pdf in a rar) are written in a temporary folder when their turn comes,
+# up to `isbn_archive_scratch_limit` MiB at a time
 def get_all_isbns_from_archive(
-        file_path, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+        file_path, epub_convert_method=EPUB_CONVERT_METHOD,
+        isbn_archive_scan_workers=ISBN_ARCHIVE_SCAN_WORKERS,
+        isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+        isbn_archive_scratch_limit=ISBN_ARCHIVE_SCRATCH_LIMIT,
         isbn_direct_grep_files=ISBN_DIRECT_GREP_FILES,
+        isbn_extract_first_last_pages=ISBN_EXTRACT_FIRST_LAST_PAGES,
         isbn_grep_reorder_files=ISBN_DIRECT_GREP_FILES,
         isbn_grep_rf_reverse_last=ISBN_GREP_RF_REVERSE_LAST,
         isbn_grep_rf_scan_first=ISBN_GREP_RF_SCAN_FIRST,
         isbn_ignored_files=ISBN_IGNORED_FILES, isbn_regex=ISBN_REGEX,
-        isbn_ret_separator=ISBN_RET_SEPARATOR, ocr_command=OCR_COMMAND,
+        isbn_ret_separator=ISBN_RET_SEPARATOR,
+        isbn_stop_after=ISBN_STOP_AFTER, ocr_command=OCR_COMMAND,
         ocr_enabled=OCR_ENABLED,
         ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES, **kwargs):
     func_params = locals().copy()
     func_params.pop('file_path')
-    all_isbns = []
+    basename = os.path.basename(file_path)
+    scratch = _ScratchSpace(isbn_archive_scratch_limit * 1024 * 1024)
+    with ExitStack() as stack:
+        try:
+            archive = _open_archive(file_path, stack)
+        except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError) as e:
+            logger.debug(f"Couldn't read the archive ({e}), trying with 7z...")
+            archive = None
+        if archive is None:
+            logger.debug(f"Listing the content of '{basename}' with 7z...")
+            result = list_archive(file_path)
+            if result.returncode or result.stderr:
+                logger.debug('Error listing the file (probably not an '
+                             'archive)!')
+                logger.debug(f'Error: {result.stderr}')
+                # TODO: return None?
+                return ''
+            archive = (_parse_7z_listing(result.stdout),
+                       lambda name: _open_7z_member(file_path, name), True)
+        members, open_member, concurrent = archive
+        sizes = dict(members)
+        logger.debug(f"Scanning the {len(members)} files of '{basename}' by "
+                     "likelihood...")
+
+        def search_member(name, is_text):
+            try:
+                if is_text:
+                    return _search_archive_text_member(
+                        name, _iter_archive_member_regions(
+                            open_member, name, sizes[name], func_params),
+                        func_params)
+                return _search_extracted_member(name, sizes[name],
+                                                open_member, scratch,
+                                                func_params)
+            except (zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError,
+                    zlib.error, EOFError, NotImplementedError, OSError,
+                    RuntimeError) as e:
+                # e.g. bad CRC, encrypted file or unsupported compression
+                # method
+                logger.debug(f"Couldn't read '{name}' from the archive: {e}")
+                return ''
+
+        name, isbns = _search_archive_members(
+            members, search_member,
+            isbn_archive_scan_workers if concurrent else 1)
+    if isbns:
+        logger.debug(f"Found ISBNs '{isbns}' in '{name}'!")
+        # TODO: two prints, one for stderror and the other for stdout
+        logger.debug(isbns.replace(isbn_ret_separator, '\n'))
+    return isbns
+
+
+# Opens the archive if it can be read directly (the archive is closed with
+# `stack`) and returns (members, open_member, concurrent) where `members` is
+# the list of (name, size) of its files, open_member(name) returns a binary
+# file object of a file and `concurrent` tells if the files can be read by
+# several threads at the same time. Returns None for the other archives
+def _open_archive(file_path, stack):
+    if zipfile.is_zipfile(file_path):
+        zf = stack.enter_context(zipfile.ZipFile(file_path))
+        infos = {info.filename: info for info in zf.infolist()
+                 if not info.is_dir()}
+        return ([(name, info.file_size) for name, info in infos.items()],
+                lambda name: zf.open(infos[name]), True)
+    if tarfile.is_tarfile(file_path):
+        tf = stack.enter_context(tarfile.open(file_path))
+        infos = {info.name: info for info in tf.getmembers() if info.isfile()}
+        # NOTE: the files of a tar archive share the same (compressed) stream
+        return ([(name, info.size) for name, info in infos.items()],
+                lambda name: tf.extractfile(infos[name]), False)
+    with open(file_path, 'rb') as f:
+        magic = f.read(6)
+    for magic_number, open_compressed in _COMPRESSED_FILE_OPENERS:
+        if magic.startswith(magic_number):
+            # e.g. book.pdf.gz -> book.pdf (its size is not known)
+            name = os.path.splitext(os.path.basename(file_path))[0]
+            return ([(name, -1)],
+                    lambda name: open_compressed(file_path, 'rb'), True)
+    return None
+
+
+def _iter_archive_member_regions(open_member, name, size, func_params):
+    with open_member(name) as f:
+        if 0 <= size <= _ARCHIVE_MEMBER_MAX_MEMORY:
+            yield from iter_buffer_regions(f.read(), **func_params)
+        else:
+            yield from iter_stream_regions(f)
+
+
+# Decompresses the file of an archive in a temporary folder and searches it
+# with search_file_for_isbns(). The scratch space for the whole file (or all of
+# it if its size is unknown) is taken before, waiting for the other files to be
+# done if needed
+def _search_extracted_member(name, size, open_member, scratch, func_params):
+    if size > scratch.limit:
+        logger.debug(f"Skipping '{name}': {size} bytes is more than the "
+                     "scratch space limit")
+        return ''
+    # NOTE: taking all the space at once (instead of block by block) means
+    # that a thread never waits while holding some space, i.e. no deadlock
+    reserved = size if size >= 0 else scratch.limit
+    scratch.take(reserved)
     tmpdir = tempfile.mkdtemp()
-    logger.debug(f"Trying to decompress '{os.path.basename(file_path)}' and "
-                 "recursively scan the contents")
-    logger.debug(f"Decompressing '{file_path}' into tmp folder '{tmpdir}'")
-    result = extract_archive(file_path, tmpdir)
-    if result.stderr:
-        logger.debug('Error extracting the file (probably not an archive)!')
-        logger.debug(f'Error: {result.stderr}')
-        logger.debug('Removing tmp dir...')
+    member = os.path.join(tmpdir, os.path.basename(name))
+    written = 0
+    try:
+        with open_member(name) as src, open(member, 'wb') as dst:
+            while True:
+                block = src.read(_SCRATCH_BLOCK_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > reserved:
+                    logger.debug(f"Skipping '{name}': it is bigger than the "
+                                 f"{reserved} bytes taken in the scratch "
+                                 "space")
+                    return ''
+                dst.write(block)
+        return search_file_for_isbns(member, **func_params)
+    finally:
         remove_tree(tmpdir)
-        # TODO: return None?
-        return ''
-
-    logger.debug(f"Archive extracted successfully in '{tmpdir}', scanning "
-                 f"contents recursively...")
-    # TODO: ref.: https://stackoverflow.com/a/2759553
-    # TODO: ignore .DS_Store
-    for path, dirs, files in os.walk(tmpdir, topdown=False):
-        # TODO: they use flag options for sorting the directory contents
-        # see https://github.com/na--/ebook-tools#miscellaneous-options [FILE_SORT_FLAGS]
-        for file_to_check in files:
-            # TODO: add debug_prefixer
-            file_to_check = os.path.join(path, file_to_check)
-            isbns = search_file_for_isbns(file_to_check, **func_params)
+        scratch.release(reserved)
+
+
+# Bytes that can be written at the same time in temporary files while
+# searching the files of an archive (by several threads)
+class _ScratchSpace:
+    def __init__(self, limit):
+        self.limit = limit
+        self.available = limit
+        self._released = threading.Condition()
+
+    def release(self, nbytes):
+        with self._released:
+            self.available += nbytes
+            self._released.notify_all()
+
+    # Waits until `nbytes` (at most `limit`) are released by the other threads
+    # and takes them
+    def take(self, nbytes):
+        with self._released:
+            while nbytes > self.available:
+                self._released.wait()
+            self.available -= nbytes
+
+
+# Yields the decompressed content of a file of the archive (read from the
+# stdout of `7z e -so`). The process is killed if the content is not read until
+# the end (e.g. the search stopped early)
+@contextmanager
+def _open_7z_member(file_path, name):
+    # NOTE: -spd disables the wildcards, e.g. for names with '*' or '?'
+    process = subprocess.Popen(['7z', 'e', '-so', '-spd', '--',
+                                str(file_path), name],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    try:
+        yield process.stdout
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+
+# Returns the list of (name, size) of the files from the output of
+# `7z l -slt` (one block of `Key = value` lines per file)
+def _parse_7z_listing(output):
+    members = []
+    # NOTE: the properties of the archive itself are before the '----------'
+    # line
+    for block in output.split('----------', 1)[-1].split('\n\n'):
+        props = dict(line.split(' = ', 1) for line in block.splitlines()
+                     if ' = ' in line)
+        if 'Path' not in props or props.get('Folder') == '+' or \
+                props.get('Attributes', '').startswith('D'):
+            continue
+        size = props.get('Size', '')
+        members.append((props['Path'], int(size) if size.isdigit() else -1))
+    return members
+
+
+# Searches the files of an archive (list of (name, size)) for ISBNs by
+# decreasing likelihood with search_member(name, is_text) in `workers` threads
+# and returns (name, isbns) for the first file (in that order) with ISBNs or
+# (None, '')
+def _search_archive_members(members, search_member, workers):
+    # NOTE: the files before the None priority (OPF, xhtml, ...) are text and
+    # are searched directly, the others go through search_file_for_isbns()
+    text_priority = ARCHIVE_MEMBER_PRIORITIES.index(None)
+    members = sorted(
+        (get_archive_member_priority(name), size, name)
+        for name, size in members
+        if name not in _ARCHIVE_IGNORED_MEMBERS
+        and os.path.basename(name) != '.DS_Store')
+    # Within the same priority, the smallest files are searched first
+    members = [(name, priority < text_priority)
+               for priority, _, name in members]
+    if workers > 1 and len(members) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(search_member, name, is_text)
+                       for name, is_text in members]
+            try:
+                for (name, _), future in zip(members, futures):
+                    isbns = future.result()
+                    if isbns:
+                        return name, isbns
+            finally:
+                # NOTE: the files being searched can't be stopped, the others
+                # are not even started
+                for future in futures:
+                    future.cancel()
+    else:
+        for name, is_text in members:
+            isbns = search_member(name, is_text)
             if isbns:
-                logger.debug(f"Found ISBNs '{isbns}'!")
-                # TODO: two prints, one for stderror and the other for stdout
-                logger.debug(isbns.replace(isbn_ret_separator, '\n'))
-                for isbn in isbns.split(','):
-                    if isbn not in all_isbns:
-                        all_isbns.append(isbn)
-            logger.debug(f'Removing {file_to_check}...')
-            remove_file(file_to_check)
-        if len(os.listdir(path)) == 0 and path != tmpdir:
-            os.rmdir(path)
-        elif path == tmpdir:
-            if len(os.listdir(tmpdir)) == 1 and '.DS_Store' in tmpdir:
-                remove_file(os.path.join(tmpdir, '.DS_Store'))
-    logger.debug(f"Removing temporary folder '{tmpdir}' (should be empty)...")
-    if is_dir_empty(tmpdir):
-        remove_tree(tmpdir)
-    return isbn_ret_separator.join(all_isbns)
+                return name, isbns
+    return None, ''
+
+
+# Searches the name of a text file from an archive and then its content (the
+# chunks) for ISBNs
+def _search_archive_text_member(name, chunks, func_params):
+    isbns = find_isbns(os.path.basename(name), **func_params)
+    if isbns:
+        chunks.close()
+        return isbns
+    return find_isbns_in_chunks(chunks, **func_params)
+
+
+# Returns the priority (0 = most likely to contain the book's ISBNs) of a file
+# from an archive given its path relative to the archive, see
+# ARCHIVE_MEMBER_PRIORITIES
+def get_archive_member_priority(member_name):
+    member_name = member_name.replace(os.sep, '/').lower()
+    for priority, regex in enumerate(ARCHIVE_MEMBER_PRIORITIES):
+        if regex and re.search(regex, member_name):
+            return priority
+    return ARCHIVE_MEMBER_PRIORITIES.index(None)
+
+
+# Returns the names of the (x)html files of the opened epub in reading order,
+# as listed by the spine of its OPF package document (see read_epub_opf())
+def get_epub_spine(zf):
+    opf_path, opf = read_epub_opf(zf)
+    if opf is None:
+        return []
+    opf_dir = posixpath.dirname(opf_path)
+    hrefs = {}
+    for item in opf.xpath('//*[local-name()="manifest"]/*[local-name()="item"]'):
+        if item.get('id') and item.get('href'):
+            hrefs[item.get('id')] = posixpath.normpath(
+                posixpath.join(opf_dir, unquote(item.get('href'))))
+    names = set(zf.namelist())
+    spine = []
+    for itemref in opf.xpath('//*[local-name()="spine"]'
+                             '/*[local-name()="itemref"]'):
+        name = hrefs.get(itemref.get('idref'))
+        if name in names:
+            spine.append(name)
+    return spine
 
 
 def get_ebook_metadata(file_path):
@@ -663,7 +1687,7 @@ def get_pages_in_pdf(file_path, cmd='mdls'):
         result = subprocess.run(args, stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE)
     else:
-        cmd = f'pdfinfo {file_path}'
+        cmd = f'pdfinfo "{file_path}"'
         args = shlex.split(cmd)
         result = subprocess.run(args, stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE)
@@ -688,6 +1712,27 @@ def gs(input_file, output_file):
     return convert_result_from_shell_cmd(result)
 
 
+# Returns the on-disk cache (see python-diskcache) or None if it can't be used
+# Ref.: https://github.com/grantjenks/python-diskcache
+def init_cache(cache_folder=CACHE_FOLDER, cache_size_limit=CACHE_SIZE_LIMIT,
+               clear_cache=CLEAR_CACHE, eviction_policy=EVICTION_POLICY,
+               **kwargs):
+    try:
+        from diskcache import Cache
+    except ImportError:
+        logger.warning('diskcache is not installed, the cache will not be '
+                       'used: pip install diskcache')
+        return None
+    logger.debug(f'Opening cache: {cache_folder}')
+    # NOTE: `cache_size_limit` is in GB
+    cache = Cache(cache_folder, eviction_policy=eviction_policy,
+                  size_limit=int(cache_size_limit * 1e9))
+    if clear_cache:
+        logger.info('Clearing the cache...')
+        cache.clear()
+    return cache
+
+
 # Checks if directory is empty
 # Ref.: https://stackoverflow.com/a/47363995
 # NOTE: .DS_Store can be the only file present and not empty directory
@@ -697,12 +1742,22 @@ def is_dir_empty(path):
 
 
 # Ref.: https://stackoverflow.com/a/15924160
+# Returns True if the file is zero-sized or contains only \0
 def is_file_empty(file_path):
-    # TODO: test when file doesn't exist
     # TODO: see if the proposed solution @ https://stackoverflow.com/a/15924160
     # is equivalent to using try and catch the `OSError`
     try:
-        return not os.path.getsize(file_path) > 0
+        size = os.path.getsize(file_path)
+        if size == 0:
+            return True
+        with open(file_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            # Stops at the first block that is not only zeros
+            for start in range(0, size, len(_ZERO_BLOCK)):
+                block = buf[start:start + len(_ZERO_BLOCK)]
+                if block != _ZERO_BLOCK[:len(block)]:
+                    return False
+        return True
     except OSError as e:
         logger.error(f'Error: {e.filename} - {e.strerror}.')
         return False
@@ -712,33 +1767,20 @@ def is_file_empty(file_path):
 # Ref.: https://bit.ly/2HO2lMD
 def is_isbn_valid(isbn):
     # TODO: there is also a Python package for validating ISBNs (but dependency)
-    # Remove whitespaces (space, tab, newline, and so on), '-', and capitalize all
-    # characters (ISBNs can consist of numbers [0-9] and the letters [xX])
+    # Remove whitespaces (space, tab, newline, and so on) and '-' (ISBNs can
+    # consist of numbers [0-9] and the letters [xX])
     isbn = ''.join(isbn.split())
     isbn = isbn.replace('-', '')
-    isbn = isbn.upper()
-
-    sum = 0
-    # Case 1: ISBN-10
-    if len(isbn) == 10:
-        for i in range(len(isbn)):
-            if i == 9 and isbn[i] == 'X':
-                number = 10
-            else:
-                number = int(isbn[i])
-            sum += (number * (10 - i))
-        if sum % 11 == 0:
-            return True
-    # Case 2: ISBN-13
-    elif len(isbn) == 13:
-        if isbn[0:3] in ['978', '979']:
-            for i in range(0, len(isbn), 2):
-                sum += int(isbn[i])
-            for i in range(1, len(isbn), 2):
-                sum += (int(isbn[i])*3)
-            if sum % 10 == 0:
-                return True
-    return False
+    return ISBNScanner.is_valid(isbn)
+
+
+# Checksum of an ISSN, e.g. 0378-5955
+def is_issn_valid(issn):
+    issn = issn.replace('-', '').upper()
+    if len(issn) != 8 or not issn[:7].isdigit():
+        return False
+    check = -sum((ord(c) - 48) * w for c, w in zip(issn, range(8, 1, -1))) % 11
+    return issn[7] == ('X' if check == 10 else str(check))
 
 
 def isalnum_in_file(file_path):
@@ -754,6 +1796,165 @@ def isalnum_in_file(file_path):
     return isalnum
 
 
+# Yields the text of the file in the order used for searching ISBNs, see
+# iter_file_regions()
+# NOTE: the file is decoded as UTF-8, invalid bytes are replaced
+def iter_file_chunks(file_path, **kwargs):
+    for region in iter_file_regions(file_path, **kwargs):
+        yield region.decode('utf-8', 'replace')
+
+
+# Yields the content of the file (as bytes) in the order used for searching
+# ISBNs, see iter_buffer_regions().
+# The file is memory-mapped: the line boundaries are found by searching the
+# map and only the yielded chunks are copied, i.e. the file is only read as far
+# as the chunks are consumed
+def iter_file_regions(file_path, **kwargs):
+    with open(file_path, 'rb') as f:
+        # NOTE: an empty file can't be mapped
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter_buffer_regions(mm, **kwargs)
+
+
+# Yields the content of the buffer (bytes or mmap) in the order used for
+# searching ISBNs: if `isbn_grep_reorder_files` is set, the first
+# `isbn_grep_rf_scan_first` lines, then the last `isbn_grep_rf_reverse_last`
+# lines in reverse and then the middle of the buffer in chunks of about
+# _ISBN_CHUNK_SIZE bytes. Otherwise, the whole buffer in chunks.
+def iter_buffer_regions(buf, isbn_grep_reorder_files=ISBN_GREP_REORDER_FILES,
+                        isbn_grep_rf_scan_first=ISBN_GREP_RF_SCAN_FIRST,
+                        isbn_grep_rf_reverse_last=ISBN_GREP_RF_REVERSE_LAST,
+                        **kwargs):
+    size = len(buf)
+    if not size:
+        return
+    middle_start = 0
+    middle_end = size
+    if isbn_grep_reorder_files:
+        middle_start = _find_first_lines(buf, isbn_grep_rf_scan_first)
+        yield buf[:middle_start]
+        middle_end = _find_last_lines(buf, middle_start,
+                                      isbn_grep_rf_reverse_last)
+        last_part = buf[middle_end:].splitlines(True)
+        if last_part and not last_part[-1].endswith(b'\n'):
+            # Don't join the last line of the file with the line before it
+            # once reversed
+            last_part[-1] += b'\n'
+        last_part.reverse()
+        yield b''.join(last_part)
+    pos = middle_start
+    while pos < middle_end:
+        start = pos
+        end = min(pos + _ISBN_CHUNK_SIZE, middle_end)
+        cut = 0
+        while end < middle_end:
+            cut = buf.rfind(b'\n', start, end) + 1 or \
+                _cut_chunk(buf, start, end)
+            if cut:
+                break
+            # NOTE: cutting within a run of ISBN characters would let the
+            # look-ahead (?![0-9]) of the ISBN regex match at the end of the
+            # chunk, the chunk is extended instead
+            start = end
+            end = min(end + _ISBN_CHUNK_SIZE, middle_end)
+        yield buf[pos:cut or end]
+        pos = cut or end
+
+
+# Yields the content of the binary file object (e.g. a file being
+# decompressed) in chunks of about _ISBN_CHUNK_SIZE bytes, cut like in
+# iter_buffer_regions(). The content is not reordered since the end of the file
+# is only known once it is read
+def iter_stream_regions(f):
+    rest = bytearray()
+    while True:
+        data = f.read(_ISBN_CHUNK_SIZE)
+        if not data:
+            if rest:
+                yield bytes(rest)
+            return
+        start = len(rest)
+        rest += data
+        # NOTE: `rest` had no newline, only the new data is searched
+        cut = rest.rfind(b'\n', start) + 1 or _cut_chunk(rest, start, len(rest))
+        if cut:
+            yield bytes(rest[:cut])
+            del rest[:cut]
+        # else only ISBN characters, see iter_buffer_regions()
+
+
+# Removes the punctuation that is matched at the end of a DOI but is most
+# likely not part of it, e.g. '10.1000/182).' -> '10.1000/182'
+def _strip_doi(doi):
+    doi = doi.rstrip('.,;:')
+    while doi.endswith(')') and doi.count(')') > doi.count('('):
+        doi = doi[:-1].rstrip('.,;:')
+    return doi
+
+
+# Returns the offset, between `start` and `end`, right after the last byte that
+# can't be part of an ISBN or 0 if there is none
+def _cut_chunk(buf, start, end):
+    # NOTE: only cutting before or after a run of ISBN characters keeps the
+    # look-behind and look-ahead of the ISBN regex right
+    length = len(buf[start:end].rstrip(_ISBN_CHARS_BYTES))
+    return start + length if length else 0
+
+
+# Returns the offset of the end of the first `nb_lines` lines of the mapped
+# file or of a byte window if these lines are too long
+def _find_first_lines(mm, nb_lines):
+    limit = min(len(mm), nb_lines * _REGION_LINE_BYTES)
+    pos = 0
+    for _ in range(nb_lines):
+        i = mm.find(b'\n', pos, limit)
+        if i == -1:
+            if limit == len(mm):
+                return limit
+            logger.debug(f'The first {nb_lines} lines are longer than {limit} '
+                         'bytes, using a byte window')
+            return _cut_chunk(mm, pos, limit) or pos
+        pos = i + 1
+    return pos
+
+
+# Returns the offset of the first of the last `nb_lines` lines of the mapped
+# file (or of a byte window if these lines are too long) without going
+# before `start`
+def _find_last_lines(mm, start, nb_lines):
+    size = len(mm)
+    if nb_lines <= 0 or start >= size:
+        return size
+    limit = max(start, size - nb_lines * _REGION_LINE_BYTES)
+    # The newline at the end of the last line doesn't start a new line
+    end = size - 1
+    for _ in range(nb_lines):
+        i = mm.rfind(b'\n', limit, end)
+        if i == -1:
+            if limit == start:
+                return start
+            logger.debug(f'The last {nb_lines} lines are longer than '
+                         f'{size - limit} bytes, using a byte window')
+            # Start the window after a byte that can't be part of an ISBN
+            for pos in range(limit, size):
+                if mm[pos] not in _ISBN_CHARS:
+                    return pos + 1
+            return size
+        end = i
+    return end + 1
+
+
+# Lists the files of the archive with their properties (see
+# _parse_7z_listing())
+def list_archive(file_path):
+    cmd = f'7z l -slt "{file_path}"'
+    args = shlex.split(cmd)
+    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return convert_result_from_shell_cmd(result)
+
+
 # Ref.: https://bit.ly/2HxYEaw
 # TODO: `output_filename_template` should be accessed from config.config_dict,
 # all scripts should have access to config.config_dict
@@ -807,7 +2008,8 @@ def move_or_link_ebook_file_and_metadata(
 
     new_path = unique_filename(new_folder, new_name)
     logger.debug(f'Full path: {new_path}')
-    move_or_link_file(current_ebook_path, new_path, dry_run, symlink_only)
+    new_path = move_or_link_file(current_ebook_path, new_path, dry_run,
+                                 symlink_only)
 
     if keep_metadata:
         new_metadata_path = f'{new_path}.{output_metadata_extension}'
@@ -828,6 +2030,7 @@ def move_or_link_ebook_file_and_metadata(
     return new_path
 
 
+# Returns the path the file was actually moved or symlinked to
 def move_or_link_file(current_path, new_path, dry_run=DRY_RUN,
                       symlink_only=SYMLINK_ONLY):
     new_folder = Path(new_path).parent
@@ -839,17 +2042,29 @@ def move_or_link_file(current_path, new_path, dry_run=DRY_RUN,
     if not new_folder.exists():
         logger.debug(f'Creating folder {new_folder}')
         if not dry_run:
-            new_folder.mkdir()
+            new_folder.mkdir(exist_ok=True)
 
     # Symlink or move file
-    if symlink_only:
-        logger.debug(f"Symlinking file '{current_path}' to '{new_path}'...")
-        if not dry_run:
-            Path(new_path).symlink_to(current_path)
-    else:
-        logger.debug(f"Moving file '{current_path}' to '{new_path}'...")
-        if not dry_run:
-            move(current_path, new_path, clobber=False)
+    # NOTE: another process (e.g. organize with `--jobs`) might have taken
+    # `new_path` since it was returned by unique_filename(). Existing files are
+    # never overwritten, the next available filename is used instead
+    while True:
+        try:
+            if symlink_only:
+                logger.debug(f"Symlinking file '{current_path}' to "
+                             f"'{new_path}'...")
+                if not dry_run:
+                    Path(new_path).symlink_to(current_path)
+            else:
+                logger.debug(f"Moving file '{current_path}' to '{new_path}'...")
+                if not dry_run:
+                    move_exclusive(current_path, new_path)
+        except FileExistsError:
+            logger.debug(f"File '{new_path}' already exists, trying with "
+                         "another filename...")
+            new_path = unique_filename(new_folder, Path(new_path).name)
+        else:
+            return new_path
 
 
 def mutool(file_path):
@@ -997,8 +2212,13 @@ def pdftocairo(input_file, output_file):
     return convert_result_from_shell_cmd(result)
 
 
-def pdftotext(input_file, output_file):
-    cmd = f'pdftotext "{input_file}" "{output_file}"'
+def pdftotext(input_file, output_file, first_page=None, last_page=None):
+    cmd = 'pdftotext '
+    if first_page:
+        cmd += f'-f {first_page} '
+    if last_page:
+        cmd += f'-l {last_page} '
+    cmd += f'"{input_file}" "{output_file}"'
     args = shlex.split(cmd)
     result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return convert_result_from_shell_cmd(result)
@@ -1076,6 +2296,37 @@ def process_pdftocairo_result(command_result, output_tmp_file):
 
 
 # TODO: place it (and other path-related functions) in genutils
+# Returns (path, root element) of the OPF package document of the opened epub
+# given by its META-INF/container.xml (or the first .opf file found) or
+# (None, None) if there is none
+def read_epub_opf(zf):
+    opf_path = None
+    try:
+        container = _parse_xml(zf.read('META-INF/container.xml'))
+    except KeyError:
+        container = None
+    if container is not None:
+        rootfiles = container.xpath('//*[local-name()="rootfile"]/@full-path')
+        opf_path = rootfiles[0] if rootfiles else None
+    if opf_path is None:
+        opf_path = next((name for name in zf.namelist()
+                         if name.lower().endswith('.opf')), None)
+    try:
+        opf = _parse_xml(zf.read(opf_path)) if opf_path else None
+    except KeyError:
+        opf = None
+    return (opf_path, opf) if opf is not None else (None, None)
+
+
+def _parse_xml(data):
+    try:
+        return fromstring(data, XMLParser(recover=True,
+                                          resolve_entities=False,
+                                          no_network=True))
+    except XMLSyntaxError:
+        return None
+
+
 def remove_file(file_path):
     # TODO add reference: https://stackoverflow.com/a/42641792
     try:
@@ -1113,40 +2364,15 @@ def reorder_file_content(
                      f'{isbn_grep_rf_scan_first} lines normally, then read '
                      f'last {isbn_grep_rf_reverse_last} lines in reverse and '
                      'then read the rest')
-        # TODO: try out with big file, more than 800 pages (approx. 73k lines)
-        # TODO: see alternatives for reading big file @
-        # https://stackoverflow.com/a/4999741 (mmap),
-        # https://stackoverflow.com/a/24809292 (linecache),
-        # https://stackoverflow.com/a/42733235 (buffer)
-        with open(file_path, 'r') as f:
-            # Read whole file as a list of lines
-            # TODO: do we remove newlines? e.g. with f.read().rstrip("\n")
-            data = f.readlines()
-            # Read the first ISBN_GREP_RF_SCAN_FIRST lines of the file text
-            first_part = data[:isbn_grep_rf_scan_first]
-            del data[:isbn_grep_rf_scan_first]
-            # Read the last part and reverse it
-            last_part = data[-isbn_grep_rf_reverse_last:]
-            if last_part:
-                last_part.reverse()
-                del data[-isbn_grep_rf_reverse_last:]
-            # Read the middle part of the file text
-            middle_part = data
-            # TODO: try out with large lists, if efficiency is a concern then
-            # check itertools.chain
-            # ref.: https://stackoverflow.com/a/4344735
-            # Concatenate the three parts: first, last part (reversed), and
-            # middle part
-            data = first_part + last_part + middle_part
-            data = "".join(data)
     else:
         logger.debug('Since isbn_grep_reorder_files is False, input file will '
                      'not be reordered')
-        with open(file_path, 'r') as f:
-            # TODO: do we remove newlines? e.g. with f.read().rstrip("\n")
-            # Read whole content of file as a string
-            data = f.read()
-    return data
+    # NOTE: the file is memory-mapped, see iter_file_regions()
+    # TODO: do we remove newlines? e.g. with f.read().rstrip("\n")
+    return ''.join(iter_file_chunks(
+        file_path, isbn_grep_reorder_files=isbn_grep_reorder_files,
+        isbn_grep_rf_scan_first=isbn_grep_rf_scan_first,
+        isbn_grep_rf_reverse_last=isbn_grep_rf_reverse_last))
 
 
 # Tries to find ISBN numbers in the given ebook file by using progressively
@@ -1157,6 +2383,8 @@ def reorder_file_content(
 #    file contents directly for ISBNs
 # 3. If the MIME type matches `isbn_ignored_files`, the function returns early
 #    with no results
+# 3a. If the file is an epub, check the identifiers of its OPF package
+#    document (dc:identifier) for ISBNs
 # 4. Check the file metadata from calibre's `ebook-meta` for ISBNs
 # 5. Try to extract the file as an archive with `7z`; if successful,
 #    recursively call search_file_for_isbns for all the extracted files
@@ -1167,48 +2395,98 @@ def reorder_file_content(
 #    ISBNs and OCR_ENABLED is set to "always", run OCR as well.
 # ref.: https://bit.ly/2r28US2
 def search_file_for_isbns(
-        file_path, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
+        file_path, epub_convert_method=EPUB_CONVERT_METHOD,
+        isbn_archive_scan_workers=ISBN_ARCHIVE_SCAN_WORKERS,
+        isbn_archive_scratch_limit=ISBN_ARCHIVE_SCRATCH_LIMIT,
+        isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
         isbn_direct_grep_files=ISBN_DIRECT_GREP_FILES,
+        isbn_extract_first_last_pages=ISBN_EXTRACT_FIRST_LAST_PAGES,
         isbn_grep_reorder_files=ISBN_GREP_REORDER_FILES,
         isbn_grep_rf_reverse_last=ISBN_GREP_RF_REVERSE_LAST,
         isbn_grep_rf_scan_first=ISBN_GREP_RF_SCAN_FIRST,
         isbn_ignored_files=ISBN_IGNORED_FILES, isbn_regex=ISBN_REGEX,
-        isbn_ret_separator=ISBN_RET_SEPARATOR, ocr_command=OCR_COMMAND,
+        isbn_ret_separator=ISBN_RET_SEPARATOR,
+        isbn_stop_after=ISBN_STOP_AFTER, ocr_command=OCR_COMMAND,
         ocr_enabled=OCR_ENABLED,
-        ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES, **kwargs):
+        ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES, cache=None,
+        search_info=None, **kwargs):
     # TODO: urgent, check vars and other functions
     func_params = locals().copy()
     # TODO: explain pop()
     func_params.pop('file_path')
+    # NOTE: the files extracted from archives are not cached
+    func_params.pop('cache')
+    # NOTE: `search_info` (if given) is a dict where the step that found the
+    # ISBNs is saved: 'filename', 'text', 'opf', 'ebook-meta', 'archive',
+    # 'pages', 'convert', 'ocr' or 'cache' (None if no ISBNs were found)
+    func_params.pop('search_info')
+    if search_info is None:
+        search_info = {}
     basename = os.path.basename(file_path)
     # logger.debug(f"Searching file '{basename}' for ISBN numbers...")
     # Step 1: check the filename for ISBNs
     # TODO: make sure that we return an empty string when we can't find ISBNs
     logger.debug('check the filename for ISBNs')
+    search_info['step'] = 'filename'
     isbns = find_isbns(basename, **func_params)
     if isbns:
         logger.debug("Extracted ISBNs '{}' from the file name!".format(
             isbns.replace('\n', '; ')))
         return isbns
 
+    # Steps 2-7 only depend on the file content (and the options), thus their
+    # result is cached, including when no ISBNs are found
+    if cache is None:
+        isbns = _search_file_content_for_isbns(file_path, func_params,
+                                               search_info)
+    else:
+        cache_key = get_isbns_cache_key(file_path, **func_params)
+        isbns = cache.get(cache_key)
+        if isbns is None:
+            isbns = _search_file_content_for_isbns(file_path, func_params,
+                                                   search_info)
+            cache.set(cache_key, isbns)
+        else:
+            logger.debug("Found the result of the ISBNs search in the cache: "
+                         f"'{isbns}'")
+            search_info['step'] = 'cache'
+    if not isbns:
+        search_info['step'] = None
+    return isbns
+
+
+# Steps 2-7 of search_file_for_isbns(). The current step is saved in
+# `search_info['step']`
+def _search_file_content_for_isbns(file_path, func_params, search_info):
+    isbns = ''
+    search_info['step'] = 'text'
     # Steps 2-3: (2) if valid MIME type, search file contents for isbns and
     # (3) if invalid MIME type, exit without results
     mime_type = get_mime_type(file_path)
-    if re.match(isbn_direct_grep_files, mime_type):
+    if re.match(func_params['isbn_direct_grep_files'], mime_type):
         logger.debug('Ebook is in text format, trying to find ISBN directly')
-        data = reorder_file_content(file_path, **func_params)
-        isbns = find_isbns(data, **func_params)
+        isbns = find_isbns_in_file(file_path, **func_params)
         if isbns:
             logger.debug(f"Extracted ISBNs '{isbns}' from the text file contents!")
         else:
             logger.debug('Did not find any ISBNs')
         return isbns
-    elif re.match(isbn_ignored_files, mime_type):
+    elif re.match(func_params['isbn_ignored_files'], mime_type):
         logger.info('The file type is in the blacklist, ignoring...')
         return isbns
 
+    # Step 3a: check the identifiers of the OPF of an epub (two small reads of
+    # the zip archive and no external tool)
+    if mime_type == 'application/epub+zip':
+        search_info['step'] = 'opf'
+        isbns = find_isbns_in_epub_opf(file_path, **func_params)
+        if isbns:
+            logger.debug(f"Extracted ISBNs '{isbns}' from the OPF identifiers!")
+            return isbns
+
     # Step 4: check the file metadata from calibre's `ebook-meta` for ISBNs
     logger.debug("check the file metadata from calibre's `ebook-meta` for ISBNs")
+    search_info['step'] = 'ebook-meta'
     ebookmeta = get_ebook_metadata(file_path)
     logger.debug(f'Ebook metadata:\n{ebookmeta.stdout}')
     isbns = find_isbns(ebookmeta.stdout, **func_params)
@@ -1218,6 +2496,7 @@ def search_file_for_isbns(
 
     # Step 5: decompress with 7z
     logger.debug('decompress with 7z')
+    search_info['step'] = 'archive'
     isbns = get_all_isbns_from_archive(file_path, **func_params)
     if isbns:
         logger.debug(f"Extracted ISBNs '{isbns}' from the archive file")
@@ -1229,24 +2508,41 @@ def search_file_for_isbns(
     logger.debug(f"Converting ebook to text format...")
     logger.debug(f"Temp file: {tmp_file_txt}")
 
+    # Step 6a: only convert the first and last pages of a big document first
+    # since the ISBNs are most likely found there
+    search_info['step'] = 'pages'
+    result = convert_pages_to_txt(file_path, tmp_file_txt, mime_type,
+                                  **func_params)
+    if result is not None and result.returncode == 0:
+        isbns = find_isbns_in_file(tmp_file_txt, **func_params)
+        if isbns:
+            logger.debug(f"The text of the first and last pages contains "
+                         f"ISBNs '{isbns}'")
+            logger.debug(f'Removing {tmp_file_txt}...')
+            remove_file(tmp_file_txt)
+            return isbns
+        logger.debug('Did not find any ISBNs in the first and last pages, '
+                     'converting the whole document...')
+
     # TODO: important, takes a long time for pdfs (not djvu)
+    search_info['step'] = 'convert'
     result = convert_to_txt(file_path, tmp_file_txt, mime_type)
     if result.returncode == 0:
         logger.debug('Conversion to text was successful, checking the result...')
-        with open(tmp_file_txt, 'r') as f:
-            data = f.read()
-        if not re.search('[A-Za-z0-9]+', data):
+        if not any(re.search(b'[A-Za-z0-9]', chunk)
+                   for chunk in iter_file_regions(
+                       tmp_file_txt, isbn_grep_reorder_files=False)):
             logger.debug('The converted txt with size '
                          f'{os.stat(tmp_file_txt).st_size} bytes does not seem '
                          'to contain text')
-            logger.debug(f'First 1000 characters:\n{data[:1000]}')
+            with open(tmp_file_txt, 'r', errors='replace') as f:
+                logger.debug(f'First 1000 characters:\n{f.read(1000)}')
             try_ocr = True
         else:
-            data = reorder_file_content(tmp_file_txt, **func_params)
-            isbns = find_isbns(data, **func_params)
+            isbns = find_isbns_in_file(tmp_file_txt, **func_params)
             if isbns:
                 logger.debug(f"Text output contains ISBNs '{isbns}'")
-            elif ocr_enabled == 'always':
+            elif func_params['ocr_enabled'] == 'always':
                 logger.debug('We will try OCR because the successfully converted '
                              'text did not have any ISBNs')
                 try_ocr = True
@@ -1258,12 +2554,12 @@ def search_file_for_isbns(
         try_ocr = True
 
     # Step 7: OCR the file
-    if not isbns and ocr_enabled and try_ocr:
+    if not isbns and func_params['ocr_enabled'] and try_ocr:
         logger.debug('Trying to run OCR on the file...')
+        search_info['step'] = 'ocr'
         if ocr_file(file_path, tmp_file_txt, mime_type, **func_params) == 0:
             logger.debug('OCR was successful, checking the result...')
-            data = reorder_file_content(tmp_file_txt, **func_params)
-            isbns = find_isbns(data, **func_params)
+            isbns = find_isbns_in_file(tmp_file_txt, **func_params)
             if isbns:
                 logger.debug(f"Text output contains ISBNs {isbns}!")
             else:
@@ -1294,6 +2590,19 @@ def search_meta_val(ebookmeta, key):
     return val
 
 
+# Caches the result of the `fetch-ebook-metadata` command for `ttl` seconds or
+# for `negative_ttl` seconds if no metadata was found
+def set_cached_metadata(cache, cmd, result, ttl=METADATA_CACHE_TTL,
+                        negative_ttl=METADATA_CACHE_NEGATIVE_TTL):
+    if result.returncode == 0 and result.stdout:
+        expire = ttl
+    else:
+        expire = negative_ttl
+    # NOTE: `stderr` (the whole log of the query) is not cached
+    cache.set(f'metadata:{cmd}', Result(result.stdout, '', result.returncode,
+                                        result.args), expire=expire)
+
+
 def skip_file(old_path, new_path):
     # TODO: https://bit.ly/2rf38f5
     old_path = get_parts_from_path(old_path)
@@ -1378,7 +2687,8 @@ def unique_filename(folder_path, basename):
     ext = Path(basename).suffix
     new_path = Path(Path(folder_path).joinpath(basename))
     counter = 0
-    while new_path.is_file():
+    # NOTE: lexists() since broken symlinks also take the filename
+    while os.path.lexists(new_path):
         counter += 1
         logger.debug(f"File '{new_path.name}' already exists in destination "
                      f"'{folder_path}', trying with counter {counter}!")
@@ -19,46 +19,97 @@ References
 .. _organize-ebooks.sh: https://github.com/na--/ebook-tools/blob/master/organize-ebooks.sh
 """
 import os
+import queue
 import re
 import tempfile
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
+from pyebooktools import async_lib
 from pyebooktools.configs import default_config as default_cfg
 from pyebooktools.lib import (check_file_for_corruption, fail_file,
                               fetch_metadata, find_isbns, get_ebook_metadata,
                               get_file_size, get_mime_type, get_pages_in_pdf,
+                              group_isbns,
                               # get_parts_from_path as g,
-                              is_dir_empty,
+                              init_cache, is_dir_empty,
                               move_or_link_ebook_file_and_metadata,
                               move_or_link_file, remove_file, ok_file,
                               search_file_for_isbns, search_meta_val,
                               skip_file, unique_filename)
-from pyebooktools.utils.logutils import init_log
+from pyebooktools.utils.genutils import scan_files
+from pyebooktools.utils.inotify import FolderWatcher
+from pyebooktools.utils.journal import FAIL, OK, SKIP, Journal
+from pyebooktools.utils.logutils import (RecordsCapture, get_logging_levels,
+                                         init_log, replay_records,
+                                         set_logging_levels)
 
 logger = init_log(__name__, __file__)
 
+# Options whose falsy values are valid and thus replace the current ones, see
+# OrganizeEbooks._update()
+_FALSY_OPTIONS = ['sort_window', 'watch_debounce']
+
+
+# State of a file while it goes through the stages of organize
+class _FileJob:
+    def __init__(self, file_path, index=None):
+        self.file_path = file_path
+        # Position of the file in the input; only set if its log records need
+        # to be collected (e.g. pipeline)
+        self.index = index
+        self.done = False
+        self.file_err = ''
+        self.isbns = ''
+        # Function returned by the metadata stage that will move the file
+        self.move = None
+        self.records = []
+        # Outcome of the file: OK, SKIP or FAIL
+        self.status = None
+        self.reason = ''
+        self.new_path = None
+
 
 # TODO: important, do the same for others
 class OrganizeEbooks:
     def __init__(self):
         self.folder_to_organize = None
+        # Opened by organize() if `use_cache` is enabled
+        self.cache = None
+        self.cache_folder = default_cfg.cache_folder
+        self.cache_size_limit = default_cfg.cache_size_limit
+        self.clear_cache = default_cfg.clear_cache
+        self.eviction_policy = default_cfg.eviction_policy
         self.output_folder = default_cfg.organize['output_folder']
         self.output_folder_corrupt = default_cfg.organize['output_folder_corrupt']
         self.output_folder_pamphlets = default_cfg.organize['output_folder_pamphlets']
         self.output_folder_uncertain = default_cfg.organize['output_folder_uncertain']
         self.corruption_check_only = default_cfg.organize['corruption_check_only']
         self.dry_run = default_cfg.dry_run
+        self.epub_convert_method = default_cfg.epub_convert_method
+        self.isbn_archive_scan_workers = default_cfg.isbn_archive_scan_workers
+        self.isbn_archive_scratch_limit = default_cfg.isbn_archive_scratch_limit
         self.isbn_blacklist_regex = default_cfg.isbn_blacklist_regex
         self.isbn_direct_grep_files = default_cfg.isbn_direct_grep_files
+        self.isbn_extract_first_last_pages = default_cfg.isbn_extract_first_last_pages
         self.isbn_grep_reorder_files = default_cfg.isbn_grep_reorder_files
         self.isbn_grep_rf_reverse_last = default_cfg.isbn_grep_rf_reverse_last
         self.isbn_grep_rf_scan_first = default_cfg.isbn_grep_rf_scan_first
         self.isbn_ignored_files = default_cfg.isbn_ignored_files
         self.isbn_metadata_fetch_order = default_cfg.isbn_metadata_fetch_order
+        self.isbn_metadata_fetch_race = default_cfg.isbn_metadata_fetch_race
         self.isbn_regex = default_cfg.isbn_regex
         self.isbn_ret_separator = default_cfg.isbn_ret_separator
+        self.isbn_stop_after = default_cfg.isbn_stop_after
+        self.jobs = default_cfg.organize['jobs']
+        self.journal = default_cfg.organize['journal']
         self.keep_metadata = default_cfg.keep_metadata
+        self.metadata_cache_negative_ttl = default_cfg.metadata_cache_negative_ttl
+        self.metadata_cache_ttl = default_cfg.metadata_cache_ttl
         self.ocr_command = default_cfg.ocr_command
         self.ocr_enabled = default_cfg.ocr_enabled
         self.ocr_only_first_last_pages = default_cfg.ocr_only_first_last_pages
@@ -70,10 +121,34 @@ class OrganizeEbooks:
         self.pamphlet_included_files = default_cfg.organize['pamphlet_included_files']
         self.pamphlet_max_filesize_kib = default_cfg.organize['pamphlet_max_filesize_kib']
         self.pamphlet_max_pdf_pages = default_cfg.organize['pamphlet_max_pdf_pages']
+        self.pipeline = default_cfg.organize['pipeline']
+        self.pipeline_queue_size = default_cfg.organize['pipeline_queue_size']
+        self.pipeline_workers = default_cfg.organize['pipeline_workers']
+        self.resume = default_cfg.organize['resume']
         self.reverse = default_cfg.reverse
+        self.sort_window = default_cfg.sort_window
         self.symlink_only = default_cfg.symlink_only
         self.tested_archive_extensions = default_cfg.organize['tested_archive_extensions']
+        self.use_cache = default_cfg.use_cache
+        self.watch = default_cfg.organize['watch']
+        self.watch_debounce = default_cfg.organize['watch_debounce']
+        self.watch_ignored_files = default_cfg.organize['watch_ignored_files']
         self.without_isbn_ignore = default_cfg.organize['without_isbn_ignore']
+        self.zip_check_method = default_cfg.organize['zip_check_method']
+        self.zip_check_workers = default_cfg.organize['zip_check_workers']
+        # Opened by organize() if `journal` is set
+        self._journal = None
+        # ISBN -> Future of its lookup, see _lookup_isbn()
+        self._isbn_lookups = {}
+        self._isbn_lookups_lock = threading.Lock()
+
+    def _fail_file(self, job, reason, new_path=None):
+        job.status, job.reason, job.new_path = FAIL, reason, new_path
+        fail_file(job.file_path, reason, new_path)
+
+    def _get_stages(self):
+        return [self._probe_file, self._search_isbns, self._fetch_metadata,
+                self._move_file]
 
     def _is_pamphlet(self, file_path):
         logger.debug(f"Checking whether '{file_path}' looks like a pamphlet...")
@@ -146,8 +221,10 @@ class OrganizeEbooks:
                          '({file_size_KiB} KB), does NOT look like a pamphlet')
             return False
 
-    def _organize_by_filename_and_meta(self, old_path, prev_reason):
-        # TODO: important, return nothing?
+    # Returns the function that will move the file (see _move_file()) or None if
+    # the file was skipped
+    def _organize_by_filename_and_meta(self, job, prev_reason):
+        old_path = job.file_path
         prev_reason = f'{prev_reason}; '
         logger.debug(f"Organizing '{old_path}' by non-ISBN metadata and "
                      "filename...")
@@ -171,8 +248,8 @@ class OrganizeEbooks:
             matches = ';'.join(parts)
             logger.debug('Parts of the filename match the ignore regex: '
                          f'[{matches}]')
-            skip_file(old_path,
-                      f'{prev_reason}File matches the ignore regex ({matches})')
+            self._skip_file(
+                job, f'{prev_reason}File matches the ignore regex ({matches})')
             return
         else:
             logger.debug('File does not match the ignore regex, continuing...')
@@ -180,15 +257,11 @@ class OrganizeEbooks:
         if is_p is True:
             logger.debug(f"File '{old_path}' looks like a pamphlet!")
             if self.output_folder_pamphlets:
-                new_path = unique_filename(self.output_folder_pamphlets,
-                                           os.path.basename(old_path))
-                logger.debug(f"Moving file '{old_path}' to '{new_path}'!")
-                ok_file(old_path, new_path)
-                move_or_link_file(old_path, new_path)
+                return partial(self._move_pamphlet, job)
             else:
                 logger.debug('Output folder for pamphlet files is not set, '
                              'skipping...')
-                skip_file(old_path, 'No pamphlet folder specified')
+                self._skip_file(job, 'No pamphlet folder specified')
             return
         elif is_p is False:
             logger.debug(f"File '{old_path}' doesn't look like a pamphlet")
@@ -196,7 +269,7 @@ class OrganizeEbooks:
             logger.debug(f"Couldn't determine if file '{old_path}' is a pamphlet")
         if not self.output_folder_uncertain:
             # logger.debug('No uncertain folder specified, skipping...')
-            skip_file(old_path, 'No uncertain folder specified')
+            self._skip_file(job, 'No uncertain folder specified')
             return
         result = get_ebook_metadata(old_path)
         if result.stderr:
@@ -232,12 +305,8 @@ class OrganizeEbooks:
                     f.write(f'\nISBN                : {isbn}')
             else:
                 logger.debug(f'No isbn found for file {old_path}')
-            logger.debug(f"Organizing '{old_path}' (with '{tmpmfile}')...")
-            new_path = move_or_link_ebook_file_and_metadata(
-                new_folder=self.output_folder_uncertain,
-                current_ebook_path=old_path,
-                current_metadata_path=tmpmfile, **self.__dict__)
-            ok_file(old_path, new_path)
+            return partial(self._move_ebook_and_metadata, job,
+                           self.output_folder_uncertain, tmpmfile)
 
         title = search_meta_val(ebookmeta, 'Title')
         author = search_meta_val(ebookmeta, 'Author(s)')
@@ -252,200 +321,571 @@ class OrganizeEbooks:
                              f'and author "{author}"...')
                 options = f'--verbose --title="{title}" --author="{author}"'
                 # TODO: check that fetch_metadata() can also return an empty string
-                metadata = fetch_metadata(self.organize_without_isbn_sources,
-                                          options)
+                metadata = self._fetch_online_metadata(
+                    self.organize_without_isbn_sources, options)
                 if metadata.returncode == 0:
                     # TODO: they are writing outside the if, https://bit.ly/2FyIiwh
                     with open(tmpmfile, 'a') as f:
                         # TODO: do we write even if metadata can be empty?
                         # TODO: important, stdout (only one 1 result) or stderr (all results)
                         f.write(metadata.stdout)
-                    finisher('title&author', ebookmeta, metadata.stdout)
-                    return
+                    return finisher('title&author', ebookmeta,
+                                    metadata.stdout)
                 logger.debug(f"Trying to swap places - author '{title}' and "
                              f"title '{author}'...")
                 options = f'--verbose --title="{author}" --author="{title}"'
-                metadata = fetch_metadata(self.organize_without_isbn_sources,
-                                          options)
+                metadata = self._fetch_online_metadata(
+                    self.organize_without_isbn_sources, options)
                 if metadata.returncode == 0:
                     # TODO: they are writing outside the if, https://bit.ly/2Kt78kX
                     with open(tmpmfile, 'a') as f:
                         # TODO: do we write even if metadata can be empty?
                         f.write(metadata.stdout)
-                    finisher('rev-title&author', ebookmeta, metadata.stdout)
-                    return
+                    return finisher('rev-title&author', ebookmeta,
+                                    metadata.stdout)
                 logger.debug(f'Trying to fetch metadata only by title {title}...')
                 options = f'--verbose --title="{title}"'
-                metadata = fetch_metadata(self.organize_without_isbn_sources,
-                                          options)
+                metadata = self._fetch_online_metadata(
+                    self.organize_without_isbn_sources, options)
                 if metadata.returncode == 0:
                     # TODO: they are writing outside the if, https://bit.ly/2vZeFES
                     with open(tmpmfile, 'a') as f:
                         # TODO: do we write even if metadata can be empty?
                         f.write(metadata.stdout)
-                    finisher('title', ebookmeta, metadata.stdout)
-                    return
+                    return finisher('title', ebookmeta, metadata.stdout)
         # TODO: tokenize basename
         # filename="$(basename "${old_path%.*}" | tokenize)"
         # Ref.: https://bit.ly/2jlyBIR
         filename = os.path.splitext(os.path.basename(old_path))[0]
         logger.debug(f'Trying to fetch metadata only by filename {filename}...')
         options = f'--verbose --title="{filename}"'
-        metadata = fetch_metadata(self.organize_without_isbn_sources, options)
+        metadata = self._fetch_online_metadata(
+            self.organize_without_isbn_sources, options)
         if metadata.returncode == 0:
             # TODO: they are writing outside the if, https://bit.ly/2I3GH6X
             with open(tmpmfile, 'a') as f:
                 # TODO: do we write even if metadata can be empty?
                 f.write(filename)
-            finisher('title', ebookmeta, filename)
-            return
+            return finisher('title', ebookmeta, filename)
         logger.debug('Could not find anything, removing the temp file '
                      f'{tmpmfile}...')
         remove_file(tmpmfile)
-        skip_file(old_path, f'{prev_reason}Insufficient or wrong file '
-                            'name/metadata')
+        self._skip_file(job, f'{prev_reason}Insufficient or wrong file '
+                             'name/metadata')
 
-    def _organize_by_isbns(self, file_path, isbns):
-        # TODO: important, returns nothing?
-        isbn_sources = self.isbn_metadata_fetch_order
-        if not isbn_sources:
-            # NOTE: If you use Calibre versions that are older than 2.84, it's
-            # required to manually set the following option to an empty string.
-            isbn_sources = []
-        for isbn in isbns.split(self.isbn_ret_separator):
+    # Returns the function that will move the file (see _move_file()) or None if
+    # the file was skipped
+    def _organize_by_isbns(self, job):
+        file_path, isbns = job.file_path, job.isbns
+        # The equivalent ISBNs (ISBN-10 and ISBN-13 of a book) are looked up
+        # once with their canonical form (ISBN-13) but the first found form is
+        # saved in the metadata
+        groups = group_isbns(isbns.split(self.isbn_ret_separator))
+        for canonical, (isbn, *_) in groups.items():
+            found = self._lookup_isbn(canonical)
+            if found is None:
+                continue
+            isbn_source, metadata = found
             tmp_file = tempfile.mkstemp(suffix='.txt')[1]
-            logger.debug(f"Trying to fetch metadata for ISBN '{isbn}' into "
-                         f"temp file '{tmp_file}'...")
-
-            # IMPORTANT: as soon as we find metadata from one source, we return
-            for isbn_source in isbn_sources:
-                # Remove whitespaces around the isbn source
-                isbn_source = isbn_source.strip()
-                # Check if there are spaces in the arguments, and if it is the
-                # case enclose the arguments in quotation marks
-                # e.g. WorldCat xISBN --> "WorldCat xISBN"
-                if ' ' in isbn_source:
-                    isbn_source = f'"{isbn_source}"'
-                logger.debug(f"Fetching metadata from '{isbn_source}' sources...")
-                options = f'--verbose --isbn={isbn}'
-                result = fetch_metadata(isbn_source, options)
-                metadata = result.stdout
-                if metadata:
-                    with open(tmp_file, 'w') as f:
-                        f.write(metadata)
-
-                    # TODO: is it necessary to sleep after fetching the
-                    # metadata from online sources like they do? The code is
-                    # run sequentially, so we are executing the rest of the
-                    # code here once fetch_metadata() is done
-                    # Ref.: https://bit.ly/2vV9MfU
-                    time.sleep(0.1)
-                    logger.debug('Successfully fetched metadata')
-                    logger.debug(f'Fetched metadata:{metadata}')
-
-                    logger.debug('Adding additional metadata to the end of the '
-                                 'metadata file...')
-                    more_metadata = 'ISBN                : {}\n' \
-                                    'All found ISBNs     : {}\n' \
-                                    'Old file path       : {}\n' \
-                                    'Metadata source     : {}'.format(
-                        isbn, isbns.replace('\n', ','), file_path, isbn_source)
-                    logger.debug(more_metadata)
-                    with open(tmp_file, 'a') as f:
-                        f.write(more_metadata)
-
-                    logger.debug(f"Organizing '{file_path}' (with {tmp_file})...")
-                    new_path = move_or_link_ebook_file_and_metadata(
-                        new_folder=self.output_folder,
-                        current_ebook_path=file_path,
-                        current_metadata_path=tmp_file, **self.__dict__)
-
-                    ok_file(file_path, new_path)
-                    # NOTE: `tmp_file` was already removed in
-                    # move_or_link_ebook_file_and_metadata()
-                    return
-
-            logger.debug(f'Removing temp file {tmp_file}...')
-            remove_file(tmp_file)
+            logger.debug(f"Saving metadata for ISBN '{isbn}' into temp file "
+                         f"'{tmp_file}'...")
+            with open(tmp_file, 'w') as f:
+                f.write(metadata)
+            logger.debug('Adding additional metadata to the end of the '
+                         'metadata file...')
+            more_metadata = 'ISBN                : {}\n' \
+                            'All found ISBNs     : {}\n' \
+                            'Old file path       : {}\n' \
+                            'Metadata source     : {}'.format(
+                isbn, isbns.replace('\n', ','), file_path, isbn_source)
+            logger.debug(more_metadata)
+            with open(tmp_file, 'a') as f:
+                f.write(more_metadata)
+            # NOTE: `tmp_file` will be removed in
+            # move_or_link_ebook_file_and_metadata()
+            return partial(self._move_ebook_and_metadata, job,
+                           self.output_folder, tmp_file)
 
         if self.organize_without_isbn:
             logger.debug('Could not organize via the found ISBNs, organizing '
                          'by filename and metadata instead...')
-            self._organize_by_filename_and_meta(
-                old_path=file_path,
-                prev_reason=f'Could not fetch metadata for ISBNs {isbns}')
+            return self._organize_by_filename_and_meta(
+                job, prev_reason=f'Could not fetch metadata for ISBNs {isbns}')
         else:
             logger.debug('Organization by filename and metadata is not turned '
                          'on, giving up...')
-            skip_file(file_path, f'Could not fetch metadata for ISBNs {isbns}; '
-                                 f'Non-ISBN organization disabled')
+            self._skip_file(job, f'Could not fetch metadata for ISBNs {isbns}; '
+                                 'Non-ISBN organization disabled')
+
+    # Returns (isbn_source, metadata) from the first source (in
+    # `isbn_metadata_fetch_order`) that has metadata for the ISBN or None
+    def _fetch_isbn_metadata(self, isbn):
+        isbn_sources = self.isbn_metadata_fetch_order
+        if not isbn_sources:
+            # NOTE: If you use Calibre versions that are older than 2.84, it's
+            # required to manually set the following option to an empty string.
+            isbn_sources = []
+        logger.debug(f"Trying to fetch metadata for ISBN '{isbn}'...")
+        # Remove whitespaces around the isbn sources and check if there are
+        # spaces in the arguments, and if it is the case enclose the arguments
+        # in quotation marks, e.g. WorldCat xISBN --> "WorldCat xISBN"
+        isbn_sources = [f'"{s.strip()}"' if ' ' in s.strip() else s.strip()
+                        for s in isbn_sources]
+        options = f'--verbose --isbn={isbn}'
+        if self.isbn_metadata_fetch_race and len(isbn_sources) > 1:
+            if async_lib.can_run_subprocesses():
+                return self._race_isbn_sources(isbn_sources, options)
+            logger.debug('The sources can only be raced from the main thread '
+                         'before Python 3.8, fetching them one by one...')
+        # IMPORTANT: as soon as we find metadata from one source, we return
+        for isbn_source in isbn_sources:
+            logger.debug(f"Fetching metadata from '{isbn_source}' sources...")
+            result = self._fetch_online_metadata(isbn_source, options)
+            metadata = result.stdout
+            if metadata:
+                # TODO: is it necessary to sleep after fetching the
+                # metadata from online sources like they do? The code is
+                # run sequentially, so we are executing the rest of the
+                # code here once fetch_metadata() is done
+                # Ref.: https://bit.ly/2vV9MfU
+                time.sleep(0.1)
+                logger.debug('Successfully fetched metadata')
+                logger.debug(f'Fetched metadata:{metadata}')
+                return isbn_source, metadata
+        return None
+
+    def _end_file(self, job):
+        # NOTE: nothing is recorded with a dry run since no file was moved
+        if self._journal and job.status and not self.dry_run:
+            self._journal.record(job.file_path, job.status, job.reason,
+                                 job.new_path)
+        logger.debug('=====================================================')
+
+    def _fetch_metadata(self, job):
+        if job.file_err:
+            return
+        if job.isbns:
+            logger.debug(f"Organizing '{job.file_path}' by ISBNs\n{job.isbns}")
+            job.move = self._organize_by_isbns(job)
+        else:
+            logger.debug(f"No ISBNs found for '{job.file_path}', organizing by "
+                         'filename and metadata...')
+            job.move = self._organize_by_filename_and_meta(
+                job, prev_reason='No ISBNs found')
+        if job.move is None:
+            job.done = True
+
+    # Fetches the metadata with calibre's `fetch-ebook-metadata` (through the
+    # cache if it is used)
+    def _fetch_online_metadata(self, isbn_sources, options):
+        return fetch_metadata(isbn_sources, options, cache=self.cache,
+                              ttl=self.metadata_cache_ttl,
+                              negative_ttl=self.metadata_cache_negative_ttl)
+
+    # Each ISBN is looked up only once per run: the files with an ISBN that was
+    # already looked up reuse the result, or wait for it if the lookup is still
+    # in progress (e.g. pipeline). See _fetch_isbn_metadata() for the returned
+    # value
+    # NOTE: only the lookups that found metadata are kept, a miss or an error
+    # (e.g. a source that is temporarily down) is retried by the next file with
+    # the ISBN, see `metadata_cache_negative_ttl` for caching the misses
+    # NOTE: with `jobs`, each worker process has its own lookups, i.e. an ISBN
+    # can be looked up once per worker (the cache, if used, is shared)
+    def _lookup_isbn(self, isbn):
+        with self._isbn_lookups_lock:
+            future = self._isbn_lookups.get(isbn)
+            new_lookup = future is None
+            if new_lookup:
+                future = Future()
+                self._isbn_lookups[isbn] = future
+        if not new_lookup:
+            logger.debug(f"ISBN '{isbn}' was already looked up in this run, "
+                         "reusing the result...")
+            return future.result()
+        found = None
+        try:
+            found = self._fetch_isbn_metadata(isbn)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(found)
+        finally:
+            if found is None:
+                with self._isbn_lookups_lock:
+                    del self._isbn_lookups[isbn]
+        return found
+
+    def _move_corrupt_file(self, job):
+        file_path, file_err = job.file_path, job.file_err
+        if self.output_folder_corrupt:
+            new_path = unique_filename(self.output_folder_corrupt,
+                                       file_path.name)
+            new_path = move_or_link_file(file_path, new_path, self.dry_run,
+                                         self.symlink_only)
+            # TODO: do we add the meta extension directly to new_path (which
+            # already has an extension); thus if new_path='/test/path/book.pdf'
+            # then new_metadata_path='/test/path/book.pdf.meta' or should it be
+            # new_metadata_path='/test/path/book.meta'
+            # Ref.: https://bit.ly/2I6K3pW
+            """
+            new_metadata_path = f'{os.path.splitext(new_path)[0]}.' \
+                                f'{self.output_metadata_extension}'
+            """
+            # NOTE: no unique name for matadata path (and other places)
+            new_metadata_path = f'{new_path}.{self.output_metadata_extension}'
+            logger.debug(f'Saving original filename to {new_metadata_path}...')
+            if not self.dry_run:
+                metadata = f'Corruption reason   : {file_err}\n' \
+                           f'Old file path       : {file_path}'
+                with open(new_metadata_path, 'w') as f:
+                    f.write(metadata)
+            self._fail_file(job, f'File is corrupt: {file_err}', new_path)
+        else:
+            logger.debug('Output folder for corrupt files is not set, doing '
+                         'nothing')
+            self._fail_file(job, f'File is corrupt: {file_err}')
+
+    def _move_ebook_and_metadata(self, job, new_folder, metadata_path):
+        logger.debug(f"Organizing '{job.file_path}' (with {metadata_path})...")
+        new_path = move_or_link_ebook_file_and_metadata(
+            new_folder=new_folder, current_ebook_path=job.file_path,
+            current_metadata_path=metadata_path, **self.__dict__)
+        self._ok_file(job, new_path)
+
+    def _move_file(self, job):
+        if job.file_err:
+            self._move_corrupt_file(job)
+        else:
+            job.move()
+        job.done = True
+
+    def _move_pamphlet(self, job):
+        new_path = unique_filename(self.output_folder_pamphlets,
+                                   os.path.basename(job.file_path))
+        logger.debug(f"Moving file '{job.file_path}' to '{new_path}'!")
+        new_path = move_or_link_file(job.file_path, new_path, self.dry_run,
+                                     self.symlink_only)
+        self._ok_file(job, new_path)
+
+    def _ok_file(self, job, new_path):
+        job.status, job.new_path = OK, new_path
+        ok_file(job.file_path, new_path)
 
     def _organize_file(self, file_path):
-        logger.info(f'Processing {Path(file_path).name} ...')
-        file_err = check_file_for_corruption(file_path,
-                                             self.tested_archive_extensions)
-        if file_err:
-            logger.debug(f"File '{file_path}' is corrupt with error: {file_err}")
-            if self.output_folder_corrupt:
-                new_path = unique_filename(self.output_folder_corrupt,
-                                           file_path.name)
-                move_or_link_file(file_path, new_path, self.dry_run,
-                                  self.symlink_only)
-                # TODO: do we add the meta extension directly to new_path (which
-                # already has an extension); thus if new_path='/test/path/book.pdf'
-                # then new_metadata_path='/test/path/book.pdf.meta' or should it be
-                # new_metadata_path='/test/path/book.meta'
-                # Ref.: https://bit.ly/2I6K3pW
-                """
-                new_metadata_path = f'{os.path.splitext(new_path)[0]}.' \
-                                    f'{self.output_metadata_extension}'
-                """
-                # NOTE: no unique name for matadata path (and other places)
-                new_metadata_path = f'{new_path}.{self.output_metadata_extension}'
-                logger.debug(f'Saving original filename to {new_metadata_path}...')
-                if not self.dry_run:
-                    metadata = f'Corruption reason   : {file_err}\n' \
-                               f'Old file path       : {file_path}'
-                    with open(new_metadata_path, 'w') as f:
-                        f.write(metadata)
-                fail_file(file_path, f'File is corrupt: {file_err}', new_path)
-            else:
-                logger.debug('Output folder for corrupt files is not set, doing '
-                             'nothing')
-                fail_file(file_path, f'File is corrupt: {file_err}')
+        job = _FileJob(file_path)
+        self._run_stages(job)
+        self._end_file(job)
+
+    # Organizes the files with a pipeline of stages (see _get_stages()) that
+    # are connected by bounded queues. Each stage has its own pool of worker
+    # threads so that e.g. slow metadata downloads don't stall the ISBN search
+    # of the next files. The log records of each file are collected along the
+    # stages and emitted here, in the same order as the files.
+    # The files go through the last stage (move) one at a time and in the same
+    # order as the files so that the new names (e.g. the numbered duplicates,
+    # see unique_filename()) are the same as when organizing one file at a time
+    def _organize_files_in_pipeline(self, files):
+        stages = self._get_stages()
+        last = len(stages) - 1
+        nb_workers = [int(n) for n in self.pipeline_workers]
+        logger.debug('Organizing files with a pipeline of stages: ' + ', '.join(
+            f'{stage.__name__} ({n} workers)'
+            for stage, n in zip(stages, nb_workers)))
+        queues = [queue.Queue(maxsize=self.pipeline_queue_size)
+                  for _ in stages]
+        done_queue = queue.Queue()
+        # Bounds the number of files in the pipeline (incl. the finished ones
+        # that wait for the previous files to be logged)
+        in_flight = threading.BoundedSemaphore(
+            len(stages) * self.pipeline_queue_size + sum(nb_workers))
+        _records_capture.install()
+        # Files that are ready for the last stage (or done) but wait for the
+        # previous files, by index
+        ready = {}
+        next_ready = 0
+        ready_lock = threading.Lock()
+        # Index of the next file that can go through the last stage
+        next_move = 0
+        move_turn = threading.Condition()
+
+        def put_in_order(job):
+            nonlocal next_ready
+            with ready_lock:
+                ready[job.index] = job
+                while next_ready in ready:
+                    # NOTE: the files that are already done also go through
+                    # the last queue, they keep the turn of the moves
+                    queues[last].put(ready.pop(next_ready))
+                    next_ready += 1
+
+        def move_in_turn(job):
+            nonlocal next_move
+            with move_turn:
+                while next_move != job.index:
+                    move_turn.wait()
+            try:
+                if not job.done:
+                    self._run_stage(stages[last], job)
+            finally:
+                with move_turn:
+                    next_move += 1
+                    move_turn.notify_all()
+
+        def run_stage(i):
+            while True:
+                job = queues[i].get()
+                if job is None:
+                    break
+                if i == last:
+                    move_in_turn(job)
+                    done_queue.put(job)
+                    continue
+                self._run_stage(stages[i], job)
+                if job.done or i + 1 == last:
+                    put_in_order(job)
+                else:
+                    queues[i + 1].put(job)
+
+        threads = []
+        for i, n in enumerate(nb_workers):
+            threads.append([threading.Thread(target=run_stage, args=(i,),
+                                             daemon=True) for _ in range(n)])
+            for thread in threads[-1]:
+                thread.start()
+
+        # Exception raised by `files` in the feeder thread, re-raised once the
+        # files already in the pipeline are organized
+        feed_errors = []
+
+        def feed():
+            try:
+                for index, fp in enumerate(files):
+                    in_flight.acquire()
+                    queues[0].put(_FileJob(fp, index))
+            except Exception as e:
+                feed_errors.append(e)
+            finally:
+                # Stop the stages one after the other
+                for i, stage_threads in enumerate(threads):
+                    for _ in stage_threads:
+                        queues[i].put(None)
+                    for thread in stage_threads:
+                        thread.join()
+                done_queue.put(None)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        finished = {}
+        next_index = 0
+        while True:
+            job = done_queue.get()
+            if job is None:
+                break
+            finished[job.index] = job
+            while next_index in finished:
+                job = finished.pop(next_index)
+                replay_records(job.records)
+                self._end_file(job)
+                in_flight.release()
+                next_index += 1
+        feeder.join()
+        if feed_errors:
+            raise feed_errors[0]
+
+    # Organizes the files with a pool of `self.jobs` worker processes. The log
+    # records of each file are collected by the worker and emitted here, in the
+    # same order as the files
+    def _organize_files_in_parallel(self, files):
+        logger.debug(f'Organizing files with {self.jobs} worker processes...')
+        # Maximum number of files submitted to the pool and not yet logged
+        max_pending = self.jobs * 4
+        pending = deque()
+
+        def end_file(future):
+            job = future.result()
+            replay_records(job.records)
+            self._end_file(job)
+
+        # NOTE: only the config values are sent to the workers, the private
+        # attributes (e.g. the journal) and the cache stay in the main process
+        # and each worker opens its own cache
+        options = {k: v for k, v in self.__dict__.items()
+                   if not k.startswith('_') and k != 'cache'}
+        with ProcessPoolExecutor(
+                max_workers=self.jobs, initializer=_init_worker,
+                initargs=(options, get_logging_levels())) as executor:
+            for fp in files:
+                pending.append(executor.submit(_organize_file_in_worker, fp))
+                if len(pending) >= max_pending:
+                    end_file(pending.popleft())
+            while pending:
+                end_file(pending.popleft())
+
+    def _probe_file(self, job):
+        logger.info(f'Processing {Path(job.file_path).name} ...')
+        job.file_err = check_file_for_corruption(
+            job.file_path, self.tested_archive_extensions,
+            self.zip_check_method, self.zip_check_workers)
+        if job.file_err:
+            logger.debug(f"File '{job.file_path}' is corrupt with error: "
+                         f"{job.file_err}")
         elif self.corruption_check_only:
             logger.debug('We are only checking for corruption, do not continue '
                          'organising...')
-            skip_file(file_path, 'File appears OK')
-        else:
-            # TODO: important, if html has ISBN it will be considered as an ebook
-            # self._is_pamphlet() needs to be called before search...()
-            logger.debug('File passed the corruption test, looking for ISBNs...')
-            logger.debug(f"Searching file '{Path(file_path).name}' for ISBN "
-                         "numbers...")
-            isbns = search_file_for_isbns(file_path, **self.__dict__)
-            if isbns:
-                logger.debug(f"Organizing '{file_path}' by ISBNs\n{isbns}")
-                self._organize_by_isbns(file_path, isbns)
-            elif self.organize_without_isbn:
-                logger.debug(f"No ISBNs found for '{file_path}', organizing by "
-                             'filename and metadata...')
-                self._organize_by_filename_and_meta(
-                    old_path=file_path, prev_reason='No ISBNs found')
+            self._skip_file(job, 'File appears OK')
+            job.done = True
+
+    # Queries all the sources at the same time, see
+    # async_lib.race_fetch_metadata()
+    # NOTE: a new event loop is used for each ISBN since the lookups can be done
+    # by the threads of the pipeline (the number of processes of each tool is
+    # limited across all the loops). Running subprocesses from an event loop
+    # outside of the main thread requires Python 3.8+ (ThreadedChildWatcher),
+    # see async_lib.can_run_subprocesses()
+    def _race_isbn_sources(self, isbn_sources, options):
+        logger.debug(f'Fetching metadata from {isbn_sources} sources at the '
+                     'same time...')
+        found = async_lib.run_until_complete(async_lib.race_fetch_metadata(
+            isbn_sources, options, cache=self.cache,
+            ttl=self.metadata_cache_ttl,
+            negative_ttl=self.metadata_cache_negative_ttl))
+        if found is None:
+            return None
+        isbn_source, result = found
+        logger.debug(f"Successfully fetched metadata from '{isbn_source}'")
+        logger.debug(f'Fetched metadata:{result.stdout}')
+        return isbn_source, result.stdout
+
+    # Runs one stage on the given file and collects the log records emitted by
+    # the current thread if they are being captured (e.g. pipeline)
+    def _run_stage(self, stage, job):
+        capture = job.index is not None
+        if capture:
+            _records_capture.start()
+        try:
+            stage(job)
+        except Exception as e:
+            logger.debug('Traceback:', exc_info=True)
+            self._fail_file(job, f'Unexpected error: {e!r}')
+            job.done = True
+        finally:
+            if capture:
+                job.records.extend(_records_capture.stop())
+
+    def _run_stages(self, job):
+        for stage in self._get_stages():
+            if job.done:
+                break
+            self._run_stage(stage, job)
+
+    def _search_isbns(self, job):
+        if job.file_err:
+            return
+        # TODO: important, if html has ISBN it will be considered as an ebook
+        # self._is_pamphlet() needs to be called before search...()
+        logger.debug('File passed the corruption test, looking for ISBNs...')
+        logger.debug(f"Searching file '{Path(job.file_path).name}' for ISBN "
+                     "numbers...")
+        job.isbns = search_file_for_isbns(job.file_path, **self.__dict__)
+        if not job.isbns and not self.organize_without_isbn:
+            self._skip_file(job,
+                            'No ISBNs found; Non-ISBN organization disabled')
+            job.done = True
+
+    def _skip_file(self, job, reason):
+        job.status, job.reason = SKIP, reason
+        skip_file(job.file_path, reason)
+
+    # Skips the files whose outcome was already recorded in the journal by a
+    # previous run
+    def _skip_journaled_files(self, files):
+        for fp in files:
+            outcome = self._journal.get(fp)
+            if outcome:
+                logger.debug(f"Skipping '{fp}', already processed by a "
+                             f"previous run: {outcome[0]} ({outcome[1]})")
             else:
-                skip_file(file_path,
-                          'No ISBNs found; Non-ISBN organization disabled')
-        logger.debug('=====================================================')
+                yield fp
+
+    # Returns True if the file reported by the watcher has to be organized
+    def _is_new_file(self, file_path):
+        if not file_path.is_file() or file_path.name.startswith('.'):
+            return False
+        if re.search(self.watch_ignored_files, file_path.name.lower()):
+            logger.debug(f"Ignoring '{file_path}', it matches the watch ignore "
+                         "regex")
+            return False
+        # e.g. the output folder is a subfolder of the watched folder
+        # NOTE: only the parent is resolved, a symlink created in an output
+        # folder (see `symlink_only`) points back into the watched folder
+        parent = file_path.parent.resolve()
+        for folder in [self.output_folder, self.output_folder_corrupt,
+                       self.output_folder_pamphlets,
+                       self.output_folder_uncertain]:
+            if not folder:
+                continue
+            folder = Path(folder).resolve()
+            if folder == parent or folder in parent.parents:
+                return False
+        if self.resume and self._journal and self._journal.get(file_path):
+            logger.debug(f"Skipping '{file_path}', already in the journal")
+            return False
+        return True
+
+    def _log_found_files(self, files):
+        nb_files = 0
+        for fp in files:
+            logger.debug(f"{fp.name}")
+            nb_files += 1
+            yield fp
+        if not nb_files:
+            logger.warning('No ebooks found in folder: '
+                           f'{self.folder_to_organize}')
 
     # TODO: important, do the same for others
     def _update(self, **kwargs):
         logger.debug('Updating attributes for organize...')
         for k, v in self.__dict__.items():
             new_val = kwargs.get(k)
-            if new_val and v != new_val:
+            # NOTE: the unset options of the command-line are falsy (e.g. False
+            # or None), only the ones in _FALSY_OPTIONS can be set to 0
+            if k in _FALSY_OPTIONS:
+                is_set = new_val is not None
+            else:
+                is_set = bool(new_val)
+            if is_set and v != new_val:
                 logger.debug(f'{k}: {v} -> {new_val}')
                 self.__setattr__(k, new_val)
 
+    # Organizes the files as soon as they are added to the watched folder. A
+    # file is organized once it hasn't been modified for `watch_debounce`
+    # seconds so that partially written files (e.g. downloads) are left alone
+    def _watch(self, watcher):
+        logger.info(f"Watching '{self.folder_to_organize}' for new files "
+                    "(Ctrl-C to stop)...\n")
+        # File path -> time of its last event
+        pending = {}
+        try:
+            while True:
+                timeout = None
+                if pending:
+                    timeout = max(0, min(pending.values()) + self.watch_debounce
+                                  - time.monotonic())
+                for fp in watcher.read_paths(timeout):
+                    pending[fp] = time.monotonic()
+                now = time.monotonic()
+                ready = [fp for fp, t in pending.items()
+                         if now - t >= self.watch_debounce]
+                for fp in sorted(ready, reverse=self.reverse):
+                    del pending[fp]
+                    if self._is_new_file(Path(fp)):
+                        self._organize_file(Path(fp))
+                if ready and self._journal:
+                    self._journal.commit()
+        except KeyboardInterrupt:
+            logger.info('Stopped watching')
+
     def organize(self, folder_to_organize, **kwargs):
         # TODO: important, factorize (other places, e.g. rename)
         # TODO: important, add red color to error message (other places too)
@@ -454,7 +894,16 @@ class OrganizeEbooks:
             return 1
         self._update(**kwargs)
         self.folder_to_organize = folder_to_organize
-        files = []
+        self._isbn_lookups = {}
+        # NOTE: the folder is watched before being scanned so that no new file
+        # is missed in between
+        watcher = None
+        if self.watch:
+            try:
+                watcher = FolderWatcher(folder_to_organize)
+            except OSError as e:
+                logger.error(f'\nerror: the folder could not be watched: {e}')
+                return 1
         # TODO: important, other places too
         if is_dir_empty(folder_to_organize):
             logger.warning(f'Folder is empty: {folder_to_organize}')
@@ -463,20 +912,86 @@ class OrganizeEbooks:
         else:
             logger.info('')
         logger.debug(f"Recursively scanning '{folder_to_organize}' for files...")
-        for fp in Path(folder_to_organize).rglob('*'):
-            # Ignore directory and hidden files
-            if Path.is_file(fp) and not fp.name.startswith('.'):
-                logger.debug(f"{fp.name}")
-                files.append(fp)
-        if not files:
-            logger.warning(f'No ebooks found in folder: {folder_to_organize}')
-        # TODO: important sort within glob?
-        logger.debug("Files sorted {}".format("in desc" if self.reverse else "in asc"))
-        files.sort(key=lambda x: x.name, reverse=self.reverse)
+        # NOTE: the files are organized while the folder is being scanned. Thus
+        # the output folders are not scanned in case they are within the folder
+        # to organize
+        output_folders = {Path(folder).resolve() for folder in
+                          [self.output_folder, self.output_folder_corrupt,
+                           self.output_folder_pamphlets,
+                           self.output_folder_uncertain] if folder}
+        if Path(folder_to_organize).resolve() in output_folders:
+            # The renamed files would be found again by the scan
+            logger.debug('The folder to organize is also an output folder, '
+                         'scanning it entirely first...')
+            files = list(scan_files(folder_to_organize,
+                                    sort_window=self.sort_window,
+                                    reverse=self.reverse))
+        else:
+            files = scan_files(folder_to_organize,
+                               excluded_folders=output_folders,
+                               sort_window=self.sort_window,
+                               reverse=self.reverse)
+        if self.sort_window > 0:
+            logger.debug("Files sorted {} within windows of {} files".format(
+                "in desc" if self.reverse else "in asc", self.sort_window))
+        files = self._log_found_files(files)
         logger.debug('=====================================================')
-        for fp in files:
-            self._organize_file(fp)
+        if self.journal:
+            self._journal = Journal(self.journal)
+            if self.resume:
+                files = self._skip_journaled_files(files)
+        elif self.resume:
+            logger.warning('No journal specified, there is nothing to resume')
+        # NOTE: only the cache opened here is closed at the end
+        opened_cache = self.use_cache and self.cache is None
+        if opened_cache:
+            self.cache = init_cache(**self.__dict__)
+        # NOTE: the journal and the cache are closed (and thus committed) even
+        # if the run is interrupted (e.g. with Ctrl-C)
+        try:
+            if self.pipeline:
+                self._organize_files_in_pipeline(files)
+            elif self.jobs > 1:
+                self._organize_files_in_parallel(files)
+            else:
+                for fp in files:
+                    self._organize_file(fp)
+            if watcher:
+                self._watch(watcher)
+        finally:
+            if watcher:
+                watcher.close()
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+            if opened_cache and self.cache is not None:
+                self.cache.close()
+                self.cache = None
         return 0
 
-
 organizer = OrganizeEbooks()
+_records_capture = RecordsCapture()
+
+
+def _init_worker(options, logging_levels):
+    # NOTE: with the 'spawn' start method, the worker doesn't inherit the
+    # organizer options nor the logging config
+    organizer.__dict__.update(options)
+    set_logging_levels(logging_levels)
+    if organizer.use_cache:
+        # NOTE: the cache was already cleared (if asked) by the main process
+        organizer.cache = init_cache(**dict(options, clear_cache=False))
+    _records_capture.install()
+
+
+# Returns the job of the file with the log records emitted while organizing it
+def _organize_file_in_worker(file_path):
+    job = _FileJob(file_path)
+    _records_capture.start()
+    try:
+        organizer._run_stages(job)
+    finally:
+        job.records = _records_capture.stop()
+    # NOTE: the job is sent back to the main process and `move` can't be pickled
+    job.move = None
+    return job
@@ -23,26 +23,15 @@ from pyebooktools.configs import default_config as default_cfg
 from pyebooktools.lib import (find_isbns, get_metadata, move_or_link_file,
                               substitute_params, substitute_with_sed,
                               unique_filename)
-from pyebooktools.utils.genutils import copy, remove_accents
+from pyebooktools.utils.genutils import copy, remove_accents, scan_files
 from pyebooktools.utils.logutils import init_log
 
 logger = init_log(__name__, __file__)
 
 
-def rename(calibre_folder, output_folder=default_cfg.rename['output_folder'],
-           dry_run=default_cfg.dry_run,
-           isbn_blacklist_regex=default_cfg.isbn_blacklist_regex,
-           isbn_regex=default_cfg.isbn_regex,
-           output_filename_template=default_cfg.output_filename_template,
-           output_metadata_extension=default_cfg.output_metadata_extension,
-           reverse=default_cfg.reverse, save_metadata=default_cfg.rename['save_metadata'],
-           symlink_only=default_cfg.symlink_only, **kwargs):
-    if calibre_folder is None:
-        logger.error("\nerror: the following arguments are required: calibre_folder")
-        return 1
-    number_ebooks = 0
-    file_paths = []
-    for book_path in Path(calibre_folder).rglob('*'):
+# Yields the book files (with their metadata.opf) found in the calibre library
+def _find_book_files(book_paths):
+    for book_path in book_paths:
         logger.debug(f'Processing {book_path}')
         if book_path.is_dir():
             logger.debug('Rejected! It is a folder')
@@ -74,15 +63,39 @@ def rename(calibre_folder, output_folder=default_cfg.rename['output_folder'],
         logger.debug(f"Found file '{book_path.name}' with metadata.opf "
                      "present")
         logger.debug(f'Full path: {book_path}')
-        number_ebooks += 1
-        file_paths.append((book_path, metadata_path))
-    # TODO: important sort within glob?
-    logger.debug(f"Found {number_ebooks} ebooks with metadata.opf")
-    logger.info("Files sorted {}".format("in desc" if reverse else "in asc"))
-    file_paths.sort(key=lambda paths: paths[0].name, reverse=reverse)
+        yield book_path, metadata_path
+
+
+def rename(calibre_folder, output_folder=default_cfg.rename['output_folder'],
+           dry_run=default_cfg.dry_run,
+           isbn_blacklist_regex=default_cfg.isbn_blacklist_regex,
+           isbn_regex=default_cfg.isbn_regex,
+           output_filename_template=default_cfg.output_filename_template,
+           output_metadata_extension=default_cfg.output_metadata_extension,
+           reverse=default_cfg.reverse, save_metadata=default_cfg.rename['save_metadata'],
+           sort_window=default_cfg.sort_window,
+           symlink_only=default_cfg.symlink_only, **kwargs):
+    if calibre_folder is None:
+        logger.error("\nerror: the following arguments are required: calibre_folder")
+        return 1
+    # NOTE: the books are renamed while the library is being scanned, thus the
+    # output folder is not scanned in case it is within the library
+    output_folders = {Path(output_folder).resolve()}
+    if Path(calibre_folder).resolve() in output_folders:
+        # The renamed files would be found again by the scan
+        book_paths = list(scan_files(calibre_folder, sort_window=sort_window,
+                                     reverse=reverse))
+    else:
+        book_paths = scan_files(calibre_folder, excluded_folders=output_folders,
+                                sort_window=sort_window, reverse=reverse)
+    if sort_window > 0:
+        logger.info("Files sorted {} within windows of {} files".format(
+            "in desc" if reverse else "in asc", sort_window))
+    number_ebooks = 0
     metadata = {'EXT': '', 'TITLE': '', 'AUTHORS': '', 'SERIES': '',
                 'PUBLISHED': '', 'ISBN': ''}
-    for book_path, metadata_path in file_paths:
+    for book_path, metadata_path in _find_book_files(book_paths):
+        number_ebooks += 1
         logger.info(f"Parsing metadata for '{book_path.name}'...")
         logger.debug(f'Full path: {book_path}')
         metadata['EXT'] = book_path.suffix.split('.')[-1]
@@ -132,7 +145,8 @@ def rename(calibre_folder, output_folder=default_cfg.rename['output_folder'],
         new_path = unique_filename(output_folder, new_name)
         logger.info('Saving book file and metadata...')
         logger.debug(f"Moving file to '{new_path}'")
-        move_or_link_file(book_path, new_path, dry_run, symlink_only)
+        new_path = move_or_link_file(book_path, new_path, dry_run,
+                                     symlink_only)
         # TODO: important, book.pdf.meta or book.meta?
         # What if: book.pdf and book.epub
         # case 1: book.pdf.meta and book.epub.meta
@@ -156,4 +170,5 @@ Metadata source     : metadata.opf"""
             copy(metadata_path, new_metadata_path, clobber=False)
         else:
             logger.debug('Metadata was not copied or recreated')
+    logger.debug(f"Found {number_ebooks} ebooks with metadata.opf")
     return 0
@@ -15,7 +15,7 @@ References
 """
 import argparse
 import codecs
-import os
+import shutil
 import sys
 
 import pyebooktools
@@ -37,26 +37,41 @@ logger = init_log(__name__, __file__)
 # Default config values
 # =====================
 # TODO: important, use namespace
+CACHE_FOLDER = default_cfg.cache_folder
 CFG_TYPE = default_cfg.cfg_type
 CORRUPTION_CHECK_ONLY = default_cfg.organize['corruption_check_only']
 CORRUPTION_CHECK_ORDER = default_cfg.organize['corruption_check_order']
 CORRUPTION_FIX_ONLY = default_cfg.fix['corruption_fix_only']
 CORRUPTION_FIX_ORDER = default_cfg.fix['corruption_fix_order']
 FILES_PER_FOLDER = default_cfg.split['files_per_folder']
+FIND_JOBS = default_cfg.find_jobs
 FOLDER_PATTERN = default_cfg.split['folder_pattern']
+JOBS = default_cfg.organize['jobs']
+JOURNAL = default_cfg.organize['journal']
+ISBN_ARCHIVE_SCAN_WORKERS = default_cfg.isbn_archive_scan_workers
+ISBN_ARCHIVE_SCRATCH_LIMIT = default_cfg.isbn_archive_scratch_limit
 ISBN_BLACKLIST_REGEX = default_cfg.isbn_blacklist_regex
+IDENTIFIERS = default_cfg.identifiers
+INPUT_NULL = default_cfg.input_null
 ISBN_DIRECT_GREP_FILES = default_cfg.isbn_direct_grep_files
+ISBN_EXTRACT_FIRST_LAST_PAGES = default_cfg.isbn_extract_first_last_pages
 ISBN_GREP_REORDER_FILES = default_cfg.isbn_grep_reorder_files
 ISBN_IGNORED_FILES = default_cfg.isbn_ignored_files
 ISBN_METADATA_FETCH_ORDER = default_cfg.isbn_metadata_fetch_order
+ISBN_METADATA_FETCH_RACE = default_cfg.isbn_metadata_fetch_race
 ISBN_REGEX = default_cfg.isbn_regex
 ISBN_RET_SEPARATOR = default_cfg.isbn_ret_separator
+ISBN_STOP_AFTER = default_cfg.isbn_stop_after
 LOGGING_FORMATTER = default_cfg.logging_formatter
 LOGGING_LEVEL = default_cfg.logging_level
+METADATA_CACHE_NEGATIVE_TTL = default_cfg.metadata_cache_negative_ttl
+METADATA_CACHE_TTL = default_cfg.metadata_cache_ttl
 PAMPHLET_EXCLUDED_FILES = default_cfg.organize['pamphlet_excluded_files']
 PAMPHLET_INCLUDED_FILES = default_cfg.organize['pamphlet_included_files']
 PAMPHLET_MAX_FILESIZE_KIB = default_cfg.organize['pamphlet_max_filesize_kib']
 PAMPHLET_MAX_PDF_PAGES = default_cfg.organize['pamphlet_max_pdf_pages']
+PIPELINE_QUEUE_SIZE = default_cfg.organize['pipeline_queue_size']
+PIPELINE_WORKERS = default_cfg.organize['pipeline_workers']
 OCR_COMMAND = default_cfg.ocr_command
 OCR_ENABLED = default_cfg.ocr_enabled
 OCR_ONLY_FIRST_LAST_PAGES = default_cfg.ocr_only_first_last_pages
@@ -70,11 +85,15 @@ OUTPUT_FOLDER_PAMPHLETS = default_cfg.organize['output_folder_pamphlets']
 OUTPUT_FOLDER_UNCERTAIN = default_cfg.organize['output_folder_uncertain']
 OUTPUT_METADATA_EXTENSION = default_cfg.output_metadata_extension
 SAVE_METADATA = default_cfg.rename['save_metadata']
+SORT_WINDOW = default_cfg.sort_window
 START_NUMBER = default_cfg.split['start_number']
 TESTED_ARCHIVE_EXTENSIONS = default_cfg.organize['tested_archive_extensions']
 TOKEN_MIN_LENGTH = default_cfg.token_min_length
 TOKENS_TO_IGNORE = default_cfg.tokens_to_ignore
+WATCH_DEBOUNCE = default_cfg.organize['watch_debounce']
 WITHOUT_ISBN_IGNORE = default_cfg.organize['without_isbn_ignore']
+ZIP_CHECK_METHOD = default_cfg.organize['zip_check_method']
+ZIP_CHECK_WORKERS = default_cfg.organize['zip_check_workers']
 
 # ====================
 # Other default values
@@ -84,7 +103,43 @@ MAIN_CFG = 'main'
 _DEFAULT_MSG = ' (default: {})'
 
 
-# Options related to checking for corruption
+# Options related to the cache
+def add_cache_options(parser, remove_opts=None):
+    remove_opts = init_list(remove_opts)
+    parser_cache_group = parser.add_argument_group(
+        title='Options related to caching')
+    if not remove_opts.count('use-cache'):
+        parser_cache_group.add_argument(
+            '--use-cache', dest='use_cache', action='store_true',
+            help='Cache the results of the slow operations (e.g. the ISBNs '
+                 'found in the content of a file) so that they are not redone '
+                 'for unchanged files. Requires the `diskcache` package.')
+    if not remove_opts.count('cache-folder'):
+        parser_cache_group.add_argument(
+            '--cache-folder', dest='cache_folder', metavar='PATH',
+            help='Folder where the cache is saved.'
+                 + _DEFAULT_MSG.format(CACHE_FOLDER))
+    if not remove_opts.count('clear-cache'):
+        parser_cache_group.add_argument(
+            '--clear-cache', dest='clear_cache', action='store_true',
+            help='Clear the cache before using it.')
+    if not remove_opts.count('metadata-cache-ttl'):
+        parser_cache_group.add_argument(
+            '--metadata-cache-ttl', dest='metadata_cache_ttl',
+            type=check_positive, metavar='SECONDS',
+            help='Number of seconds the metadata fetched online is kept in '
+                 'the cache.' + _DEFAULT_MSG.format(METADATA_CACHE_TTL))
+    if not remove_opts.count('metadata-cache-negative-ttl'):
+        parser_cache_group.add_argument(
+            '--metadata-cache-negative-ttl',
+            dest='metadata_cache_negative_ttl', type=check_positive,
+            metavar='SECONDS',
+            help='When no metadata was found online, number of seconds before '
+                 'the same query can be sent again to the same source.'
+                 + _DEFAULT_MSG.format(METADATA_CACHE_NEGATIVE_TTL))
+    return parser_cache_group
+
+
 def add_corruption_options(parser, remove_opts=None, add_as_group=True,
                            organize=True):
     remove_opts = init_list(remove_opts)
@@ -219,6 +274,14 @@ def add_general_options(parser, add_opts=None, remove_opts=None,
             help='If this is enabled, the files will be sorted in reverse (i.e. '
                  'descending) order. By default, they are sorted in ascending '
                  'order.')
+    if checker.check('sort-window'):
+        parser_general_group.add_argument(
+            '--sort-window', dest='sort_window', type=int, metavar='N',
+            help='The files are processed as soon as they are found and are '
+                 'sorted by name only within consecutive windows of N files '
+                 'so that huge folders are never entirely loaded in memory. '
+                 'Set it to 0 to disable the sorting.'
+                 + _DEFAULT_MSG.format(SORT_WINDOW))
     # TODO: important, add color to default values (other places too)
     if checker.check('log-level'):
         parser_general_group.add_argument(
@@ -332,6 +395,43 @@ def add_isbns_options(parser, remove_opts=None):
             overlap. Set it to `False` to disable the functionality and
             `first_lines last_lines` to enable it with the specified values.'''
                  + _DEFAULT_MSG.format(ISBN_GREP_REORDER_FILES))
+    if not remove_opts.count('extract-first-last-pages'):
+        parser_isbns_group.add_argument(
+            "--extract-first-last-pages", dest='isbn_extract_first_last_pages',
+            metavar='PAGES', nargs=2, type=int,
+            help='''Value n m instructs the subcommands to first extract only
+            the text of the first n and last m pages of the pdf and djvu
+            documents (with `pdftotext` and `djvutxt`) when searching for
+            ISBNs. The whole document is converted only if no ISBNs are found
+            in these pages. Set it to `0 0` to always convert the whole
+            document.''' + _DEFAULT_MSG.format(ISBN_EXTRACT_FIRST_LAST_PAGES))
+    if not remove_opts.count('isbn-stop-after'):
+        parser_isbns_group.add_argument(
+            "--isbn-stop-after", dest='isbn_stop_after', type=int, metavar='N',
+            help='''Stop searching the text of a book once N ISBNs are found.
+            The text is read in chunks (in the order given by
+            `--reorder-files-for-grep`) so the rest of a big text is not even
+            read. Set it to 0 to always search the whole text.'''
+                 + _DEFAULT_MSG.format(ISBN_STOP_AFTER))
+    if not remove_opts.count('archive-scan-workers'):
+        parser_isbns_group.add_argument(
+            "--archive-scan-workers", dest='isbn_archive_scan_workers',
+            type=check_positive, metavar='N',
+            help='''Number of threads used for searching the files extracted
+            from an archive (e.g. epub) for ISBNs. The files are searched by
+            likelihood (OPF, copyright/title pages, other text files, then the
+            rest) and the search stops at the first file with ISBNs.'''
+                 + _DEFAULT_MSG.format(ISBN_ARCHIVE_SCAN_WORKERS))
+    if not remove_opts.count('archive-scratch-limit'):
+        parser_isbns_group.add_argument(
+            "--archive-scratch-limit", dest='isbn_archive_scratch_limit',
+            type=int, metavar='MIB',
+            help='''Maximum disk space (in MiB) used at the same time for
+            decompressing the files of an archive that are not text (e.g. a
+            pdf in a rar) before searching them for ISBNs. The archives are
+            never extracted as a whole and their text files are searched as
+            they are decompressed.'''
+                 + _DEFAULT_MSG.format(ISBN_ARCHIVE_SCRATCH_LIMIT))
     if not remove_opts.count('metadata-fetch-order'):
         parser_isbns_group.add_argument(
             "---mfo", "---metadata-fetch-order", nargs='+',
@@ -346,6 +446,15 @@ def add_isbns_options(parser, remove_opts=None):
             Calibre versions that are older than 2.84, it's required to
             manually set this option to an empty string.'''
                  + _DEFAULT_MSG.format(ISBN_METADATA_FETCH_ORDER))
+    if not remove_opts.count('metadata-fetch-race'):
+        parser_isbns_group.add_argument(
+            "--mfr", "--metadata-fetch-race", dest='isbn_metadata_fetch_race',
+            action='store_true',
+            help='''Query all the metadata sources at the same time instead of
+            one after the other. The metadata is still taken from the first
+            source (in the order of `--metadata-fetch-order`) that has it and
+            the queries of the following sources are cancelled as soon as it
+            is found.''' + _DEFAULT_MSG.format(ISBN_METADATA_FETCH_RACE))
     # TODO: return parser for other functions too?
     return parser_isbns_group
 
@@ -559,7 +668,9 @@ def setup_argparser():
         Argument parser.
 
     """
-    width = os.get_terminal_size().columns - 5
+    # NOTE: falls back to 80 columns if the output is not a terminal (e.g.
+    # `ebooktools find -0 | jq`)
+    width = shutil.get_terminal_size().columns - 5
     # Setup the parser
     parser = ArgumentParser(
         description='This program is a Python port of ebook-tools written in '
@@ -600,7 +711,8 @@ def setup_argparser():
         formatter_class=lambda prog: MyFormatter(
             prog, max_help_position=50, width=width))
     add_general_options(parser_edit, remove_opts=['dry-run', 'keep-metadata',
-                                                  'reverse', 'symlink-only'])
+                                                  'reverse', 'sort-window',
+                                                  'symlink-only'])
     parser_edit_group = parser_edit.add_argument_group(
         title='edit options')
     parser_edit_mutual_group = parser_edit_group.add_mutually_exclusive_group()
@@ -635,7 +747,8 @@ def setup_argparser():
         formatter_class=lambda prog: MyFormatter(
             prog, max_help_position=40, width=width))
     add_general_options(parser_convert, remove_opts=['dry-run', 'keep-metadata',
-                                                     'reverse', 'symlink-only'])
+                                                     'reverse', 'sort-window',
+                                                     'symlink-only'])
     add_ocr_options(parser_convert)
     parser_convert_group = parser_convert.add_argument_group(
         title='Input and output options')
@@ -654,26 +767,53 @@ def setup_argparser():
     name_input = 'input_data'
     desc = 'Find valid ISBNs inside a file or in a string if no file was ' \
            'specified. \nSearching for ISBNs in files uses progressively more ' \
-           'resource-intensive methods until some ISBNs are found.'
+           'resource-intensive methods until some ISBNs are found.\nWith ' \
+           'folders, several paths or `-0`, one JSON line is printed per file.'
     parser_find = subparsers.add_parser(
         'find', add_help=False,
-        usage=f'%(prog)s [OPTIONS] {name_input}\n\n{desc}',
+        usage=f'%(prog)s [OPTIONS] [{name_input} ...]\n\n{desc}',
         help='Find valid ISBNs inside a file or in a string.',
         formatter_class=lambda prog: MyFormatter(
             prog, max_help_position=52, width=width))
     add_general_options(parser_find, remove_opts=['dry-run', 'keep-metadata',
-                                                  'reverse', 'symlink-only'])
-    add_isbns_options(parser_find, remove_opts=['metadata-fetch-order'])
+                                                  'reverse', 'sort-window',
+                                                  'symlink-only'])
+    add_isbns_options(parser_find, remove_opts=['metadata-fetch-order',
+                                                'metadata-fetch-race'])
     add_ocr_options(parser_find)
+    add_cache_options(parser_find,
+                      remove_opts=['metadata-cache-ttl',
+                                   'metadata-cache-negative-ttl'])
     parser_find_group = parser_find.add_argument_group(
         title='Find options')
     add_isbn_return_separator(parser_find_group)
+    parser_find_group.add_argument(
+        '--identifiers', dest='identifiers', action='store_true',
+        help='Also find the ISSNs, DOIs and ASINs (e.g. of journals). All the '
+             'identifiers are found in a single pass over the text and are '
+             'shown tagged with their kind, the ISBNs are still returned '
+             'separated by `--isbn-return-separator`. Only the text of a '
+             'file is searched: its metadata, the files inside archives and '
+             'OCR are skipped and the cache is not used. With many files, '
+             'the JSON lines also have the identifiers found.'
+             + _DEFAULT_MSG.format(IDENTIFIERS))
+    parser_find_group.add_argument(
+        '-j', '--jobs', dest='find_jobs', metavar='N', type=check_positive,
+        help='Number of worker processes used for searching many files for '
+             'ISBNs. The JSON lines are printed in the same order as the '
+             'files.' + _DEFAULT_MSG.format(FIND_JOBS))
+    parser_find_group.add_argument(
+        '-0', '--null', dest='input_null', action='store_true',
+        help='Read the NUL-delimited paths of the files to search from stdin, '
+             'e.g. `find . -print0 | ebooktools find -0`.'
+             + _DEFAULT_MSG.format(INPUT_NULL))
     parser_find_input_group = parser_find.add_argument_group(
         title='input argument')
     parser_find_input_group.add_argument(
-        name_input, nargs='?',
+        name_input, nargs='*',
         help='Can either be the path to a file or a string. The input will be '
-             'searched for ISBNs.')
+             'searched for ISBNs. Folders (searched recursively) and several '
+             'paths can also be given.')
     parser_find.set_defaults(func=find_isbns.find)
     # ==========
     # fix-ebooks
@@ -731,6 +871,7 @@ def setup_argparser():
     add_general_options(parser_organize)
     add_isbns_options(parser_organize)
     add_ocr_options(parser_organize)
+    add_cache_options(parser_organize)
     add_non_isbn_options(parser_organize)
     add_input_output_options(parser_organize)
     parser_organize_group = parser_organize.add_argument_group(
@@ -741,12 +882,44 @@ def setup_argparser():
         help='Do not organize or rename files, just check them for corruption '
              '(ex. zero-filled files, corrupt archives or broken .pdf files). '
              'Useful with the `output-folder-corrupt` option.')
+    parser_organize_group.add_argument(
+        '-j', '--jobs', dest='jobs', metavar='N', type=check_positive,
+        help='Number of worker processes used to organize files in parallel. '
+             'The output of each file is still printed in the order in which '
+             'the files are processed. Each worker looks up an ISBN only once '
+             'but the lookups are not shared between the workers: use the '
+             'cache to avoid fetching the metadata of an ISBN again.'
+             + _DEFAULT_MSG.format(JOBS))
+    parser_organize_group.add_argument(
+        '--journal', dest='journal', metavar='PATH',
+        help='SQLite database where the outcome of each file (OK, SKIP or '
+             'FAIL, the reason and the destination) is saved. It is used by '
+             '`--resume` to continue an interrupted run.'
+             + _DEFAULT_MSG.format(JOURNAL))
+    parser_organize_group.add_argument(
+        '--resume', dest='resume', action='store_true',
+        help='Skip the files whose outcome was already saved in the journal '
+             'by a previous run, as long as their size and modification time '
+             'did not change. Requires `--journal`.')
     parser_organize_group.add_argument(
         '--tested-archive-extensions', dest='tested_archive_extensions',
         metavar='REGEX',
         help='A regular expression that specifies which file extensions will '
              'be tested with `7z t` for corruption.'
              + _DEFAULT_MSG.format(TESTED_ARCHIVE_EXTENSIONS))
+    parser_organize_group.add_argument(
+        '--zip-check-method', dest='zip_check_method',
+        choices=['quick', 'crc', '7z'],
+        help='How the zip archives (epub, docx, cbz, ...) with a tested '
+             'extension are checked for corruption: `quick` only checks their '
+             'central directory and local headers, `crc` also decompresses '
+             'each file and checks its CRC (without calling an external tool) '
+             'and `7z` uses `7z t`.' + _DEFAULT_MSG.format(ZIP_CHECK_METHOD))
+    parser_organize_group.add_argument(
+        '--zip-check-workers', dest='zip_check_workers', metavar='N',
+        type=check_positive,
+        help='Number of threads used for checking the CRCs of the files of a '
+             'zip archive.' + _DEFAULT_MSG.format(ZIP_CHECK_WORKERS))
     parser_organize_group.add_argument(
         '--owi', '--organize-without-isbn', dest='organize_without_isbn',
         action="store_true",
@@ -801,6 +974,36 @@ def setup_argparser():
         help='Other files that do not contain valid ISBNs and are below this '
              'size in KBs are considered pamplets/non-ebook documents.'
              + _DEFAULT_MSG.format(PAMPHLET_MAX_FILESIZE_KIB))
+    parser_organize_group.add_argument(
+        '--pipeline', dest='pipeline', action='store_true',
+        help='Organize the files with a pipeline of stages (corruption check, '
+             'ISBN search, metadata fetch and move) connected by bounded '
+             'queues, each stage having its own worker threads. Thus slow '
+             'metadata downloads do not stall the ISBN search of the next '
+             'files. Takes precedence over `--jobs`.')
+    parser_organize_group.add_argument(
+        '--pipeline-workers', dest='pipeline_workers', nargs=4,
+        type=check_positive, metavar='N',
+        help='Number of worker threads for each stage of the pipeline: '
+             'corruption check, ISBN search, metadata fetch and move. The '
+             'files are still moved one at a time and in the same order as '
+             'without the pipeline, e.g. for the numbering of duplicates.'
+             + _DEFAULT_MSG.format(PIPELINE_WORKERS))
+    parser_organize_group.add_argument(
+        '--pipeline-queue-size', dest='pipeline_queue_size',
+        type=check_positive, metavar='SIZE',
+        help='Maximum number of files waiting in the queue of each stage of '
+             'the pipeline.' + _DEFAULT_MSG.format(PIPELINE_QUEUE_SIZE))
+    parser_organize_group.add_argument(
+        '--watch', dest='watch', action='store_true',
+        help='After organizing the folder, keep watching it and organize the '
+             'new files as soon as they are written (Linux only).')
+    parser_organize_group.add_argument(
+        '--watch-debounce', dest='watch_debounce', type=float,
+        metavar='SECONDS',
+        help='With `--watch`, number of seconds a new file must stay '
+             'unmodified before being organized so that partially written '
+             'files are left alone.' + _DEFAULT_MSG.format(WATCH_DEBOUNCE))
     add_isbn_return_separator(parser_organize_group)
     parser_organize_input_output_group = parser_organize.add_argument_group(
         title='Input and output options')
@@ -874,7 +1077,12 @@ def setup_argparser():
     add_isbns_options(parser_rename, remove_opts=['isbn-direct-grep-files',
                                                   'isbn-ignored-files',
                                                   'reorder-files-for-grep',
-                                                  'metadata-fetch-order'])
+                                                  'isbn-stop-after',
+                                                  'archive-scan-workers',
+                                                  'archive-scratch-limit',
+                                                  'extract-first-last-pages',
+                                                  'metadata-fetch-order',
+                                                  'metadata-fetch-race'])
     add_input_output_options(parser_rename)
     parser_rename_group = parser_rename.add_argument_group(
         title='rename options')
@@ -14,12 +14,12 @@ References
 .. _na--: https://github.com/na--
 .. _split-into-folders.sh: https://github.com/na--/ebook-tools/blob/master/split-into-folders.sh
 """
-import math
 import os
+from itertools import islice
 from pathlib import Path
 
 from pyebooktools.configs import default_config as default_cfg
-from pyebooktools.utils.genutils import mkdir, move
+from pyebooktools.utils.genutils import mkdir, move, scan_files
 from pyebooktools.utils.logutils import init_log
 
 logger = init_log(__name__, __file__)
@@ -32,46 +32,42 @@ def split(folder_with_books,
           folder_pattern=default_cfg.split['folder_pattern'],
           output_metadata_extension=default_cfg.output_metadata_extension,
           reverse=default_cfg.reverse,
+          sort_window=default_cfg.sort_window,
           start_number=default_cfg.split['start_number'],
           **kwargs):
-    files = []
-    for fp in Path(folder_with_books).rglob('*'):
-        # File extension
-        ext = fp.suffix.split('.')[-1]
-        # Ignore directory, metadata and hidden files
-        if Path.is_file(fp) and ext != output_metadata_extension and \
-                not fp.name.startswith('.'):
-            # TODO: debug logging
-            # print(fp)
-            files.append(fp)
-        # TODO: debug logging skip directory/file
-    # TODO: important sort within glob?
-    logger.info("Files sorted {}".format("in desc" if reverse else "in asc"))
-    files.sort(key=lambda x: x.name, reverse=reverse)
+    # NOTE: the files are split while the folder is being scanned, thus the
+    # folders created by the splits are not scanned
+    created_folders = set()
+    # Ignore metadata and hidden files
+    files = scan_files(folder_with_books,
+                       excluded_extensions=[output_metadata_extension],
+                       excluded_folders=created_folders,
+                       sort_window=sort_window, reverse=reverse)
+    if sort_window > 0:
+        logger.info("Files sorted {} within windows of {} files".format(
+            "in desc" if reverse else "in asc", sort_window))
     current_folder_num = start_number
-    start_index = 0
     # Get width of zeros for folder format pattern
     left, right = folder_pattern.split('%')[-1].split('d')
     width = int(left) + len(right)
-    total_files = len(files)
-    logger.info(f"Total number of files to be split into folders: {total_files}")
+    total_files = 0
     logger.info(f"Number of files per folder: {files_per_folder}")
-    number_splits = math.ceil(total_files / files_per_folder)
-    logger.info(f"Number of splits: {number_splits}")
     logger.info("Starting splits...")
     while True:
-        if start_index >= len(files):
+        chunk = list(islice(files, files_per_folder))
+        if not chunk:
             # TODO: debug logging
             logger.info(f"End of splits!")
             break
-        chunk = files[start_index:start_index+files_per_folder]
-        start_index += files_per_folder
+        total_files += len(chunk)
         logger.debug(f"Found {len(chunk)} files...")
         current_folder_basename = '{0:0{width}}'.format(
             current_folder_num, width=width)
         current_folder = os.path.join(output_folder, current_folder_basename)
         current_folder_metadata = os.path.join(
             output_folder, current_folder_basename + '.' + output_metadata_extension)
+        created_folders.update([Path(current_folder).resolve(),
+                                Path(current_folder_metadata).resolve()])
         current_folder_num += 1
         if dry_run:
             logger.debug(f"Creating folder '{current_folder}'...")
@@ -101,4 +97,6 @@ def split(folder_with_books,
                     metadata_dest = os.path.join(current_folder_metadata,
                                                  metadata_name)
                     move(metada_file_to_move, metadata_dest, clobber=False)
+    logger.info(f"Total number of files split into folders: {total_files}")
+    logger.info(f"Number of splits: {current_folder_num - start_number}")
     return 0
@@ -187,6 +187,33 @@ def move(src, dst, clobber=True):
         logger.debug("File moved!")
 
 
+# Like move() with `clobber=False` but raises FileExistsError if `dst` already
+# exists, even when another process creates it concurrently. `dst` is claimed
+# atomically with a hard link; if hard links are not supported (e.g. `src` and
+# `dst` are on different filesystems), `dst` is first reserved with an empty
+# file that is then replaced by `src`
+def move_exclusive(src, dst):
+    src = Path(src)
+    dst = Path(dst)
+    logger.debug(f"Moving '{src.name}'...")
+    logger.debug(f"Destination folder path: {dst.parent}")
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError:
+        fd = os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+        try:
+            shutil.move(src, dst)
+        except OSError:
+            os.remove(dst)
+            raise
+    else:
+        os.remove(src)
+    logger.debug("File moved!")
+
+
 def namespace_to_dict(ns):
     namspace_classes = [Namespace, SimpleNamespace]
     # TODO: check why not working anymore
@@ -337,6 +364,64 @@ def run_cmd(cmd):
         return result
 
 
+# Recursively yields the files (as Path objects) found in `folder` while the
+# tree is being scanned, instead of listing the whole tree first like
+# Path.rglob() followed by a sort. Hidden files and the files with an
+# extension in `excluded_extensions` (e.g. metadata files) are skipped, as are
+# the folders in `excluded_folders` (resolved Path objects) which is checked
+# each time a folder is entered (e.g. output folders created within `folder`
+# during the scan).
+# If `sort_window` > 0, the files are sorted by name within consecutive windows
+# of `sort_window` files (0 = no sorting)
+def scan_files(folder, excluded_extensions=(), excluded_folders=(),
+               sort_window=0, reverse=False):
+    files = _scan_files(str(folder), excluded_extensions, excluded_folders)
+    if sort_window <= 0:
+        return files
+    return _sort_in_windows(files, sort_window, reverse)
+
+
+def _scan_files(folder, excluded_extensions, excluded_folders):
+    # NOTE: DirEntry.is_dir() and is_file() use the file type returned when
+    # reading the folder, no additional stat() is needed on most systems
+    folders = [folder]
+    while folders:
+        folder = folders.pop()
+        if excluded_folders and Path(folder).resolve() in excluded_folders:
+            logger.debug(f"Skipping excluded folder '{folder}'")
+            continue
+        try:
+            it = os.scandir(folder)
+        except OSError as e:
+            logger.warning(f"Couldn't scan folder '{folder}': {e}")
+            continue
+        subfolders = []
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(entry.path)
+                elif entry.name.startswith('.') or not entry.is_file():
+                    continue
+                elif os.path.splitext(entry.name)[1][1:] in excluded_extensions:
+                    continue
+                else:
+                    yield Path(entry.path)
+        # Depth-first and in scanning order
+        folders.extend(reversed(subfolders))
+
+
+def _sort_in_windows(files, window, reverse):
+    chunk = []
+    for fp in files:
+        chunk.append(fp)
+        if len(chunk) == window:
+            chunk.sort(key=lambda x: x.name, reverse=reverse)
+            yield from chunk
+            chunk = []
+    chunk.sort(key=lambda x: x.name, reverse=reverse)
+    yield from chunk
+
+
 def setup_log(package=None, configs_dirpath=None, quiet=False, verbose=False,
               logging_level=None, logging_formatter=None, subcommand=None):
     package_path = os.getcwd()
@@ -0,0 +1,121 @@
+"""Minimal wrapper around Linux's inotify API (through ctypes) for watching a
+folder tree for new files
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+from pyebooktools.utils.logutils import init_log
+
+logger = init_log(__name__, __file__)
+
+# Ref.: /usr/include/linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# Files that are written or moved into a folder and new subfolders
+WATCH_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_MODIFY | IN_MOVED_TO | IN_ONLYDIR
+
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len;
+# char name[];}
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        raise OSError('inotify is only available on Linux')
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    return libc
+
+
+class FolderWatcher:
+    # Watches `folder` and all its subfolders (also the ones created later)
+    def __init__(self, folder):
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_init1: {os.strerror(err)}')
+        # Watch descriptor -> watched folder
+        self._folders = {}
+        self.add_folder(folder)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # Adds a watch for the folder and its subfolders. Returns the files already
+    # found in the subfolders (e.g. files written in a new folder before it
+    # was watched)
+    def add_folder(self, folder):
+        files = []
+        for dirpath, dirnames, filenames in os.walk(folder):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath),
+                                              WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    logger.warning('The inotify watch limit has been reached, '
+                                   'see /proc/sys/fs/inotify/max_user_watches')
+                logger.debug(f"Couldn't watch '{dirpath}': {os.strerror(err)}")
+                continue
+            self._folders[wd] = dirpath
+            files.extend(os.path.join(dirpath, f) for f in filenames)
+        return files
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    # Waits at most `timeout` seconds (forever if None) for events and returns
+    # the paths of the files that were written, moved or created in the
+    # watched folders
+    def read_paths(self, timeout=None):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('Too many inotify events, some new files might '
+                               'have been missed')
+                continue
+            folder = self._folders.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._folders[wd]
+                continue
+            if not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    paths.extend(self.add_folder(path))
+            else:
+                paths.append(path)
+        return paths
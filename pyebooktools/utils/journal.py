@@ -0,0 +1,113 @@
+"""Persistent journal of the files processed by a command (e.g. organize)
+
+Each file is identified by its path, size and modification time and its
+outcome (OK, SKIP or FAIL), the reason and the destination are saved in a
+SQLite database so that an interrupted run can be resumed without redoing the
+work already decided.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from pyebooktools.utils.logutils import init_log
+
+logger = init_log(__name__, __file__)
+
+FAIL = 'FAIL'
+OK = 'OK'
+SKIP = 'SKIP'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT,
+    destination TEXT,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (path, size, mtime_ns)
+)
+'''
+
+
+def _get_key(file_path):
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+class Journal:
+    # The outcomes are committed in batches of `commit_every` files. Call
+    # close() (or use the journal as a context manager) so that the last batch
+    # is committed, e.g. when the run is interrupted with Ctrl-C
+    def __init__(self, db_path, commit_every=100):
+        self.db_path = os.path.expanduser(db_path)
+        self.commit_every = commit_every
+        self._nb_uncommitted = 0
+        # The journal can be used by the threads of the pipeline
+        self._lock = threading.Lock()
+        logger.debug(f'Opening journal: {self.db_path}')
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            logger.debug(f'Closing journal ({self._nb_uncommitted} outcomes '
+                         'to commit)')
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._nb_uncommitted = 0
+
+    # Returns the (status, reason, destination) recorded for the file or None
+    # if the file (with its current size and modification time) was not
+    # processed yet
+    def get(self, file_path):
+        try:
+            key = _get_key(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            return self._conn.execute(
+                'SELECT status, reason, destination FROM files '
+                'WHERE path = ? AND size = ? AND mtime_ns = ?', key).fetchone()
+
+    # NOTE: the outcome is recorded after the file has been processed. If the
+    # file was moved, it is recorded with the size and modification time of its
+    # destination (both are preserved by the move)
+    def record(self, file_path, status, reason='', destination=None):
+        try:
+            key = _get_key(file_path)
+        except OSError:
+            if not destination or not os.path.exists(destination):
+                logger.debug(f"Couldn't stat '{file_path}', the outcome is not "
+                             "recorded in the journal")
+                return
+            key = (os.path.abspath(file_path),) + _get_key(destination)[1:]
+        values = key + (status, reason,
+                        str(destination) if destination else None,
+                        time.time())
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                values)
+            self._nb_uncommitted += 1
+            if self._nb_uncommitted >= self.commit_every:
+                self._conn.commit()
+                self._nb_uncommitted = 0
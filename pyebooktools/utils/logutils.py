@@ -1,6 +1,7 @@
 import logging
 import os
 import sys
+import threading
 from logging import NullHandler
 
 
@@ -29,6 +30,17 @@ def get_logger_name(module__name__, module___file__, package_name=None):
     return logger_name
 
 
+# Returns the logging levels of the root logger and of all the loggers created so
+# far, e.g. to pass them to worker processes (which might not inherit the logging
+# config)
+def get_logging_levels():
+    levels = {'': logging.getLogger().level}
+    for name, logger_ in logging.Logger.manager.loggerDict.items():
+        if isinstance(logger_, logging.Logger):
+            levels[name] = logger_.level
+    return levels
+
+
 def init_log(module__name__, module___file__=None, package_name=None):
     if module___file__:
         logger_ = logging.getLogger(get_logger_name(module__name__,
@@ -43,6 +55,13 @@ def init_log(module__name__, module___file__=None, package_name=None):
     return logger_
 
 
+# Sends the log records (e.g. those collected by RecordsCapture) to the handlers
+# of their respective loggers, in the given order
+def replay_records(records):
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+
 # TODO: specify log_dict change inline
 def set_logging_field_width(log_dict, size_longest_name=None):
     if not size_longest_name:
@@ -83,3 +102,48 @@ def set_logging_level(log_dict, handler_names=None, logger_names=None,
                     (k == 'handlers' and name in handler_names) or \
                     (k == 'loggers' and name in logger_names):
                 val['level'] = level
+
+
+def set_logging_levels(levels):
+    for name, level in levels.items():
+        logging.getLogger(name or None).setLevel(level)
+
+
+# Filter that diverts into a buffer the log records emitted by the current thread
+# between start() and stop() instead of letting them reach the handlers. The
+# records returned by stop() can be pickled (e.g. sent back from a worker
+# process) and emitted later with replay_records() so that the log block of
+# each processed file stays together even when files are processed concurrently
+class RecordsCapture(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def filter(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return True
+        # Format the message now since the args might not be picklable
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        records.append(record)
+        return False
+
+    # Adds the filter to the root logger and to all the loggers created so far
+    def install(self):
+        logging.getLogger().addFilter(self)
+        for logger_ in logging.Logger.manager.loggerDict.values():
+            if isinstance(logger_, logging.Logger):
+                logger_.addFilter(self)
+
+    def start(self):
+        self._local.records = []
+
+    def stop(self):
+        records = getattr(self._local, 'records', None)
+        self._local.records = None
+        return records if records is not None else []
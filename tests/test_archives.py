@@ -0,0 +1,143 @@
+import io
+import threading
+import unittest
+from unittest import mock
+
+from pyebooktools import lib
+from pyebooktools.lib import (_parse_7z_listing, _ScratchSpace,
+                              _search_extracted_member)
+
+# Output of `7z l -slt` for a rar archive with a folder, two files (one of
+# them with ' = ' in its name) and a file whose size is unknown
+_7Z_LISTING = """
+7-Zip [64] 16.02 : Copyright (c) 1999-2016 Igor Pavlov : 2016-05-21
+
+Scanning the drive for archives:
+1 file, 52360 bytes (52 KiB)
+
+Listing archive: books.rar
+
+--
+Path = books.rar
+Type = Rar
+Physical Size = 52360
+Solid = -
+Blocks = 3
+Multivolume = -
+Volumes = 1
+
+----------
+Path = books
+Folder = +
+Size = 0
+Packed Size = 0
+Attributes = D...
+Encrypted = -
+
+Path = books/chapter 1.xhtml
+Folder = -
+Size = 5120
+Packed Size = 1200
+Modified = 2020-01-01 00:00:00
+Attributes = A...
+CRC = ABCDEF01
+Encrypted = -
+
+Path = books/a = b.pdf
+Folder = -
+Size = 49152
+Packed Size = 49000
+Attributes = A...
+Encrypted = -
+
+Path = books/cover.jpg
+Folder = -
+Size =
+Packed Size = 0
+Attributes = A...
+Encrypted = -
+"""
+
+
+class Parse7zListingTest(unittest.TestCase):
+    def test_files_with_sizes(self):
+        self.assertEqual(_parse_7z_listing(_7Z_LISTING),
+                         [('books/chapter 1.xhtml', 5120),
+                          ('books/a = b.pdf', 49152),
+                          ('books/cover.jpg', -1)])
+
+    def test_folders_by_attributes(self):
+        # NOTE: 7z archives don't have the Folder property
+        listing = ('Path = book.7z\nType = 7z\n\n----------\n'
+                   'Path = book\nSize = 0\nAttributes = D....\n\n'
+                   'Path = book/book.txt\nSize = 12\nAttributes = A....\n')
+        self.assertEqual(_parse_7z_listing(listing), [('book/book.txt', 12)])
+
+    def test_no_files(self):
+        self.assertEqual(_parse_7z_listing(''), [])
+        self.assertEqual(_parse_7z_listing('Path = empty.7z\n\n----------\n'),
+                         [])
+
+
+class ScratchSpaceTest(unittest.TestCase):
+    def test_take_waits_for_release(self):
+        scratch = _ScratchSpace(10)
+        scratch.take(8)
+        taken = threading.Event()
+
+        def take():
+            scratch.take(5)
+            taken.set()
+
+        thread = threading.Thread(target=take)
+        thread.start()
+        self.assertFalse(taken.wait(0.1))
+        scratch.release(8)
+        self.assertTrue(taken.wait(5))
+        thread.join()
+        self.assertEqual(scratch.available, 5)
+
+    def test_extracted_members_share_the_space(self):
+        scratch = _ScratchSpace(10)
+        # NOTE: more threads than the space can hold at the same time
+        sizes = [6, 7, 10, 3, 6, 4]
+        results = [None] * len(sizes)
+
+        def search(i):
+            results[i] = _search_extracted_member(
+                f'book{i}.pdf', sizes[i],
+                lambda name: io.BytesIO(b'x' * sizes[i]), scratch, {})
+
+        with mock.patch.object(lib, 'search_file_for_isbns',
+                               return_value='9780306406157'):
+            threads = [threading.Thread(target=search, args=(i,))
+                       for i in range(len(sizes))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(results, ['9780306406157'] * len(sizes))
+        self.assertEqual(scratch.available, 10)
+
+    def test_skipped_members(self):
+        scratch = _ScratchSpace(10)
+        with mock.patch.object(lib, 'search_file_for_isbns',
+                               return_value='9780306406157') as search:
+            # Bigger than the limit
+            self.assertEqual(_search_extracted_member(
+                'big.pdf', 11, lambda name: io.BytesIO(b'x' * 11), scratch,
+                {}), '')
+            # Bigger than its listed size
+            self.assertEqual(_search_extracted_member(
+                'bad.pdf', 4, lambda name: io.BytesIO(b'x' * 11), scratch,
+                {}), '')
+            search.assert_not_called()
+            # Unknown size
+            self.assertEqual(_search_extracted_member(
+                'book.pdf', -1, lambda name: io.BytesIO(b'x' * 10), scratch,
+                {}), '9780306406157')
+        self.assertEqual(scratch.available, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
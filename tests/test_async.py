@@ -0,0 +1,138 @@
+import asyncio
+import os
+import stat
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from pyebooktools import async_lib
+from pyebooktools.configs import default_config as default_cfg
+
+# Stub of calibre's `fetch-ebook-metadata`: the answer of each source (i.e.
+# --allowed-plugin) is read from `<source>.out` after waiting `<source>.delay`
+# seconds. The pids of the stub and of its child (the `sleep`) are written in
+# `pids`, the sources that answered in `done`
+_STUB = '''#!/bin/sh
+for arg; do source=${arg#--allowed-plugin=}; done
+dir=$(dirname "$0")
+echo $$ >> "$dir/pids"
+sleep "$(cat "$dir/$source.delay")" &
+echo $! >> "$dir/pids"
+wait
+cat "$dir/$source.out" 2>/dev/null
+echo "$source" >> "$dir/done"
+'''
+
+
+# Returns True if the process is still running (zombies are not)
+def _is_running(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            state = f.read().rsplit(')', 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state not in 'ZX'
+
+
+@unittest.skipUnless(os.path.isdir('/proc'), 'needs /proc to find processes')
+class RaceFetchMetadataTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.stub_dir = self.tmp_dir.name
+        stub_path = os.path.join(self.stub_dir, 'fetch-ebook-metadata')
+        with open(stub_path, 'w') as f:
+            f.write(_STUB)
+        os.chmod(stub_path, os.stat(stub_path).st_mode | stat.S_IEXEC)
+        path = mock.patch.dict(
+            os.environ,
+            PATH=f"{self.stub_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+        path.start()
+        self.addCleanup(path.stop)
+
+    def tearDown(self):
+        async_lib.set_tool_limits(**default_cfg.async_tool_limits)
+        self.tmp_dir.cleanup()
+
+    def _source(self, name, delay, metadata=None):
+        with open(os.path.join(self.stub_dir, f'{name}.delay'), 'w') as f:
+            f.write(str(delay))
+        if metadata:
+            with open(os.path.join(self.stub_dir, f'{name}.out'), 'w') as f:
+                f.write(metadata)
+
+    def _read_lines(self, name):
+        try:
+            with open(os.path.join(self.stub_dir, name)) as f:
+                return f.read().split()
+        except FileNotFoundError:
+            return []
+
+    def _race(self, isbn_sources):
+        start = time.monotonic()
+        race = async_lib.race_fetch_metadata(isbn_sources, '--isbn=123')
+        result = async_lib.run_until_complete(race)
+        return result, time.monotonic() - start
+
+    def _assert_reaped(self):
+        pids = self._read_lines('pids')
+        self.assertTrue(pids)
+        self.assertEqual([pid for pid in pids if _is_running(pid)], [])
+
+    def test_first_source_with_metadata_wins(self):
+        self._source('Empty', 0.1)
+        self._source('Google', 0.3, 'Title : Google\n')
+        self._source('Amazon', 30, 'Title : Amazon\n')
+        result, elapsed = self._race(['Empty', 'Google', 'Amazon'])
+        isbn_source, metadata = result
+        self.assertEqual(isbn_source, 'Google')
+        self.assertEqual(metadata.stdout, 'Title : Google\n')
+        # The slow source is cancelled, its process (and child) killed
+        self.assertLess(elapsed, 10)
+        self.assertEqual(self._read_lines('done'), ['Empty', 'Google'])
+        self._assert_reaped()
+
+    def test_sources_by_priority(self):
+        # NOTE: the first source answers last but has the highest priority
+        self._source('Google', 0.5, 'Title : Google\n')
+        self._source('Amazon', 0, 'Title : Amazon\n')
+        result, _ = self._race(['Google', 'Amazon'])
+        self.assertEqual(result[0], 'Google')
+        self._assert_reaped()
+
+    def test_no_metadata(self):
+        for name in ['Google', 'Amazon']:
+            self._source(name, 0.1)
+        result, _ = self._race(['Google', 'Amazon'])
+        self.assertIsNone(result)
+        self.assertEqual(sorted(self._read_lines('done')),
+                         ['Amazon', 'Google'])
+        self._assert_reaped()
+
+    def test_cancelled_by_timeout(self):
+        self._source('Google', 30, 'Title : Google\n')
+        fetch = async_lib.fetch_metadata('Google', '--isbn=123')
+        with self.assertRaises(asyncio.TimeoutError):
+            async_lib.run_until_complete(asyncio.wait_for(fetch, 0.5))
+        self.assertEqual(self._read_lines('done'), [])
+        self._assert_reaped()
+
+    def test_tool_limits(self):
+        async_lib.set_tool_limits(**{'fetch-ebook-metadata': 1})
+        self._source('Google', 30, 'Title : Google\n')
+        self._source('Empty', 0.3)
+        self._source('Amazon', 0.3, 'Title : Amazon\n')
+        # NOTE: the cancelled process must release the semaphore of the tool,
+        # otherwise the next race waits forever
+        fetch = async_lib.fetch_metadata('Google', '--isbn=123')
+        with self.assertRaises(asyncio.TimeoutError):
+            async_lib.run_until_complete(asyncio.wait_for(fetch, 0.5))
+        result, elapsed = self._race(['Empty', 'Amazon'])
+        self.assertEqual(result[0], 'Amazon')
+        # One process at a time
+        self.assertGreaterEqual(elapsed, 0.6)
+        self._assert_reaped()
+
+
+if __name__ == '__main__':
+    unittest.main()
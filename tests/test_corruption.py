@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+from pyebooktools.lib import check_zip_integrity, triage_file_for_corruption
+
+
+class CheckZipIntegrityTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.zip = os.path.join(self.tmp_dir.name, 'book.cbz')
+        # NOTE: the files are stored so that their data can be corrupted
+        # without breaking the compressed stream
+        with zipfile.ZipFile(self.zip, 'w', zipfile.ZIP_STORED) as zf:
+            zf.writestr('folder/', '')
+            for i in range(4):
+                zf.writestr(f'folder/page{i}.txt',
+                            f'page {i} ISBN 978-0-306-40615-7\n' * 100)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _corrupt_byte(self, data):
+        with open(self.zip, 'r+b') as f:
+            content = f.read()
+            f.seek(content.index(data))
+            f.write(bytes([data[0] ^ 0xFF]))
+
+    def test_valid_zip(self):
+        self.assertEqual(check_zip_integrity(self.zip), '')
+        self.assertEqual(check_zip_integrity(self.zip, workers=1), '')
+
+    def test_bad_crc(self):
+        self._corrupt_byte(b'page 2 ISBN')
+        for workers in [1, 4]:
+            with self.subTest(workers=workers):
+                zip_err = check_zip_integrity(self.zip, workers=workers)
+                self.assertIn('folder/page2.txt', zip_err)
+                self.assertIn('CRC', zip_err)
+        # The local headers and the central directory are fine
+        self.assertEqual(check_zip_integrity(self.zip, crc_check=False), '')
+
+    def test_truncated_zip(self):
+        with open(self.zip, 'r+b') as f:
+            f.truncate(os.path.getsize(self.zip) // 2)
+        self.assertTrue(check_zip_integrity(self.zip, crc_check=False))
+
+    def test_not_a_zip(self):
+        with open(self.zip, 'wb') as f:
+            f.write(b'not a zip archive')
+        self.assertTrue(check_zip_integrity(self.zip))
+
+
+class TriageFileForCorruptionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _triage(self, name, content):
+        file_path = os.path.join(self.tmp_dir.name, name)
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        return triage_file_for_corruption(file_path)
+
+    def _zip(self):
+        zip_path = os.path.join(self.tmp_dir.name, 'archive.zip')
+        with zipfile.ZipFile(zip_path, 'w') as zf:
+            zf.writestr('page1.jpg', b'\xff\xd8' + bytes(100))
+        with open(zip_path, 'rb') as f:
+            return f.read()
+
+    def test_valid_files(self):
+        pdf = (b'%PDF-1.4\n1 0 obj\n<<>>\nendobj\ntrailer\n<<>>\n'
+               b'startxref\n9\n%%EOF\n')
+        files = {
+            'book.pdf': pdf,
+            # NOTE: some pdfs have a junk header or padding after %%EOF
+            'junk.pdf': b'junk\n' + pdf,
+            'padded.pdf': pdf + bytes(4096),
+            'book.epub': self._zip(),
+            'comic.cbz': self._zip(),
+            'zip.cbr': self._zip(),
+            'rar.cbz': b'Rar!\x1a\x07\x00' + bytes(100),
+            'book.mobi': bytes(60) + b'BOOKMOBI' + bytes(100),
+            'palmdoc.mobi': bytes(60) + b'TEXtREAd' + bytes(100),
+            'book.azw3': bytes(60) + b'BOOKMOBI' + bytes(100),
+            'topaz.azw': b'TPZ0' + bytes(100),
+            'book.djvu': b'AT&TFORM' + bytes(100),
+            'book.txt': b'not checked',
+            'no_extension': b'not checked',
+        }
+        for name, content in files.items():
+            with self.subTest(name=name):
+                self.assertEqual(self._triage(name, content), '')
+
+    def test_inconclusive_comic_archives(self):
+        # NOTE: left to `7z t`
+        self.assertEqual(self._triage('comic.cbr', b'unknown format'), '')
+        self.assertEqual(self._triage('comic.CBZ', b'unknown format'), '')
+
+    def test_wrong_magic_numbers(self):
+        for name in ['book.pdf', 'book.epub', 'book.mobi', 'book.azw',
+                     'book.djvu', 'archive.rar']:
+            with self.subTest(name=name):
+                self.assertIn('magic number',
+                              self._triage(name, b'x' * 100))
+
+    def test_truncated_pdf(self):
+        pdf = (b'%PDF-1.4\n1 0 obj\n<<>>\nstream\n' + b'x' * 4096 +
+               b'\nendstream\nendobj\ntrailer\n<<>>\nstartxref\n9\n%%EOF\n')
+        self.assertEqual(self._triage('book.pdf', pdf + bytes(16 * 1024)), '')
+        self.assertIn('truncated', self._triage('book.pdf', pdf[:2048]))
+        # NOTE: the trailer is too far from the end
+        self.assertIn('truncated',
+                      self._triage('book.pdf', pdf + bytes(128 * 1024)))
+
+    def test_truncated_zip(self):
+        content = self._zip()
+        file_err = self._triage('book.epub', content[:len(content) // 2])
+        self.assertIn('end of central directory', file_err)
+
+
+if __name__ == '__main__':
+    unittest.main()
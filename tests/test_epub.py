@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+from pyebooktools.lib import epubtxt, get_epub_spine
+
+_CONTAINER = b"""<?xml version="1.0"?>
+<container version="1.0"
+           xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf"
+              media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>"""
+
+# NOTE: the spine is neither in the order of the manifest nor of the names
+_OPF = b"""<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>
+    <item id="intro" href="text/a%20intro.xhtml"
+          media-type="application/xhtml+xml"/>
+    <item id="ch1" href="text/c.xhtml" media-type="application/xhtml+xml"/>
+    <item id="ch2" href="text/b.xhtml" media-type="application/xhtml+xml"/>
+    <item id="notes" href="../notes.xhtml"
+          media-type="application/xhtml+xml"/>
+    <item id="missing" href="text/missing.xhtml"
+          media-type="application/xhtml+xml"/>
+  </manifest>
+  <spine>
+    <itemref idref="ch1"/>
+    <itemref idref="missing"/>
+    <itemref idref="intro"/>
+    <itemref idref="ch2"/>
+    <itemref idref="notes"/>
+  </spine>
+</package>"""
+
+
+def _xhtml(text):
+    return (f'<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Title'
+            f'</title></head><body><p>{text}</p></body></html>').encode()
+
+
+class EpubtxtTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.epub = os.path.join(self.tmp_dir.name, 'book.epub')
+        self.txt = os.path.join(self.tmp_dir.name, 'book.txt')
+        with zipfile.ZipFile(self.epub, 'w') as zf:
+            zf.writestr('mimetype', 'application/epub+zip')
+            zf.writestr('META-INF/container.xml', _CONTAINER)
+            zf.writestr('OEBPS/content.opf', _OPF)
+            zf.writestr('OEBPS/text/a intro.xhtml', _xhtml('Introduction'))
+            zf.writestr('OEBPS/text/b.xhtml', _xhtml('Chapter two'))
+            zf.writestr('OEBPS/text/c.xhtml', _xhtml('Chapter one'))
+            zf.writestr('notes.xhtml', _xhtml('Notes'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _read_txt(self):
+        with open(self.txt, encoding='utf-8') as f:
+            return f.read()
+
+    def test_spine(self):
+        with zipfile.ZipFile(self.epub) as zf:
+            self.assertEqual(get_epub_spine(zf),
+                             ['OEBPS/text/c.xhtml', 'OEBPS/text/a intro.xhtml',
+                              'OEBPS/text/b.xhtml', 'notes.xhtml'])
+
+    def test_text_in_spine_order(self):
+        result = epubtxt(self.epub, self.txt)
+        self.assertEqual(result.returncode, 0)
+        text = self._read_txt()
+        positions = [text.find(s) for s in ['Chapter one', 'Introduction',
+                                            'Chapter two', 'Notes']]
+        self.assertNotIn(-1, positions)
+        self.assertEqual(positions, sorted(positions))
+        # NOTE: the <head> of the files is not text
+        self.assertNotIn('Title', text)
+
+    def test_first_and_last_spine_items(self):
+        result = epubtxt(self.epub, self.txt, (1, 2))
+        self.assertEqual(result.returncode, 0)
+        text = self._read_txt()
+        self.assertNotIn('Introduction', text)
+        positions = [text.find(s) for s in ['Chapter one', 'Chapter two',
+                                            'Notes']]
+        self.assertNotIn(-1, positions)
+        self.assertEqual(positions, sorted(positions))
+
+    def test_no_spine(self):
+        with zipfile.ZipFile(self.epub, 'w') as zf:
+            zf.writestr('mimetype', 'application/epub+zip')
+        result = epubtxt(self.epub, self.txt)
+        self.assertEqual(result.returncode, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
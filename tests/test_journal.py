@@ -0,0 +1,160 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from pyebooktools import organize_ebooks
+from pyebooktools.lib import Result
+from pyebooktools.organize_ebooks import OrganizeEbooks
+from pyebooktools.utils.journal import FAIL, OK, SKIP, Journal
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'journal.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _make_file(self, name, content='book'):
+        file_path = os.path.join(self.tmp_dir.name, name)
+        with open(file_path, 'w') as f:
+            f.write(content)
+        return file_path
+
+    def test_record_outcomes(self):
+        skipped = self._make_file('skipped.txt')
+        failed = self._make_file('failed.txt')
+        moved = self._make_file('moved.txt')
+        destination = os.path.join(self.tmp_dir.name, 'Author - Title.txt')
+        os.rename(moved, destination)
+        with Journal(self.db_path) as journal:
+            self.assertIsNone(journal.get(skipped))
+            journal.record(skipped, SKIP, 'No ISBNs found')
+            journal.record(failed, FAIL, 'File is corrupt')
+            # The file was moved before its outcome is recorded
+            journal.record(moved, OK, '', destination)
+            self.assertEqual(journal.get(skipped),
+                             (SKIP, 'No ISBNs found', None))
+        # The outcomes are still there once the journal is reopened
+        with Journal(self.db_path) as journal:
+            self.assertEqual(journal.get(skipped),
+                             (SKIP, 'No ISBNs found', None))
+            self.assertEqual(journal.get(failed),
+                             (FAIL, 'File is corrupt', None))
+            # NOTE: a file is only found again if it is put back in place
+            self.assertIsNone(journal.get(moved))
+            os.rename(destination, moved)
+            self.assertEqual(journal.get(moved), (OK, '', destination))
+
+    def test_modified_file_is_not_done(self):
+        file_path = self._make_file('book.txt')
+        with Journal(self.db_path) as journal:
+            journal.record(file_path, SKIP, 'No ISBNs found')
+            self._make_file('book.txt', 'book with more content')
+            self.assertIsNone(journal.get(file_path))
+
+    def test_interrupted_journal(self):
+        paths = [self._make_file(f'book{i}.txt') for i in range(5)]
+        # NOTE: the process is killed before the journal is closed, only the
+        # outcomes of the committed batches are kept
+        code = ('import os, sys\n'
+                'from pyebooktools.utils.journal import SKIP, Journal\n'
+                'journal = Journal(sys.argv[1], commit_every=2)\n'
+                'for path in sys.argv[2:]:\n'
+                '    journal.record(path, SKIP)\n'
+                'os._exit(1)\n')
+        subprocess.run([sys.executable, '-c', code, self.db_path] + paths,
+                       check=False, cwd=os.path.dirname(os.path.dirname(
+                           os.path.abspath(__file__))))
+        with Journal(self.db_path) as journal:
+            self.assertEqual([journal.get(path) is not None
+                              for path in paths],
+                             [True, True, True, True, False])
+
+
+# Stub of calibre's `fetch-ebook-metadata`
+def _fetch_metadata(isbn_sources, options='', cache=None, ttl=None,
+                    negative_ttl=None):
+    return Result(stdout='Title               : Book\n'
+                         'Author(s)           : Author\n', returncode=0)
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_folder = os.path.join(self.tmp_dir.name, 'input')
+        self.output_folder = os.path.join(self.tmp_dir.name, 'output')
+        os.makedirs(self.input_folder)
+        os.makedirs(self.output_folder)
+        # Books with ISBNs (moved) and without ISBNs (skipped, left in place)
+        for i in range(6):
+            content = f'book {i}\n'
+            if i % 2 == 0:
+                content += 'ISBN 978-0-306-40615-7\n'
+            with open(os.path.join(self.input_folder, f'book{i}.txt'),
+                      'w') as f:
+                f.write(content)
+        self.organize_logger = organize_ebooks.logger
+        self.level = self.organize_logger.level
+        self.organize_logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.organize_logger.setLevel(self.level)
+        self.tmp_dir.cleanup()
+
+    # Organizes the input folder and returns the names of the processed files
+    def _organize(self, **options):
+        organizer = OrganizeEbooks()
+        organizer.__dict__.update(
+            isbn_metadata_fetch_race=False, use_cache=False,
+            output_folder=self.output_folder,
+            journal=os.path.join(self.tmp_dir.name, 'journal.db'), **options)
+        with mock.patch.object(organize_ebooks, 'fetch_metadata',
+                               _fetch_metadata), \
+                self.assertLogs(self.organize_logger, logging.INFO) as logs:
+            try:
+                self.assertEqual(organizer.organize(self.input_folder), 0)
+            finally:
+                processed = [record.getMessage().split()[1]
+                             for record in logs.records
+                             if record.getMessage().startswith('Processing')]
+        return processed
+
+    def test_resume_skips_files_already_done(self):
+        self.assertEqual(self._organize(), [f'book{i}.txt' for i in range(6)])
+        self.assertEqual(len(os.listdir(self.output_folder)), 3)
+        # The skipped files are still in the input folder
+        with open(os.path.join(self.input_folder, 'book3.txt'), 'a') as f:
+            f.write('ISBN 978-0-306-40615-7\n')
+        self.assertEqual(self._organize(resume=True), ['book3.txt'])
+        self.assertEqual(len(os.listdir(self.output_folder)), 4)
+        self.assertEqual(self._organize(resume=True), [])
+
+    def test_resume_interrupted_run(self):
+        search_isbns = OrganizeEbooks._search_isbns
+
+        # Interrupts the run (e.g. Ctrl-C) when the 4th file is searched
+        def interrupt(organizer, job):
+            if job.file_path.name == 'book3.txt':
+                raise KeyboardInterrupt
+            search_isbns(organizer, job)
+
+        with mock.patch.object(OrganizeEbooks, '_search_isbns', interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self._organize()
+        # NOTE: the journal is closed (i.e. committed) by the interrupted run
+        self.assertEqual(self._organize(resume=True),
+                         ['book3.txt', 'book4.txt', 'book5.txt'])
+        with Journal(os.path.join(self.tmp_dir.name, 'journal.db')) as journal:
+            self.assertEqual(
+                journal.get(os.path.join(self.input_folder, 'book1.txt'))[0],
+                SKIP)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from pyebooktools import lib, organize_ebooks
+from pyebooktools.lib import Result
+from pyebooktools.organize_ebooks import OrganizeEbooks
+
+_ISBNS = ['9780306406157', '9781861972712', '9780262033848']
+
+
+# Stub of calibre's `fetch-ebook-metadata` that takes a random time to answer
+def _fetch_metadata(isbn_sources, options='', cache=None, ttl=None,
+                    negative_ttl=None):
+    time.sleep(random.uniform(0, 0.05))
+    isbn = re.search('--isbn=([0-9xX]+)', options).group(1)
+    return Result(stdout=f'Title               : Book\n'
+                         f'Author(s)           : Author {isbn[-3:]}\n'
+                         f'Published           : 2000-01-01\n',
+                  returncode=0)
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.handler = _ListHandler()
+        self.loggers = [lib.logger, organize_ebooks.logger]
+        self.levels = [logger.level for logger in self.loggers]
+        for logger in self.loggers:
+            logger.addHandler(self.handler)
+            logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for logger, level in zip(self.loggers, self.levels):
+            logger.removeHandler(self.handler)
+            logger.setLevel(level)
+        self.tmp_dir.cleanup()
+
+    # Creates the files to organize: books with the same ISBNs (i.e. the same
+    # new names), corrupt files with the same name and files without ISBNs
+    def _make_folder(self, name):
+        root = os.path.join(self.tmp_dir.name, name)
+        for i in range(12):
+            folder = os.path.join(root, 'input', f'folder{i:02}')
+            os.makedirs(folder)
+            name_ = 'book.txt'
+            if i % 6 == 4:
+                # NOTE: not the magic number of a pdf
+                name_, content = 'book.pdf', f'corrupt pdf {i}\n'
+            elif i % 6 == 5:
+                content = f'book {i} without ISBN\n'
+            else:
+                content = f'book {i}\nISBN {_ISBNS[i % len(_ISBNS)]}\n'
+            with open(os.path.join(folder, name_), 'w') as f:
+                f.write(content)
+        return root
+
+    # Organizes the folder and returns the log messages and the new name of
+    # each file (by its content)
+    def _organize(self, name, **options):
+        root = self._make_folder(name)
+        organizer = OrganizeEbooks()
+        organizer.__dict__.update(
+            isbn_metadata_fetch_race=False, use_cache=False,
+            output_folder=os.path.join(root, 'output'),
+            output_folder_corrupt=os.path.join(root, 'corrupt'),
+            **options)
+        for folder in ['output', 'corrupt']:
+            os.makedirs(os.path.join(root, folder))
+        del self.handler.messages[:]
+        with mock.patch.object(organize_ebooks, 'fetch_metadata',
+                               _fetch_metadata):
+            self.assertEqual(organizer.organize(os.path.join(root, 'input')),
+                             0)
+        new_names = {}
+        for folder in ['output', 'corrupt']:
+            for name_ in os.listdir(os.path.join(root, folder)):
+                # NOTE: the metadata of the corrupt files has their old path
+                if name_.endswith('.meta'):
+                    continue
+                with open(os.path.join(root, folder, name_)) as f:
+                    new_names.setdefault(f.read(), []).append(
+                        os.path.join(folder, name_))
+        return list(self.handler.messages), new_names
+
+    def test_same_results_as_one_file_at_a_time(self):
+        messages, new_names = self._organize('sequential')
+        # NOTE: many workers for the last stages to shuffle the files
+        p_messages, p_new_names = self._organize(
+            'pipeline', pipeline=True, pipeline_workers=[2, 4, 8, 4],
+            pipeline_queue_size=2)
+        self.assertEqual(p_new_names, new_names)
+        self.assertEqual(p_messages, messages)
+        self.assertEqual(
+            len([m for m in messages if m.startswith('Processing')]), 12)
+
+    def test_duplicates_numbered_in_input_order(self):
+        for run in range(3):
+            messages, _ = self._organize(
+                f'pipeline{run}', pipeline=True,
+                pipeline_workers=[4, 4, 4, 4], pipeline_queue_size=1)
+            # NOTE: the files are logged in the order of the input
+            new_paths = [m.group(1) for m in
+                         (re.search('^TO:\t(.+)$', msg, re.M)
+                          for msg in messages) if m]
+            self.assertEqual(len(new_paths), 10)
+            suffixes = {}
+            for path in new_paths:
+                base, suffix, ext = re.fullmatch(
+                    '(.+?)((?: [0-9]+)?)(\\.[a-z]+)', path).groups()
+                suffixes.setdefault(base + ext, []).append(suffix)
+            self.assertEqual(suffixes['output/Author 157 - Book (2000) '
+                                      f'[{_ISBNS[0]}].txt'],
+                             ['', ' 1', ' 2', ' 3'])
+            self.assertEqual(suffixes['corrupt/book.pdf'], ['', ' 1'])
+            for base, base_suffixes in suffixes.items():
+                self.assertEqual(
+                    base_suffixes,
+                    [f' {i}' if i else '' for i in range(len(base_suffixes))])
+
+
+class UpdateTest(unittest.TestCase):
+    def test_unset_options_are_ignored(self):
+        organizer = OrganizeEbooks()
+        organizer.__dict__.update(dry_run=True, output_folder='output',
+                                  sort_window=10, watch_debounce=5.0)
+        before = dict(organizer.__dict__)
+        # NOTE: the options not given in the command-line are falsy
+        for falsy in [None, False, 0, '', []]:
+            options = {k: falsy for k in before}
+            options.update(sort_window=None, watch_debounce=None)
+            organizer._update(**options)
+            self.assertEqual(organizer.__dict__, before)
+
+    def test_falsy_options(self):
+        organizer = OrganizeEbooks()
+        organizer.__dict__.update(sort_window=10, watch_debounce=5.0)
+        organizer._update(sort_window=0, watch_debounce=0.0)
+        self.assertEqual(organizer.sort_window, 0)
+        self.assertEqual(organizer.watch_debounce, 0.0)
+        organizer._update(sort_window=None, watch_debounce=None)
+        self.assertEqual(organizer.sort_window, 0)
+        self.assertEqual(organizer.watch_debounce, 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pyebooktools import lib
+from pyebooktools.lib import (_cut_chunk, find_isbns_in_chunks,
+                              iter_buffer_regions, iter_stream_regions,
+                              reorder_file_content)
+
+_ISBN_CHARS = b'0123456789xX-'
+
+
+# The reordering of the original reorder_file_content() (that read the whole
+# file as a list of lines): the first lines, the last lines in reverse and then
+# the middle lines
+def _reorder_lines(data, first, last):
+    lines = data.splitlines(True)
+    first_part = lines[:first]
+    del lines[:first]
+    last_part = lines[-last:] if last else []
+    if last_part:
+        del lines[-last:]
+        if not last_part[-1].endswith(b'\n'):
+            # NOTE: unlike the original, the last line isn't joined with the
+            # line before it once reversed
+            last_part[-1] += b'\n'
+        last_part.reverse()
+    return b''.join(first_part + last_part + lines)
+
+
+class _BytesReader:
+    def __init__(self, data, block_size=7):
+        self.data = data
+        self.block_size = block_size
+
+    def read(self, size=-1):
+        # NOTE: returns less than asked, like a decompressing file object
+        block, self.data = self.data[:self.block_size], \
+            self.data[self.block_size:]
+        return block
+
+
+class IterBufferRegionsTest(unittest.TestCase):
+    texts = [
+        b'',
+        b'one line without newline',
+        b'line 1\nline 2\n',
+        b''.join(b'line %d ISBN 978-0-306-40615-%d\n' % (i, i % 10)
+                 for i in range(50)),
+        b''.join(b'line %d\n' % i for i in range(30)) + b'last line',
+        b'\n\n\nblank lines\n\n\n',
+    ]
+
+    def test_regions_match_reordered_lines(self):
+        for data in self.texts:
+            for first, last in [(0, 0), (1, 1), (3, 2), (10, 10), (100, 100)]:
+                with self.subTest(data=data[:20], first=first, last=last):
+                    regions = iter_buffer_regions(
+                        data, isbn_grep_reorder_files=True,
+                        isbn_grep_rf_scan_first=first,
+                        isbn_grep_rf_reverse_last=last)
+                    self.assertEqual(b''.join(regions),
+                                     _reorder_lines(data, first, last))
+
+    def test_regions_without_reordering(self):
+        with mock.patch.object(lib, '_ISBN_CHUNK_SIZE', 16):
+            for data in self.texts:
+                with self.subTest(data=data[:20]):
+                    regions = list(iter_buffer_regions(
+                        data, isbn_grep_reorder_files=False))
+                    self.assertEqual(b''.join(regions), data)
+                    self.assertEqual(
+                        b''.join(iter_stream_regions(_BytesReader(data))),
+                        data)
+
+    def test_reorder_file_content(self):
+        data = self.texts[3]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'book.txt')
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            content = reorder_file_content(
+                file_path, isbn_grep_reorder_files=True,
+                isbn_grep_rf_scan_first=5, isbn_grep_rf_reverse_last=5)
+        self.assertEqual(content, _reorder_lines(data, 5, 5).decode())
+
+
+class CutChunkTest(unittest.TestCase):
+    def test_cut_after_the_last_non_isbn_char(self):
+        self.assertEqual(_cut_chunk(b'ISBN 978-0-306', 0, 14), 5)
+        self.assertEqual(_cut_chunk(b'ISBN 978-0-306 ', 0, 15), 15)
+        self.assertEqual(_cut_chunk(b'ISBN 978-0-306', 0, 4), 4)
+
+    def test_no_cut_in_a_run_of_isbn_chars(self):
+        self.assertEqual(_cut_chunk(b'978-0-306-40615-7', 0, 17), 0)
+        self.assertEqual(_cut_chunk(b'', 0, 0), 0)
+
+    def test_cut_between_start_and_end(self):
+        buf = b'ab 12 cd 34'
+        self.assertEqual(_cut_chunk(buf, 3, 5), 0)
+        self.assertEqual(_cut_chunk(buf, 0, 5), 3)
+        self.assertEqual(_cut_chunk(buf, 4, 11), 9)
+        self.assertEqual(_cut_chunk(buf, 6, 8), 8)
+
+    def test_chunks_never_split_a_run_of_isbn_chars(self):
+        # NOTE: long lines without newlines, with runs of ISBN characters
+        # longer than the chunks
+        data = b' '.join(b'ISBN 978-0-306-40615-7 x' + b'1' * i
+                         for i in range(40))
+        with mock.patch.object(lib, '_ISBN_CHUNK_SIZE', 16):
+            for regions in [
+                    list(iter_buffer_regions(data,
+                                             isbn_grep_reorder_files=False)),
+                    list(iter_stream_regions(_BytesReader(data)))]:
+                self.assertEqual(b''.join(regions), data)
+                for chunk, next_chunk in zip(regions, regions[1:]):
+                    self.assertFalse(chunk[-1] in _ISBN_CHARS
+                                     and next_chunk[0] in _ISBN_CHARS)
+                self.assertEqual(
+                    find_isbns_in_chunks(regions, isbn_stop_after=0),
+                    find_isbns_in_chunks([data], isbn_stop_after=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from pyebooktools.organize_ebooks import OrganizeEbooks
+from pyebooktools.utils.inotify import FolderWatcher
+
+
+# Sends Ctrl-C to the main thread (i.e. stops OrganizeEbooks._watch()) after
+# `delay` seconds
+def _interrupt_after(delay):
+    return threading.Timer(delay, os.kill, (os.getpid(), signal.SIGINT))
+
+
+# Reads the paths reported by the watcher until `nb_paths` are found or
+# `timeout` seconds have passed
+def _read_paths(watcher, nb_paths, timeout=5):
+    paths = []
+    end = time.monotonic() + timeout
+    while len(set(paths)) < nb_paths and time.monotonic() < end:
+        paths.extend(watcher.read_paths(max(0, end - time.monotonic())))
+    return paths
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'),
+                     'inotify is only available on Linux')
+class FolderWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_new_files(self):
+        with FolderWatcher(self.folder) as watcher:
+            self.assertEqual(watcher.read_paths(0), [])
+            file_path = os.path.join(self.folder, 'book.txt')
+            with open(file_path, 'w') as f:
+                f.write('book')
+            moved_path = os.path.join(self.folder, 'moved.txt')
+            with tempfile.NamedTemporaryFile('w', delete=False,
+                                             dir=os.path.dirname(
+                                                 self.folder)) as f:
+                f.write('book')
+            os.rename(f.name, moved_path)
+            self.assertEqual(set(_read_paths(watcher, 2)),
+                             {file_path, moved_path})
+
+    def test_new_subfolders(self):
+        with FolderWatcher(self.folder) as watcher:
+            subfolder = os.path.join(self.folder, 'sub', 'folder')
+            os.makedirs(subfolder)
+            # NOTE: written right away, maybe before the new subfolder is
+            # watched
+            first_path = os.path.join(subfolder, 'first.txt')
+            with open(first_path, 'w') as f:
+                f.write('book')
+            self.assertIn(first_path, _read_paths(watcher, 1))
+            # The new subfolder is watched
+            second_path = os.path.join(subfolder, 'second.txt')
+            with open(second_path, 'w') as f:
+                f.write('book')
+            self.assertIn(second_path, _read_paths(watcher, 1))
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'),
+                     'inotify is only available on Linux')
+class WatchDebounceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp_dir.name, 'input')
+        os.makedirs(self.folder)
+        self.organizer = OrganizeEbooks()
+        self.organizer.__dict__.update(
+            folder_to_organize=self.folder, watch_debounce=0.3,
+            output_folder=os.path.join(self.tmp_dir.name, 'output'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_file_organized_once_it_stops_changing(self):
+        file_path = os.path.join(self.folder, 'book.txt')
+        last_write = []
+        organized = []
+
+        # A slow download: the file is written a bit at a time
+        def write():
+            with open(file_path, 'w') as f:
+                for i in range(5):
+                    # NOTE: before the write, i.e. before its event
+                    last_write[:] = [time.monotonic()]
+                    f.write(f'part {i}\n')
+                    f.flush()
+                    time.sleep(0.1)
+
+        def organize_file(fp):
+            organized.append((fp, time.monotonic()))
+            # Stops watching
+            raise KeyboardInterrupt
+
+        # NOTE: stops the test if the file is never organized
+        guard = _interrupt_after(10)
+        with FolderWatcher(self.folder) as watcher, \
+                mock.patch.object(self.organizer, '_organize_file',
+                                  organize_file):
+            writer = threading.Thread(target=write)
+            writer.start()
+            guard.start()
+            try:
+                self.organizer._watch(watcher)
+            finally:
+                guard.cancel()
+                writer.join()
+        self.assertEqual(len(organized), 1)
+        fp, organized_time = organized[0]
+        self.assertEqual(fp, Path(file_path))
+        self.assertGreaterEqual(organized_time - last_write[0],
+                                self.organizer.watch_debounce)
+        with open(file_path) as f:
+            self.assertEqual(f.read().count('part'), 5)
+
+    def test_ignored_files(self):
+        organized = []
+        with FolderWatcher(self.folder) as watcher, \
+                mock.patch.object(self.organizer, '_organize_file',
+                                  organized.append):
+            for name in ['book.pdf.part', '.hidden.pdf', 'book.pdf']:
+                with open(os.path.join(self.folder, name), 'w') as f:
+                    f.write('book')
+            guard = _interrupt_after(1)
+            guard.start()
+            try:
+                self.organizer._watch(watcher)
+            finally:
+                guard.cancel()
+        self.assertEqual(organized, [Path(self.folder, 'book.pdf')])
+
+
+if __name__ == '__main__':
+    unittest.main()